@@ -0,0 +1,1193 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import bson
+import google_crc32c
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from project6.compression import compressor
+from project6.csv_convert import convert_csv, field_types
+from project6.checkpoint import TailCheckpoint
+from project6.dedup import DedupIndex
+from project6.gcs_compose import encode_crc32c
+from project6.manifest import DAY_MANIFEST
+from project6.geoip import IpLocations
+from project6.serializers import get_serializer
+from project6.export import cast_value, compile_normalizer, normalize_doc, summary_schema
+from project6.metrics import METRICS
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+# One JSON line per suite run, compared with --compare (git-ignored at the repo root)
+BENCH_RESULTS = os.environ.get("BENCH_RESULTS", "benchmark_results.jsonl")
+# Changes larger than this in the wrong direction are flagged
+REGRESSION_THRESHOLD = 0.10
+
+# -----------------------------------------------------------
+# Sample documents
+# -----------------------------------------------------------
+def sample_docs():
+    """A few summary events covering the shapes seen in production."""
+    return [
+        {
+            "_id": ObjectId(),
+            "api_version": 1.0,
+            "collection": "view_product_detail",
+            "device_id": "3b8c1a52-58f5-4b8e-a5c1-7a1e2d1c7d2f",
+            "ip": "37.170.17.183",
+            "local_time": "2020-04-01 01:39:33",
+            "current_url": "https://www.glamira.fr/glamira-pendant-viktor.html?alloy=white-585",
+            "referrer_url": "https://www.google.com/",
+            "store_id": "29",
+            "time_stamp": 1585699173,
+            "user_agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 13_3_1 like Mac OS X) AppleWebKit/605.1.15",
+            "product_id": "110474",
+            "option": [
+                {"option_label": "alloy", "option_id": "332", "value_label": "white-585", "value_id": "3358"},
+                {"option_label": "diamond", "option_id": "", "value_label": "", "value_id": ""},
+            ],
+        },
+        {
+            "_id": ObjectId(),
+            "api_version": "1.0",
+            "collection": "checkout_success",
+            "time_stamp": "1585699201",
+            "order_id": 402012,
+            "currency": "€",
+            "is_paypal": 0,
+            "cart_products": [
+                {
+                    "amount": "1",
+                    "currency": "€",
+                    "price": 510.0,
+                    "product_id": "95829",
+                    "option": [
+                        {"option_id": "119", "option_label": "alloy", "value_id": "1094", "value_label": "red-585"},
+                        {"option_id": "x", "raw": "engraving"},
+                    ],
+                },
+                "not a product",
+            ],
+        },
+        {
+            "_id": ObjectId(),
+            "collection": "select_product_option",
+            "time_stamp": 1585699300.5,
+            "recommendation": "false",
+            "recommendation_clicked_position": None,
+            "option": {"alloy": "yellow-375"},
+            "cart_products": None,
+        },
+    ]
+
+# -----------------------------------------------------------
+# Synthetic summary events
+# -----------------------------------------------------------
+# Event mix, roughly as in the glamira summary collection
+EVENT_WEIGHTS = {
+    "view_product_detail": 40,
+    "select_product_option": 20,
+    "select_product_option_quality": 8,
+    "view_listing_page": 12,
+    "add_to_cart_action": 8,
+    "view_shopping_cart": 5,
+    "checkout": 3,
+    "checkout_success": 2,
+    "search_box_action": 2,
+}
+STORES = ["6", "12", "29", "41", "57", "86"]
+CURRENCIES = ["€", "£", "$", "kr", "CHF"]
+ALLOYS = ["white-585", "yellow-375", "red-585", "platin", "silber-925"]
+STONES = ["diamond-Brillant", "sapphire", "ruby", "emerald", "zirconia"]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.149",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 13_3_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko)",
+    "Mozilla/5.0 (Linux; Android 9; SM-G960F) AppleWebKit/537.36 (KHTML, like Gecko) Mobile Safari/537.36",
+]
+# 2020-04-01 00:00:00 UTC, the start of the production data
+START_TS = 1585699200
+
+def _dirty(rng, rate, value, *bad):
+    """`value`, or one of `bad` with probability `rate`."""
+    return rng.choice(bad) if rng.random() < rate else value
+
+def _option(rng, dirty):
+    return {
+        "option_label": rng.choice(["alloy", "diamond", "stone", "finish"]),
+        "option_id": _dirty(rng, dirty, str(rng.randint(1, 400)), "", "x", None),
+        "value_label": rng.choice(ALLOYS + STONES + [""]),
+        "value_id": _dirty(rng, dirty, str(rng.randint(1, 9000)), "", "undefined"),
+    }
+
+def _cart_product(rng, dirty):
+    product = {
+        "amount": rng.choice([1, "1", 2, "2", _dirty(rng, dirty, 1, "1 pcs", "")]),
+        "currency": rng.choice(CURRENCIES),
+        "price": rng.choice([round(rng.uniform(50, 9000), 2), f"{rng.uniform(50, 9000):,.2f}"]),
+        "product_id": rng.choice([rng.randint(10000, 120000), str(rng.randint(10000, 120000))]),
+        "option": [_option(rng, dirty) for _ in range(rng.randint(0, 4))],
+    }
+    if rng.random() < dirty:
+        product["option"].append({"option_id": "x", "raw": "engraving: Forever"})
+    return product
+
+def _object_id(rng, ts, i):
+    # Timestamp, 5 random bytes and a counter, like a real ObjectId,
+    # so ids sort by time and the same seed gives the same ids
+    return ObjectId(struct.pack(">I", ts) + rng.randbytes(5) + struct.pack(">I", i)[1:])
+
+def synthetic_docs(n_docs, seed=0, dirty=0.02):
+    """
+    Yield `n_docs` summary events shaped like production: ObjectId
+    `_id`s in time order, the event mix of EVENT_WEIGHTS, `option`
+    lists (or the occasional dict), `cart_products` with nested option
+    arrays and non-document elements, mixed-type `api_version`,
+    `time_stamp` and ids, and fields outside `summary_schema`.
+
+    About `dirty` of the castable values are junk ("n/a", "", "1 pcs",
+    ...) that casts to null. The same `seed` yields the same documents.
+    """
+    rng = random.Random(seed)
+    events = list(EVENT_WEIGHTS)
+    weights = list(EVENT_WEIGHTS.values())
+    ts = START_TS
+
+    for i in range(n_docs):
+        ts += rng.randint(0, 3)
+        collection = rng.choices(events, weights)[0]
+        store_id = rng.choice(STORES)
+        product_id = str(rng.randint(10000, 120000))
+        doc = {
+            "_id": _object_id(rng, ts, i),
+            "api_version": rng.choice([1.0, "1.0", 1, "1.1", None]),
+            "collection": collection,
+            "device_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "ip": ".".join(str(rng.randint(1, 254)) for _ in range(4)),
+            "local_time": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts)),
+            "current_url": f"https://www.glamira.de/glamira-ring-{product_id}.html?alloy={rng.choice(ALLOYS)}",
+            "referrer_url": rng.choice(["https://www.google.com/", "", "https://www.glamira.de/"]),
+            "resolution": rng.choice(["1920x1080", "375x812", "1366x768"]),
+            "store_id": store_id,
+            "time_stamp": _dirty(rng, dirty, rng.choice([ts, str(ts), ts + 0.5]), "n/a", ""),
+            "user_agent": rng.choice(USER_AGENTS),
+            "user_id_db": rng.choice(["", str(rng.randint(1, 500000))]),
+            # Not in summary_schema, dropped by the projection
+            "tmp_cookie": uuid.UUID(int=rng.getrandbits(128)).hex,
+        }
+        if rng.random() < 0.1:
+            doc["email_address"] = f"user{rng.randint(1, 10**6)}@example.com"
+        if rng.random() < 0.2:
+            doc["utm_source"] = rng.choice(["google", "facebook", "newsletter"])
+            doc["utm_medium"] = rng.choice(["cpc", "email", ""])
+
+        if collection.startswith(("view_product_detail", "select_product_option")):
+            doc["product_id"] = _dirty(rng, dirty, product_id, "undefined", "")
+            if collection == "select_product_option" and rng.random() < 0.1:
+                doc["option"] = {"alloy": rng.choice(ALLOYS)}
+            else:
+                doc["option"] = [_option(rng, dirty) for _ in range(rng.randint(1, 3))]
+            doc["recommendation"] = rng.choice([False, "false", True, "true", 0])
+            doc["recommendation_clicked_position"] = _dirty(
+                rng, dirty, rng.choice([None, rng.randint(1, 12), str(rng.randint(1, 12))]), "n/a"
+            )
+        elif collection == "view_listing_page":
+            doc["cat_id"] = str(rng.randint(1, 3000))
+            doc["collect_id"] = rng.choice(["", str(rng.randint(1, 300))])
+        elif collection == "search_box_action":
+            doc["key_search"] = rng.choice(["ring", "verlobungsring", "halskette", "bague or blanc"])
+        else:
+            doc["currency"] = rng.choice(CURRENCIES)
+            doc["cart_products"] = [_cart_product(rng, dirty) for _ in range(rng.randint(1, 5))]
+            if rng.random() < dirty:
+                doc["cart_products"].append("not a product")
+            if collection == "checkout_success":
+                doc["order_id"] = rng.choice([rng.randint(10**5, 10**6), str(rng.randint(10**5, 10**6))])
+                doc["is_paypal"] = rng.choice([0, 1, "true", "false", None])
+        yield doc
+
+# -----------------------------------------------------------
+# Local Mongo and GCS stand-ins
+# -----------------------------------------------------------
+# Just what the benchmarks drive; the tests have their own doubles
+# (tests/fakes.py) that also check preconditions and checksums.
+class FakeSummaryCollection:
+    """
+    Stand-in for the summary collection. Cursors generate synthetic
+    docs a batch at a time and hand them out decoded from BSON, as a
+    real cursor does (as RawBSONDocument with `raw_bson`), projected
+    like the server would. Time spent generating and encoding is kept
+    in `source_seconds` so it can be left out of the export's rate.
+    Each batch takes `latency` more seconds, like a far server's round
+    trip. `watch()` replays the same docs as a change stream, and
+    `database.command()` serves the find and getMore commands of a
+    TunableCursor.
+    """
+
+    name = "summary"
+
+    def __init__(self, n_docs, seed=0, raw_bson=False, rate=None, stop=None, linger=0.0, latency=0.0):
+        self.n_docs = n_docs
+        self.seed = seed
+        self.raw_bson = raw_bson
+        self.latency = latency
+        self.codec_options = CodecOptions(document_class=RawBSONDocument if raw_bson else dict)
+        self.database = FakeDatabase(self)
+        self.source_seconds = 0.0
+        # Change streams (see FakeChangeStream)
+        self.rate = rate
+        self.stop = stop
+        self.linger = linger
+        self.streams = []
+
+    def find(self, query=None, projection=None, no_cursor_timeout=False):
+        return FakeCursor(self, projection)
+
+    def watch(self, pipeline=None, resume_after=None, max_await_time_ms=1000, batch_size=None):
+        stream = FakeChangeStream(self, resume_after, max_await_time_ms / 1000)
+        self.streams.append(stream)
+        return stream
+
+    def next_batch(self, docs, projection, batch_size):
+        """Up to `batch_size` of `docs`, projected and decoded, after `latency`."""
+        start = time.perf_counter()
+        batch = []
+        for doc in docs:
+            if projection:
+                doc = {k: v for k, v in doc.items() if k == "_id" or k in projection}
+            batch.append(bson.encode(doc))
+            if len(batch) >= batch_size:
+                break
+        self.source_seconds += time.perf_counter() - start
+        time.sleep(self.latency)
+        return [RawBSONDocument(data) if self.raw_bson else bson.decode(data) for data in batch]
+
+class FakeSession:
+    def end_session(self):
+        pass
+
+class FakeDatabase:
+    """The find, getMore and killCursors commands over a FakeSummaryCollection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.client = types.SimpleNamespace(start_session=FakeSession)
+        self._cursors = {}
+
+    def command(self, name, value, session=None, codec_options=None, batchSize=None,
+                projection=None, **kwargs):
+        col = self.collection
+        if name == "killCursors":
+            for cursor_id in kwargs["cursors"]:
+                self._cursors.pop(cursor_id, None)
+            return {"ok": 1}
+        if name == "find":
+            cursor_id = len(self._cursors) + 1
+            self._cursors[cursor_id] = (synthetic_docs(col.n_docs, col.seed), projection)
+        else:
+            cursor_id = value
+        docs, projection = self._cursors[cursor_id]
+        batch = col.next_batch(docs, projection, batchSize)
+        if len(batch) < batchSize:
+            del self._cursors[cursor_id]
+            cursor_id = 0
+        key = "firstBatch" if name == "find" else "nextBatch"
+        return {"cursor": {"id": cursor_id, key: batch}, "ok": 1}
+
+class FakeCursor:
+    def __init__(self, collection, projection):
+        self.collection = collection
+        self.projection = projection
+        self._batch_size = 1000
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, n):
+        self._batch_size = n
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        col = self.collection
+        docs = synthetic_docs(col.n_docs, col.seed)
+        while True:
+            batch = col.next_batch(docs, self.projection, self._batch_size)
+            if not batch:
+                return
+            yield from batch
+
+class FakeChangeStream:
+    """
+    Simulated change stream of the collection's synthetic docs as
+    inserts, `rate` per second (None: as fast as they are read). Resume
+    tokens are event positions. `try_next()` waits up to `await_seconds`
+    for the next event, like a getMore with max_await_time_ms, and sets
+    the collection's `stop` event once it has been drained for `linger`
+    seconds. `emitted` keeps the time each event was handed out.
+    """
+
+    def __init__(self, collection, resume_after=None, await_seconds=1.0):
+        self.collection = collection
+        self.await_seconds = await_seconds
+        self.position = int(resume_after["_data"], 16) if resume_after else 0
+        self._docs = synthetic_docs(collection.n_docs, collection.seed)
+        for _ in range(self.position):
+            next(self._docs)
+        self._started = time.perf_counter()
+        self._drained_at = None
+        self.emitted = []
+        # Set when an invalidate event closed the stream
+        self.invalidated = False
+
+    @property
+    def resume_token(self):
+        return {"_data": f"{self.position:016x}"}
+
+    @property
+    def alive(self):
+        return not self.invalidated
+
+    def try_next(self):
+        col = self.collection
+        now = time.perf_counter()
+        if col.rate:
+            due = self._started + len(self.emitted) / col.rate
+            if due > now:
+                time.sleep(min(due - now, self.await_seconds))
+                if due > time.perf_counter():
+                    return None
+        doc = next(self._docs, None)
+        if doc is None:
+            self._drained_at = self._drained_at or now
+            if now - self._drained_at >= col.linger and col.stop is not None:
+                col.stop.set()
+            time.sleep(min(self.await_seconds, 0.05))
+            return None
+        self.position += 1
+        self.emitted.append(time.perf_counter())
+        return {"_id": self.resume_token, "operationType": "insert",
+                "fullDocument": bson.decode(bson.encode(doc))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+class FakeBlob:
+    """
+    Object of a FakeBucket. Objects written from memory (day manifests)
+    keep their bytes and real CRC32C; files only their size, with a
+    made-up CRC32C.
+    """
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def size(self):
+        return self.bucket.objects.get(self.name)
+
+    @property
+    def crc32c(self):
+        if self.name in self.bucket.data:
+            return encode_crc32c(google_crc32c.Checksum(self.bucket.data[self.name]))
+        size = self.size
+        return None if size is None else f"fake-{size}"
+
+    @property
+    def generation(self):
+        return self.bucket.generations.get(self.name)
+
+    def reload(self, **kwargs):
+        pass
+
+    def upload_from_filename(self, path, **kwargs):
+        # Read the file as the real client would; only its size and
+        # line count (rows of an uncompressed JSONL shard) are kept
+        size = lines = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                size += len(chunk)
+                lines += chunk.count(b"\n")
+        if self.bucket.bandwidth:
+            time.sleep(size / self.bucket.bandwidth)
+        self.bucket.objects[self.name] = size
+        self.bucket.lines[self.name] = lines
+        self.bucket.finished[self.name] = time.perf_counter()
+
+    def upload_from_string(self, data, **kwargs):
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        self.bucket.objects[self.name] = len(data)
+        self.bucket.data[self.name] = data
+        self.bucket.generations[self.name] = (self.generation or 0) + 1
+
+    def download_as_bytes(self, **kwargs):
+        return self.bucket.data[self.name]
+
+    def open(self, mode="wb", **kwargs):
+        return FakeWriter(self)
+
+    def delete(self, **kwargs):
+        for objects in (self.bucket.objects, self.bucket.lines, self.bucket.finished,
+                        self.bucket.data, self.bucket.generations):
+            objects.pop(self.name, None)
+
+class FakeWriter:
+    def __init__(self, blob):
+        self.blob = blob
+        self.size = 0
+        self.lines = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self.lines += data.count(b"\n")
+
+    def close(self):
+        self.blob.bucket.objects[self.blob.name] = self.size
+        self.blob.bucket.lines[self.blob.name] = self.lines
+        self.blob.bucket.finished[self.blob.name] = time.perf_counter()
+
+class FakeBucket:
+    """
+    Stand-in GCS bucket that records the size of every object written.
+    With `bandwidth`, each upload from a file goes at that many bytes
+    per second, like one slow connection.
+    """
+
+    def __init__(self, bandwidth=None):
+        self.bandwidth = bandwidth
+        self.objects = {}
+        self.lines = {}
+        self.finished = {}
+        # Small objects written from memory (day manifests) and versions
+        self.data = {}
+        self.generations = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix=""):
+        return [FakeBlob(self, name) for name in list(self.objects) if name.startswith(prefix)]
+
+# -----------------------------------------------------------
+# Benchmarks
+# -----------------------------------------------------------
+def best_time(func, repeat=5):
+    """Best wall-clock seconds of `repeat` calls to `func()`."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench(label, func, docs, repeat=5, unit="docs"):
+    """Run `func` over `docs` `repeat` times and print the best docs/sec."""
+    def run():
+        for doc in docs:
+            func(doc)
+    rate = len(docs) / best_time(run, repeat)
+    print(f"{label:<24} {rate:>12,.0f} {unit}/sec")
+    return rate
+
+def bench_normalizer(n_docs=200000):
+    docs = list(synthetic_docs(n_docs))
+    normalize = compile_normalizer(summary_schema)
+
+    for doc in sample_docs() + docs[:1000]:
+        assert json.dumps(normalize(doc)) == json.dumps(normalize_doc(doc, summary_schema))
+
+    before = bench("normalize_doc", lambda d: normalize_doc(d, summary_schema), docs)
+    after = bench("compile_normalizer", normalize, docs)
+    print(f"speedup: {after / before:.2f}x")
+    return {"normalize_doc docs/sec": before, "compile_normalizer docs/sec": after}
+
+def bench_cast_value(n_values=200000):
+    """cast_value per BigQuery type on a mix of clean and junk values."""
+    values = {
+        "STRING": ["abc", 12, 1.5, ObjectId(), None, ""],
+        "INTEGER": ["123", 123, 12.0, "n/a", None, ""],
+        "FLOAT": ["12.5", 12, 3.25, "1,234.00", None, ""],
+        "BOOLEAN": ["true", 0, "1", True, "yes", None],
+    }
+    results = {}
+    for field_type, sample in values.items():
+        vals = (sample * (n_values // len(sample) + 1))[:n_values]
+        results[f"cast_value {field_type} values/sec"] = bench(
+            f"cast_value {field_type}", lambda v, t=field_type: cast_value(v, t), vals, unit="values"
+        )
+    return results
+
+def bench_compression(n_docs=200000):
+    """Compare upload bytes and compression throughput per codec."""
+    normalize = compile_normalizer(summary_schema)
+    data = "".join(json.dumps(normalize(doc)) + "\n" for doc in synthetic_docs(n_docs)).encode("utf-8")
+    print(f"{'none':<24} {len(data):>12,} bytes")
+    results = {"none bytes": len(data)}
+
+    for codec in ("gzip", "zstd"):
+        try:
+            comp = compressor(codec)
+        except ImportError:
+            print(f"{codec:<24} {'skipped (not installed)':>12}")
+            continue
+        start = time.perf_counter()
+        size = len(comp.compress(data)) + len(comp.flush())
+        elapsed = time.perf_counter() - start
+        print(f"{codec:<24} {size:>12,} bytes ({size / len(data):.1%}) "
+              f"{len(data) / elapsed / 1e6:>8.1f} MB/s")
+        results[f"{codec} bytes"] = size
+        results[f"{codec} MB/sec"] = len(data) / elapsed / 1e6
+    return results
+
+def bench_serializers(n_rows=200000, batch=10000):
+    """Per-row text writes (the old loop) vs batched byte writes per backend."""
+    normalize = compile_normalizer(summary_schema)
+    rows = [normalize(doc) for doc in synthetic_docs(n_rows)]
+
+    def per_row_text():
+        f_out = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        for row in rows:
+            f_out.write(json.dumps(row) + "\n")
+        f_out.flush()
+
+    def batched(name):
+        serialize = get_serializer(name)
+        def run():
+            f_out = io.BytesIO()
+            for i in range(0, len(rows), batch):
+                f_out.write(serialize(rows[i:i + batch]))
+        return run
+
+    backends = [("per-row json.dumps", per_row_text), ("batched json", batched("json"))]
+    try:
+        backends.append(("batched orjson", batched("orjson")))
+    except ImportError:
+        print(f"{'batched orjson':<24} {'skipped (not installed)':>12}")
+
+    results = {}
+    base = None
+    for label, run in backends:
+        rate = len(rows) / best_time(run)
+        base = base or rate
+        print(f"{label:<24} {rate:>12,.0f} rows/sec ({rate / base:.2f}x)")
+        results[f"{label} rows/sec"] = rate
+    return results
+
+def bench_decode(n_docs=200000):
+    """BSON decode + normalize: full dict decoding vs lazy RawBSONDocument."""
+    normalize = compile_normalizer(summary_schema)
+    raw = [bson.encode(doc) for doc in synthetic_docs(n_docs)]
+
+    before = bench("bson.decode", lambda b: normalize(bson.decode(b)), raw)
+    after = bench("RawBSONDocument", lambda b: normalize(RawBSONDocument(b)), raw)
+    print(f"speedup: {after / before:.2f}x")
+    return {"bson.decode docs/sec": before, "RawBSONDocument docs/sec": after}
+
+def write_product_csv(path, n_rows, seed=0):
+    """A CSV shaped like product_info.csv: crawl_product columns, some bad cells."""
+    from project6.load_data import crawl_product_ids_schema
+
+    rng = random.Random(seed)
+    headers = [field.name for field in crawl_product_ids_schema]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for i in range(n_rows):
+            price = f"{rng.uniform(50, 5000):.2f}" if rng.random() > 0.05 else ""
+            writer.writerow([
+                str(100000 + i), f"Glamira Ring {i}", "simple", f"SKU-{i}",
+                price, price, rng.choice([price, "n/a"]), str(rng.randint(0, 50)),
+                str(rng.randint(1, 300)), "Viktor", "rings", "Rings, Engagement",
+                rng.choice(["de", "fr", "it", "uk"]), rng.choice(["", "women", "men"]),
+            ])
+    return crawl_product_ids_schema
+
+def bench_csv(n_rows=200000):
+    """
+    CSV -> JSONL rows/sec on product_info.csv-sized input: the old
+    dict-per-row loop (all strings) vs the typed python and arrow engines.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "product_info.csv")
+        out_path = os.path.join(tmp, "product_info.jsonl")
+        types = field_types(write_product_csv(csv_path, n_rows))
+        print(f"{'input':<24} {os.path.getsize(csv_path):>12,} bytes, {n_rows:,} rows")
+
+        def dict_per_row():
+            serialize = get_serializer("json")
+            with open(csv_path, "r", encoding="utf-8") as f_in, open(out_path, "wb") as f_out:
+                reader = csv.reader(f_in)
+                headers = next(reader)
+                batch = []
+                for row in reader:
+                    batch.append({headers[i]: row[i] for i in range(len(headers))})
+                    if len(batch) >= 50000:
+                        f_out.write(serialize(batch))
+                        batch.clear()
+                f_out.write(serialize(batch))
+
+        def typed(engine, serializer="auto"):
+            return lambda: convert_csv(csv_path, out_path, types, engine=engine, serializer=serializer)
+
+        runs = [
+            ("dict per row (strings)", dict_per_row),
+            ("python + json", typed("python", "json")),
+            ("python + orjson", typed("python", "orjson")),
+            ("arrow (columnar JSONL)", typed("arrow")),
+            ("arrow -> parquet", lambda: convert_csv(csv_path, out_path, types, file_format="parquet")),
+        ]
+
+        results = {}
+        base = None
+        for label, run in runs:
+            try:
+                rate = n_rows / best_time(run, repeat=3)
+            except ImportError:
+                print(f"{label:<24} {'skipped (not installed)':>12}")
+                continue
+            base = base or rate
+            print(f"{label:<24} {rate:>12,.0f} rows/sec ({rate / base:.2f}x)")
+            results[f"{label} rows/sec"] = rate
+        return results
+
+def bench_trigger(n_events=200, client_latency=0.05, get_table_latency=0.03):
+    """
+    Per-request latency and BigQuery API calls of the Cloud Run trigger
+    against a stub client, cold (new client and schema fetch on every
+    request, as before the warm cache) vs warm.
+    """
+    from flask import Flask, request
+    from project6 import trigger_bigquery_test_on_GCP as trigger
+
+    calls = {"client": 0, "get_table": 0, "load": 0}
+
+    class StubJob:
+        job_id = "stub"
+        state = "DONE"
+        output_rows = 1
+        def result(self):
+            return self
+
+    class StubTable:
+        schema = []
+
+    class StubClient:
+        def __init__(self, project=None):
+            calls["client"] += 1
+            time.sleep(client_latency)
+        def get_table(self, table_id):
+            calls["get_table"] += 1
+            time.sleep(get_table_latency)
+            return StubTable()
+        def load_table_from_uri(self, uri, table_id, job_id=None, job_config=None):
+            calls["load"] += 1
+            return StubJob()
+
+    results = {}
+    app = Flask(__name__)
+    real_client = trigger.bigquery.Client
+    trigger.bigquery.Client = StubClient
+    try:
+        for label, cold in (("cold", True), ("warm", False)):
+            calls.update(client=0, get_table=0, load=0)
+            trigger._client = None
+            trigger.invalidate_schema()
+            start = time.perf_counter()
+            for i in range(n_events):
+                if cold:
+                    trigger._client = None
+                    trigger.invalidate_schema()
+                event = {"bucket": "twan_glamira", "name": f"dataset_export/summary/summary_{i:05d}.jsonl.gz"}
+                with app.test_request_context(method="POST", json=event):
+                    trigger.trigger_bigquery_load(request)
+            per_request = (time.perf_counter() - start) / n_events
+            print(f"{label:<24} {per_request * 1000:>9.2f} ms/request | API calls: {calls}")
+            results[f"{label} ms/request"] = per_request * 1000
+    finally:
+        trigger.bigquery.Client = real_client
+        trigger._client = None
+        trigger.invalidate_schema()
+    return results
+
+def bench_dedup(n_ids=1000000, shard=100000):
+    """
+    DedupIndex lookups/sec for new and already exported ids, and its
+    in-memory bytes per id (Bloom filter plus run keys).
+    """
+    rng = random.Random(0)
+    ids = [_object_id(rng, START_TS + i // 100, i) for i in range(2 * n_ids)]
+    with tempfile.TemporaryDirectory() as tmp:
+        index = DedupIndex(tmp, capacity=n_ids)
+        start = time.perf_counter()
+        for i in range(0, n_ids, shard):
+            index.commit(b"".join(oid.binary for oid in ids[i:i + shard]))
+        commit_rate = n_ids / (time.perf_counter() - start)
+        print(f"{'commit':<24} {commit_rate:>12,.0f} ids/sec")
+
+        results = {"commit ids/sec": commit_rate}
+        for label, sample in (("new", ids[n_ids:]), ("exported", ids[:n_ids])):
+            results[f"{label} lookups/sec"] = bench(f"lookup {label}", index.__contains__, sample,
+                                                    repeat=3, unit="ids")
+        memory = len(index.bloom.bits) + sum(len(run.keys) * 45 for run in index.runs)
+        results["memory bytes"] = memory
+        print(f"{'memory':<24} {memory / n_ids:>12.2f} bytes/id "
+              f"({memory / n_ids * 1e9 / 1024 ** 3:.2f} GB per billion ids)")
+        index.close()
+    return results
+
+def write_ip_location_csv(path, n_ips, seed=0):
+    """
+    A CSV shaped like ip_location_results.csv: `n_ips` distinct IPv4
+    addresses, skewed towards a few countries, ~10 regions per country
+    and ~10 cities per region. Returns the addresses written.
+    """
+    rng = random.Random(seed)
+    countries = [f"Country {i}" for i in range(200)]
+    weights = [1 / (i + 1) for i in range(len(countries))]
+    ips = set()
+    while len(ips) < n_ips:
+        ips.add(".".join(str(rng.randint(1, 254)) for _ in range(4)))
+    ips = sorted(ips, key=lambda ip: rng.random())
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ip", "country", "region", "city"])
+        for ip in ips:
+            country = rng.choices(countries, weights)[0]
+            region = f"{country} region {rng.randint(1, 10)}"
+            city = f"{region} city {rng.randint(1, 10)}" if rng.random() > 0.05 else ""
+            writer.writerow([ip, country, region, city])
+    return ips
+
+def _traced(build):
+    """(result of `build()`, bytes it allocated and still holds)."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+def bench_geoip(n_ips=1000000, n_lookups=200000):
+    """
+    IP location lookups/sec and memory per IP: the IpLocations index
+    (sorted packed ints + interned locations) against a dict of ip ->
+    row dict built with csv.DictReader. Lookups are 90% hits.
+    """
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ip_location_results.csv")
+        ips = write_ip_location_csv(path, n_ips)
+        queries = [rng.choice(ips) if rng.random() < 0.9 else f"10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)}"
+                   for _ in range(n_lookups)]
+
+        def dict_per_row():
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                return {row["ip"]: row for row in csv.DictReader(f)}
+
+        results = {}
+        for label, build in (("dict per row", dict_per_row),
+                             ("IpLocations", lambda: IpLocations.from_csv(path))):
+            start = time.perf_counter()
+            build()
+            build_seconds = time.perf_counter() - start
+            index, memory = _traced(build)
+            lookup = index.get if isinstance(index, dict) else index.lookup
+            rate = bench(f"{label} lookup", lookup, queries, repeat=3, unit="lookups")
+            print(f"{'':<24} {memory / n_ips:>12.1f} bytes/ip | "
+                  f"{memory / 1024 ** 2:.0f} MB for {n_ips:,} ips | built in {build_seconds:.1f}s")
+            results[f"{label} lookups/sec"] = rate
+            results[f"{label} memory bytes"] = memory
+            del index
+    return results
+
+# -----------------------------------------------------------
+# End-to-end export
+# -----------------------------------------------------------
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    try:
+        import resource
+    except ImportError:
+        # Windows: PeakWorkingSetSize from GetProcessMemoryInfo
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                    "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage",
+                )
+            ]
+
+        counters = Counters(cb=ctypes.sizeof(Counters))
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+        )
+        return counters.PeakWorkingSetSize / 1024 ** 2
+    # ru_maxrss survives exec on Linux, so a spawned child would report
+    # its parent's peak; VmHWM starts over
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB elsewhere
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+def _run_export(n_docs, seed, shard_bytes, export_options, source_options=None, sink_options=None,
+                tune_window=None):
+    """
+    Child-process body of bench_export: point export.py at the
+    stand-ins and a temp dir, run export_to_gcs and collect the numbers.
+    `source_options` and `sink_options` go to FakeSummaryCollection and
+    FakeBucket; `tune_window` replaces TUNE_WINDOW.
+    """
+    from project6 import export, tuning
+
+    with tempfile.TemporaryDirectory() as tmp:
+        export.LOG_DIR = tmp
+        export.LOG_FILE = os.path.join(tmp, "export_to_gcs.log")
+        export.TEMP_DIR = tmp
+        export.SUMMARY_TMP_DIR = os.path.join(tmp, "summary_export")
+        export.DEDUP_DIR = os.path.join(tmp, "summary_dedup")
+        export.TUNING_FILE = os.path.join(tmp, "summary_tuning.json")
+        export.SHARD_BYTES = shard_bytes
+        tuning.TUNE_WINDOW = tune_window or tuning.TUNE_WINDOW
+        bucket = FakeBucket(**(sink_options or {}))
+        sources = []
+
+        def get_summary_collection(mongo_options=None):
+            sources.append(FakeSummaryCollection(
+                n_docs, seed, raw_bson=(mongo_options or {}).get("raw_bson", False),
+                **(source_options or {})
+            ))
+            return sources[-1]
+
+        export.get_summary_collection = get_summary_collection
+        export.get_bucket = lambda: bucket
+
+        METRICS.reset()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            export.export_to_gcs(**export_options)
+        elapsed = time.perf_counter() - start
+
+        snap = METRICS.snapshot()
+        exported = snap["stages"].get("normalize", {}).get("count", 0)
+        # The day manifests must account for every doc too
+        listed = sum(json.loads(data)["rows"] for name, data in bucket.data.items()
+                     if name.endswith(DAY_MANIFEST))
+        if exported != n_docs or listed != n_docs:
+            with open(export.LOG_FILE, encoding="utf-8") as f:
+                raise RuntimeError(f"export wrote {exported} of {n_docs} docs, manifests list {listed}:\n"
+                                   f"{f.read()[-2000:]}")
+        shards = {name: size for name, size in bucket.objects.items() if not name.endswith(DAY_MANIFEST)}
+        with open(export.LOG_FILE, encoding="utf-8") as f:
+            decisions = [line.split(" - ", 2)[-1].strip() for line in f if " - TUNE " in line]
+        tuned = tuning.load_tuning(export.TUNING_FILE, export.MONGO_URL)
+
+    source_seconds = sum(source.source_seconds for source in sources)
+    return {
+        "docs/sec": n_docs / elapsed,
+        "docs/sec excl. source": n_docs / max(elapsed - source_seconds, 1e-9),
+        "peak RSS MB": peak_rss_mb(),
+        "written bytes": snap["stages"].get("write", {}).get("bytes", 0),
+        "uploaded bytes": sum(shards.values()),
+        "shards": len(shards),
+        "stage seconds": {stage: t["seconds"] for stage, t in snap["stages"].items()},
+        "decisions": decisions,
+        "tuned": tuned,
+    }
+
+def bench_export(n_docs=200000, seed=0, shard_mb=64, **export_options):
+    """
+    Run export_to_gcs end to end against FakeSummaryCollection and
+    FakeBucket in a fresh process (so peak RSS is the export's own).
+    `export_options` go to export_to_gcs (compression, file_format,
+    serializer, stream, mongo_options, ...); partitioned and
+    incremental exports need a real server.
+
+    Reports docs/sec with and without the stand-in's generation time,
+    peak RSS, bytes written locally and uploaded, and seconds per stage.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        result = pool.submit(_run_export, n_docs, seed, int(shard_mb * 1024 ** 2),
+                             export_options).result()
+
+    stages = result.pop("stage seconds")
+    result.pop("decisions")
+    result.pop("tuned")
+    print(f"{'export':<24} {result['docs/sec']:>12,.0f} docs/sec "
+          f"({result['docs/sec excl. source']:,.0f} excl. source)")
+    print(f"{'':<24} peak RSS {result['peak RSS MB']:,.0f} MB | written {result['written bytes']:,} bytes | "
+          f"uploaded {result['uploaded bytes']:,} bytes in {result['shards']} shards")
+    print(f"{'':<24} " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in sorted(stages.items())))
+    return result
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+def _run_tail(n_docs, seed, rate, tail_options):
+    """Child-process body of bench_tail: export_tail over FakeChangeStream."""
+    from project6 import export
+
+    with tempfile.TemporaryDirectory() as tmp:
+        export.LOG_DIR = tmp
+        export.LOG_FILE = os.path.join(tmp, "export_to_gcs.log")
+        export.SUMMARY_TMP_DIR = os.path.join(tmp, "summary_export")
+        export.setup_logging()
+        stop = threading.Event()
+        bucket = FakeBucket()
+        # Stop once drained and the last shard had time to roll by age
+        linger = 1.5 * (tail_options.get("roll_seconds") or export.ROLL_SECONDS)
+        source = FakeSummaryCollection(n_docs, seed, rate=rate, stop=stop, linger=linger)
+        export.get_summary_collection = lambda mongo_options=None: source
+        export.get_bucket = lambda: bucket
+
+        checkpoint_path = os.path.join(tmp, "summary_tail.json")
+        docs, _, _ = export.export_tail(
+            checkpoint_path=checkpoint_path,
+            # Uncompressed, so the fake bucket can count rows per shard
+            shard_options={"compression": "none"},
+            tail_options=tail_options,
+            stop=stop,
+        )
+        stream = source.streams[0]
+        resumed = FakeChangeStream(source, TailCheckpoint(checkpoint_path).resume_token)
+
+    # Shards hold consecutive events, in shard-name order
+    latencies = []
+    first = 0
+    for name in sorted(bucket.lines):
+        rows = bucket.lines[name]
+        latencies += [bucket.finished[name] - t for t in stream.emitted[first:first + rows]]
+        first += rows
+    if docs != n_docs or first != n_docs or resumed.position != n_docs:
+        raise RuntimeError(f"tail exported {docs}/{first} of {n_docs} events, resumes at {resumed.position}")
+    return {
+        "events/sec": n_docs / (stream._drained_at - stream._started),
+        "p50 latency s": _percentile(latencies, 0.5),
+        "p99 latency s": _percentile(latencies, 0.99),
+        "max latency s": max(latencies),
+        "shards": len(bucket.lines),
+    }
+
+def bench_tail(n_docs=100000, rate=2000, roll_seconds=2):
+    """
+    export_tail against a simulated change stream: throughput with
+    events as fast as they can be read, then event-to-upload latency
+    with `rate` events/sec and shards rolling every `roll_seconds`.
+    The resume token must end up after the last event.
+    """
+    runs = {
+        "max rate": (n_docs, None, {"roll_seconds": roll_seconds}),
+        f"{rate}/s": (rate * 5 * roll_seconds, rate, {"roll_seconds": roll_seconds}),
+    }
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for label, (n, event_rate, tail_options) in runs.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(_run_tail, n, 0, event_rate, tail_options).result()
+        print(f"{'tail ' + label:<24} {result['events/sec']:>12,.0f} events/sec | latency p50 "
+              f"{result['p50 latency s']:.2f}s, p99 {result['p99 latency s']:.2f}s, "
+              f"max {result['max latency s']:.2f}s | {result['shards']} shards")
+        results.update({f"{label} {metric}": value for metric, value in result.items()})
+    return results
+
+def bench_tune(n_docs=100000, latency=0.05, bandwidth=512 * 1024, window=1.0):
+    """
+    export_to_gcs with fixed settings against --adaptive, both starting
+    from 1000-doc cursor batches and 2 uploads at once, over a simulated
+    slow source (`latency` seconds per round trip) and a simulated slow
+    sink (`bandwidth` bytes/sec per upload, 8 MB shards). Decisions are
+    made every `window` seconds. Adaptive runs must export every doc,
+    end up with bigger batches against the slow source and more
+    uploads against the slow sink, and log why.
+    """
+    start = {"mongo_options": {"batch_size": 1000}, "upload_options": {"max_in_flight": 2}}
+    scenarios = {
+        "slow source": ({"latency": latency}, {}, 64, "batch_size"),
+        "slow sink": ({}, {"bandwidth": bandwidth}, 8, "upload_concurrency"),
+    }
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for label, (source_options, sink_options, shard_mb, knob) in scenarios.items():
+        rates = {}
+        for adaptive in (False, True):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(
+                    _run_export, n_docs, 0, shard_mb * 1024 ** 2, {**start, "adaptive": adaptive},
+                    source_options, sink_options, window,
+                ).result()
+            mode = "adaptive" if adaptive else "fixed"
+            rates[mode] = result["docs/sec"]
+            print(f"{label + ' ' + mode:<24} {result['docs/sec']:>12,.0f} docs/sec | "
+                  f"{len(result['decisions'])} decisions, ended with {result['tuned'] or start}")
+            for decision in result["decisions"]:
+                print(f"{'':<24} {decision}")
+        tuned = result["tuned"].get(knob, 0)
+        if tuned <= (1000 if knob == "batch_size" else 2):
+            raise RuntimeError(f"{label}: {knob} was not raised ({result['tuned']})")
+        results[f"{label} fixed docs/sec"] = rates["fixed"]
+        results[f"{label} adaptive docs/sec"] = rates["adaptive"]
+        results[f"{label} tuned {knob}"] = tuned
+    return results
+
+# -----------------------------------------------------------
+# Saved results
+# -----------------------------------------------------------
+def git_commit():
+    """Current commit hash (with a '-dirty' suffix for local changes), or None."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+def save_results(results, path=BENCH_RESULTS):
+    """Append one run's results, tagged with commit and platform, to `path`."""
+    record = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Results saved to {path} (commit {record['commit']})")
+    return record
+
+def load_results(path=BENCH_RESULTS):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _higher_is_better(metric):
+    """Rates improve upward; bytes, memory and latencies downward; None if neither."""
+    if "/sec" in metric:
+        return True
+    if metric.endswith(("bytes", "MB", "ms/request", "latency s")):
+        return False
+    return None
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Print every metric the two runs share with its relative change,
+    flagging changes worse than `threshold`. Returns the regressions
+    as (bench, metric, change) tuples.
+    """
+    print(f"Comparing {current['commit']} ({current['timestamp']}) "
+          f"with {baseline['commit']} ({baseline['timestamp']})")
+    regressions = []
+    for name, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            before = baseline["results"].get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or not before:
+                continue
+            change = value / before - 1
+            better = _higher_is_better(metric)
+            flag = ""
+            if better is not None and (change < -threshold if better else change > threshold):
+                flag = "  REGRESSION"
+                regressions.append((name, metric, change))
+            print(f"{name + ': ' + metric:<48} {before:>14,.1f} -> {value:>14,.1f} ({change:+.1%}){flag}")
+    return regressions
+
+# -----------------------------------------------------------
+# Suite
+# -----------------------------------------------------------
+BENCHMARKS = {
+    "normalizer": bench_normalizer,
+    "cast_value": bench_cast_value,
+    "compression": bench_compression,
+    "serializers": bench_serializers,
+    "decode": bench_decode,
+    "csv": bench_csv,
+    "trigger": bench_trigger,
+    "dedup": bench_dedup,
+    "geoip": bench_geoip,
+    "export": bench_export,
+    "tail": bench_tail,
+    "tune": bench_tune,
+}
+
+def run_suite(names=None):
+    """Run the named benchmarks (all by default); returns {name: {metric: value}}."""
+    results = {}
+    for name in names or BENCHMARKS:
+        print(f"== {name}")
+        try:
+            results[name] = BENCHMARKS[name]()
+        except ImportError as e:
+            print(f"skipped ({e})")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the export pipeline")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--results", default=BENCH_RESULTS,
+                        help="JSON-lines file the results are appended to")
+    parser.add_argument("--no-save", dest="save", action="store_false",
+                        help="don't append the results")
+    parser.add_argument("--compare", nargs="?", const="", metavar="COMMIT",
+                        help="compare with the last saved run (or the last one of COMMIT)")
+    args = parser.parse_args()
+    unknown = sorted(set(args.benchmarks) - set(BENCHMARKS))
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    history = load_results(args.results)
+    results = run_suite(args.benchmarks)
+    current = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    if args.save:
+        current = save_results(results, args.results)
+
+    if args.compare is not None:
+        candidates = [r for r in history if (r["commit"] or "").startswith(args.compare)]
+        if candidates:
+            compare_results(candidates[-1], current)
+        else:
+            print(f"No saved run to compare with in {args.results}")
@@ -0,0 +1,152 @@
+import os
+import threading
+from bson import ObjectId, json_util
+
+# -----------------------------------------------------------
+# Export checkpoint
+# -----------------------------------------------------------
+class ExportCheckpoint:
+    """
+    Durable state of the incremental summary export, kept in a local
+    JSON file:
+
+        {
+          "version": 2,
+          "high_water_mark": <last exported _id> | null,
+          "run": null | {
+            "run_id": "20261018T101500",
+            "start_after": <_id> | null,
+            "end": <_id>,
+            "shards": {"0": {"blob": "...", "last_id": <_id>, "docs": 1000000}}
+          }
+        }
+
+    `_id`s keep their BSON type as MongoDB Extended JSON (e.g.
+    `{"$oid": "5e83..."}`, or a plain string or number), so range
+    queries compare them with `_id`s of the same type. Files written
+    before version 2 hold ObjectIds as hex strings.
+
+    `run` describes the run in progress; it is cleared once every shard
+    of the run is uploaded and `high_water_mark` is moved to `end`.
+    The file is rewritten atomically after every completed shard, so a
+    crashed run can resume after the last contiguous uploaded shard.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = {"version": self.VERSION, "high_water_mark": None, "run": None}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json_util.loads(f.read())
+            if self.state.get("version") != self.VERSION:
+                self._upgrade()
+
+    def _upgrade(self):
+        def oid(value):
+            return ObjectId(value) if value else None
+
+        self.state["version"] = self.VERSION
+        self.state["high_water_mark"] = oid(self.state["high_water_mark"])
+        run = self.state["run"]
+        if run is not None:
+            run["start_after"] = oid(run["start_after"])
+            run["end"] = oid(run["end"])
+            for shard in run["shards"].values():
+                shard["last_id"] = oid(shard["last_id"])
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps(self.state, indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    @property
+    def high_water_mark(self):
+        return self.state["high_water_mark"]
+
+    @property
+    def run(self):
+        return self.state["run"]
+
+    def start_run(self, run_id, start_after, end):
+        with self._lock:
+            self.state["run"] = {
+                "run_id": run_id,
+                "start_after": start_after,
+                "end": end,
+                "shards": {},
+            }
+            self._save()
+
+    def shard_done(self, index, blob_path, last_id, docs):
+        with self._lock:
+            self.state["run"]["shards"][str(index)] = {
+                "blob": blob_path,
+                "last_id": last_id,
+                "docs": docs,
+            }
+            self._save()
+
+    def resume_point(self):
+        """
+        Return (next shard index, resume-after _id) for the run in
+        progress: the end of the longest prefix of uploaded shards.
+        """
+        run = self.state["run"]
+        index = 0
+        after = run["start_after"]
+        while str(index) in run["shards"]:
+            after = run["shards"][str(index)]["last_id"]
+            index += 1
+        return index, after
+
+    def finish_run(self):
+        with self._lock:
+            self.state["high_water_mark"] = self.state["run"]["end"]
+            self.state["run"] = None
+            self._save()
+
+# -----------------------------------------------------------
+# Change-stream checkpoint
+# -----------------------------------------------------------
+class TailCheckpoint:
+    """
+    Resume token of the change-stream tail, kept in a local JSON file:
+
+        {"resume_token": {"_data": "8263..."} | null, "shards": 42}
+
+    The token is only saved once every shard holding events up to it
+    is uploaded, so a restarted tail resumes after the last shipped
+    event. Events of shards that were still uploading are exported
+    again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {"resume_token": None, "shards": 0}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json_util.loads(f.read())
+
+    @property
+    def resume_token(self):
+        return self.state["resume_token"]
+
+    def save(self, resume_token, shards=0):
+        """Record `resume_token` after `shards` more uploaded shards."""
+        resume_token = dict(resume_token)
+        if resume_token == self.state["resume_token"] and not shards:
+            return
+        self.state["resume_token"] = resume_token
+        self.state["shards"] += shards
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json_util.dumps(self.state, indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
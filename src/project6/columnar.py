@@ -0,0 +1,61 @@
+# -----------------------------------------------------------
+# Arrow schema from the export schema dicts
+# -----------------------------------------------------------
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export requires the 'pyarrow' package") from None
+    return pyarrow
+
+def arrow_type(field_type):
+    pa = _pyarrow()
+    types = {
+        "STRING": pa.string(),
+        "INTEGER": pa.int64(),
+        "FLOAT": pa.float64(),
+        "BOOLEAN": pa.bool_(),
+        "DATE": pa.date32(),
+    }
+    if field_type not in types:
+        raise ValueError(f"No Arrow type for {field_type!r}")
+    return types[field_type]
+
+def arrow_schema(schema):
+    """
+    Convert a schema dict like `summary_schema` in export.py into a
+    pyarrow schema: REPEATED records become list<struct>, other records
+    become struct, and primitive types map to their Arrow equivalent.
+    """
+    pa = _pyarrow()
+    return pa.schema(_arrow_fields(schema))
+
+def _arrow_fields(schema):
+    pa = _pyarrow()
+    fields = []
+    for field, field_schema in schema.items():
+        if isinstance(field_schema, str):
+            fields.append(pa.field(field, arrow_type(field_schema)))
+        elif isinstance(field_schema, dict):
+            struct = pa.struct(_arrow_fields(field_schema["fields"]))
+            if field_schema.get("type") == "REPEATED":
+                fields.append(pa.field(field, pa.list_(struct)))
+            else:
+                fields.append(pa.field(field, struct))
+    return fields
+
+def parquet_writer(path, schema, compression="none"):
+    """Open a ParquetWriter on `path` for an Arrow `schema`."""
+    pq = _pyarrow().parquet
+    return pq.ParquetWriter(path, schema, compression=compression)
+
+def rows_to_table(rows, schema):
+    """Build an Arrow table from normalized docs (list of dicts)."""
+    return _pyarrow().Table.from_pylist(rows, schema=schema)
+
+def parquet_row_groups(path):
+    """Yield the row groups of the Parquet file at `path` as Arrow tables."""
+    parquet_file = _pyarrow().parquet.ParquetFile(path)
+    for i in range(parquet_file.num_row_groups):
+        yield parquet_file.read_row_group(i)
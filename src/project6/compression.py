@@ -0,0 +1,61 @@
+import zlib
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+# gzip is the only one of these BigQuery can load directly.
+DEFAULT_COMPRESSION = "gzip"
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# Low levels: JSONL compresses well even at level 1-3, and higher
+# levels cost far more CPU than they save in upload time.
+LEVELS = {"gzip": 3, "zstd": 3}
+
+READ_BLOCK = 1024 * 1024
+
+# -----------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------
+def extension(compression):
+    """File-name suffix for `compression`, e.g. '.gz'."""
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Unknown compression: {compression!r}, expected one of {COMPRESSIONS}")
+    return EXTENSIONS[compression]
+
+def compressor(compression):
+    """
+    Return a streaming compressor with `compress(bytes)` and `flush()`,
+    or None for 'none'.
+    """
+    if compression == "none":
+        return None
+    if compression == "gzip":
+        # wbits=31 writes a gzip header and trailer instead of raw zlib
+        return zlib.compressobj(LEVELS["gzip"], zlib.DEFLATED, 31)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires the 'zstandard' package") from None
+        return zstandard.ZstdCompressor(level=LEVELS["zstd"]).compressobj()
+    raise ValueError(f"Unknown compression: {compression!r}, expected one of {COMPRESSIONS}")
+
+def compress_file(path, compression):
+    """
+    Compress `path` into `path + extension(compression)` block by block
+    and return the new path ('none' returns `path` unchanged). Both zlib
+    and zstandard release the GIL, so this runs in parallel when called
+    from worker threads.
+    """
+    comp = compressor(compression)
+    if comp is None:
+        return path
+
+    out_path = path + extension(compression)
+    with open(path, "rb") as f_in, open(out_path, "wb") as f_out:
+        while block := f_in.read(READ_BLOCK):
+            f_out.write(comp.compress(block))
+        f_out.write(comp.flush())
+    return out_path
@@ -0,0 +1,367 @@
+import csv
+import io
+import json
+import math
+import os
+import shutil
+import re
+
+from project6.columnar import arrow_type, parquet_row_groups, parquet_writer
+from project6.serializers import DEFAULT_SERIALIZER, get_serializer
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+# "auto" uses the pyarrow reader when it is installed and falls back
+# to the stdlib csv module.
+DEFAULT_ENGINE = "auto"
+ENGINES = ("auto", "arrow", "python")
+
+BLOCK_BYTES = 16 * 1024 * 1024  # arrow reader block
+BLOCK_ROWS = 50000              # python reader block
+
+# Cells that don't match become null instead of failing the load.
+# INTEGER accepts a trailing ".0" (pandas writes int columns with gaps
+# as floats) and at most 18 digits so it always fits in INT64.
+INT_PATTERN = r"^[+-]?\d{1,18}(?:\.0*)?$"
+FLOAT_PATTERN = r"^[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$"
+BOOL_VALUES = {"true": True, "1": True, "false": False, "0": False}
+
+# Rows with more or fewer cells than the header are skipped by both
+# engines and counted in `failures` under this key
+RAGGED_ROWS = "(ragged rows)"
+
+_INT_RE = re.compile(INT_PATTERN)
+_FLOAT_RE = re.compile(FLOAT_PATTERN)
+
+def field_types(schema):
+    """`{column: BigQuery type}` for a list of bigquery.SchemaField."""
+    return {field.name: field.field_type for field in schema}
+
+# -----------------------------------------------------------
+# Python engine: one caster per cell
+# -----------------------------------------------------------
+def _to_str(value):
+    return value if value != "" else None
+
+def _to_int(value):
+    value = value.strip()
+    if not _INT_RE.match(value):
+        return None
+    return int(value.split(".", 1)[0])
+
+def _to_float(value):
+    value = value.strip()
+    if not _FLOAT_RE.match(value):
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+def _to_bool(value):
+    return BOOL_VALUES.get(value.strip().lower())
+
+_CASTERS = {
+    "STRING": _to_str,
+    "INTEGER": _to_int,
+    "FLOAT": _to_float,
+    "BOOLEAN": _to_bool,
+}
+
+def _counting(cast, column, failures):
+    """Wrap `cast` to count non-empty cells it turns into None."""
+    def run(value):
+        out = cast(value)
+        if out is None and value != "":
+            failures[column] += 1
+        return out
+    return run
+
+def _python_blocks(csv_path, types, source=None, failures=None, block_rows=BLOCK_ROWS):
+    """Yield lists of cast row dicts, `block_rows` at a time."""
+    if source is not None:
+        f_in = io.TextIOWrapper(source, encoding="utf-8", newline="")
+    else:
+        f_in = open(csv_path, "r", encoding="utf-8", newline="")
+    with f_in:
+        reader = csv.reader(f_in)
+        headers = next(reader)
+        casters = [_CASTERS[types.get(h, "STRING")] for h in headers]
+        if failures is not None:
+            casters = [
+                _counting(cast, h, failures) if cast is not _to_str else cast
+                for h, cast in zip(headers, casters)
+            ]
+        columns = list(zip(headers, casters))
+
+        block = []
+        for row in reader:
+            if len(row) != len(columns):
+                # Blank lines are skipped quietly, as by the arrow reader
+                if row and failures is not None:
+                    failures[RAGGED_ROWS] += 1
+                continue
+            block.append({h: cast(v) for (h, cast), v in zip(columns, row)})
+            if len(block) >= block_rows:
+                yield block
+                block = []
+        if block:
+            yield block
+
+# -----------------------------------------------------------
+# Arrow engine: whole-column casts per block
+# -----------------------------------------------------------
+def _pyarrow_csv():
+    try:
+        import pyarrow.compute
+        import pyarrow.csv
+    except ImportError:
+        raise ImportError("The arrow CSV engine requires the 'pyarrow' package") from None
+    return pyarrow
+
+def _cast_column(column, field_type):
+    """Cast a string column to `field_type`; invalid cells become null."""
+    pa = _pyarrow_csv()
+    pc = pa.compute
+    if field_type == "STRING":
+        return column
+    if field_type not in _CASTERS:
+        raise ValueError(f"Cannot cast CSV column to {field_type!r}")
+
+    column = pc.utf8_trim_whitespace(column)
+    null = pa.scalar(None, pa.string())
+    if field_type == "BOOLEAN":
+        return pc.if_else(
+            pc.is_in(pc.utf8_lower(column), pa.array(["true", "1"])), True,
+            pc.if_else(pc.is_in(pc.utf8_lower(column), pa.array(["false", "0"])), False, None),
+        )
+
+    pattern = INT_PATTERN if field_type == "INTEGER" else FLOAT_PATTERN
+    column = pc.if_else(pc.match_substring_regex(column, pattern), column, null)
+    # Arrow's parser rejects a leading '+' (and '.0' for integers)
+    column = pc.replace_substring_regex(column, r"^\+", "")
+    if field_type == "INTEGER":
+        column = pc.replace_substring_regex(column, r"\.0*$", "")
+        return pc.cast(column, pa.int64())
+    column = pc.cast(column, pa.float64())
+    return pc.if_else(pc.is_finite(column), column, None)
+
+def _arrow_blocks(csv_path, types, source=None, failures=None, block_bytes=BLOCK_BYTES):
+    """
+    Yield cast pyarrow RecordBatches of about `block_bytes` of CSV each,
+    read from `source` (a binary file object) or else `csv_path`.
+    Cells that failed to cast are counted per column in `failures`,
+    ragged rows (skipped) under RAGGED_ROWS.
+    """
+    pa = _pyarrow_csv()
+    with open(csv_path, "r", encoding="utf-8", newline="") as f_in:
+        headers = next(csv.reader(f_in))
+
+    def skip_row(row):
+        if failures is not None:
+            failures[RAGGED_ROWS] += 1
+        return "skip"
+
+    reader = pa.csv.open_csv(
+        source if source is not None else csv_path,
+        read_options=pa.csv.ReadOptions(block_size=block_bytes),
+        # Read every column as text and cast it ourselves, so bad cells
+        # become null instead of failing the whole block
+        convert_options=pa.csv.ConvertOptions(
+            column_types={h: pa.string() for h in headers},
+            null_values=[""],
+            strings_can_be_null=True,
+        ),
+        parse_options=pa.csv.ParseOptions(newlines_in_values=True, invalid_row_handler=skip_row),
+    )
+    out_schema = pa.schema([
+        pa.field(name, arrow_type(types.get(name, "STRING"))) for name in reader.schema.names
+    ])
+    for batch in reader:
+        columns = []
+        for name, column in zip(batch.schema.names, batch.columns):
+            cast = _cast_column(column, types.get(name, "STRING"))
+            if failures is not None and cast.null_count > column.null_count:
+                failures[name] += cast.null_count - column.null_count
+            columns.append(cast)
+        yield pa.RecordBatch.from_arrays(columns, schema=out_schema)
+
+# JSON escapes arrow can apply as plain substring replaces; blocks with
+# other control characters fall back to row-wise serialization
+_JSON_ESCAPES = (("\\", "\\\\"), ('"', '\\"'), ("\n", "\\n"), ("\r", "\\r"), ("\t", "\\t"))
+_NEEDS_ESCAPE = r'["\\\x00-\x1f]'
+_CONTROL_CHARS = r"[\x00-\x08\x0b\x0c\x0e-\x1f]"
+
+def _json_column(column):
+    """
+    JSON text of each value in `column` ('null' for nulls), or None if a
+    string needs an escape arrow can't do with substring replaces.
+    """
+    pa = _pyarrow_csv()
+    pc = pa.compute
+    if pa.types.is_string(column.type):
+        # Most columns need no escaping at all; check once per block
+        if pc.any(pc.match_substring_regex(column, _NEEDS_ESCAPE)).as_py():
+            if pc.any(pc.match_substring_regex(column, _CONTROL_CHARS)).as_py():
+                return None
+            for char, escaped in _JSON_ESCAPES:
+                column = pc.replace_substring(column, char, escaped)
+        column = pc.binary_join_element_wise('"', column, '"', "")
+    else:
+        column = pc.cast(column, pa.string())
+    return pc.fill_null(column, "null")
+
+def _batch_jsonl(batch):
+    """
+    Serialize a RecordBatch to JSONL bytes column by column: each
+    column becomes JSON text and one join interleaves them with the
+    keys, with no per-row Python objects. Returns None when the block
+    has to go through the row-wise serializer instead.
+    """
+    pa = _pyarrow_csv()
+    pc = pa.compute
+    if batch.num_rows == 0:
+        return b""
+    parts = []
+    for i, (name, column) in enumerate(zip(batch.schema.names, batch.columns)):
+        text = _json_column(column)
+        if text is None:
+            return None
+        parts += [("{" if i == 0 else ",") + json.dumps(name) + ":", text]
+    lines = pc.binary_join_element_wise(*parts, "}\n", "")
+    _, offsets, data = lines.buffers()
+    offsets = memoryview(offsets).cast("i")
+    start, end = offsets[lines.offset], offsets[lines.offset + len(lines)]
+    return data.slice(start, end - start).to_pybytes()
+
+def _batch_rows(batch):
+    """RecordBatch -> list of dicts, converting column by column."""
+    names = batch.schema.names
+    columns = [column.to_pylist() for column in batch.columns]
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+def _has_pyarrow():
+    try:
+        _pyarrow_csv()
+    except ImportError:
+        return False
+    return True
+
+# -----------------------------------------------------------
+# Byte-range chunks
+# -----------------------------------------------------------
+def csv_chunks(csv_path, chunk_bytes):
+    """
+    Split the rows of `csv_path` into (start, end) byte ranges of about
+    `chunk_bytes` each, cut at line ends. A line end only counts when
+    an even number of quotes precede it, so quoted values spanning
+    several lines are never split.
+    """
+    with open(csv_path, "rb") as f:
+        f.readline()  # header
+        start = pos = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        if not chunk_bytes or size - start <= chunk_bytes:
+            return [(start, size)]
+
+        ranges = []
+        quotes = 0
+        for line in f:
+            pos += len(line)
+            quotes += line.count(b'"')
+            if pos - start >= chunk_bytes and quotes % 2 == 0:
+                ranges.append((start, pos))
+                start = pos
+        if pos > start:
+            ranges.append((start, pos))
+        return ranges
+
+def _read_range(csv_path, byte_range):
+    """The header line plus the rows in `byte_range`, as one in-memory CSV."""
+    start, end = byte_range
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        f.seek(start)
+        return io.BytesIO(header + f.read(end - start))
+
+def merge_parts(part_paths, out_path, file_format="jsonl", compression="none"):
+    """Concatenate converted chunk files into `out_path` and delete them."""
+    if file_format == "parquet":
+        writer = None
+        try:
+            for part in part_paths:
+                for table in parquet_row_groups(part):
+                    if writer is None:
+                        writer = parquet_writer(out_path, table.schema, compression)
+                    writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(out_path, "wb") as f_out:
+            for part in part_paths:
+                with open(part, "rb") as f_in:
+                    shutil.copyfileobj(f_in, f_out)
+    for part in part_paths:
+        os.remove(part)
+
+# -----------------------------------------------------------
+# Converter
+# -----------------------------------------------------------
+def convert_csv(csv_path, out_path, types, file_format="jsonl",
+                engine=DEFAULT_ENGINE, serializer=DEFAULT_SERIALIZER, compression="none",
+                byte_range=None, failures=None):
+    """
+    Convert `csv_path` to `out_path` (JSONL or Parquet), casting each
+    column to its type in `types` (`{column: BigQuery type}`, see
+    field_types). Columns missing from `types` stay STRING; empty and
+    invalid cells are written as null, rows with another number of
+    cells than the header are skipped. Returns the number of rows.
+
+    The CSV is read and written a block at a time. The arrow engine
+    casts whole columns per block and builds the JSONL text with arrow
+    kernels (`serializer` only serves the python engine and blocks
+    with unusual control characters); Parquet output requires it and uses
+    `compression` as its codec (JSONL is compressed after conversion).
+
+    `byte_range` converts only the rows in that range (see csv_chunks),
+    so chunks of one file can be converted in parallel and merged with
+    merge_parts. Cells nulled because they failed to cast are counted
+    per column in the `failures` Counter, when given, and skipped rows
+    under RAGGED_ROWS.
+    """
+    if engine == "auto":
+        engine = "arrow" if _has_pyarrow() else "python"
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown CSV engine: {engine!r}, expected one of {ENGINES}")
+    if file_format == "parquet" and engine != "arrow":
+        raise ValueError("Parquet output requires the arrow CSV engine")
+
+    source = _read_range(csv_path, byte_range) if byte_range else None
+    total = 0
+    if file_format == "parquet":
+        writer = None
+        try:
+            for batch in _arrow_blocks(csv_path, types, source, failures):
+                if writer is None:
+                    writer = parquet_writer(out_path, batch.schema, compression)
+                writer.write_batch(batch)
+                total += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return total
+
+    serialize = get_serializer(serializer)
+    with open(out_path, "wb") as f_out:
+        if engine == "arrow":
+            for batch in _arrow_blocks(csv_path, types, source, failures):
+                data = _batch_jsonl(batch)
+                if data is None:
+                    data = serialize(_batch_rows(batch))
+                f_out.write(data)
+                total += batch.num_rows
+        else:
+            for rows in _python_blocks(csv_path, types, source, failures):
+                f_out.write(serialize(rows))
+                total += len(rows)
+    return total
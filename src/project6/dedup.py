@@ -0,0 +1,309 @@
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import threading
+from bson import ObjectId
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+ID_BYTES = 12               # ObjectId.binary
+BITS_PER_ID = 10            # Bloom filter size: ~0.8% false positives with 7 hashes
+BLOOM_HASHES = 7
+INITIAL_CAPACITY = 10_000_000
+INDEX_EVERY = 4096          # one in-memory key per this many ids of a run file
+MAX_RUNS = 8                # run files beyond this are merged, smallest first
+_MASK64 = (1 << 64) - 1
+
+# -----------------------------------------------------------
+# Bloom filter
+# -----------------------------------------------------------
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over byte strings in a bytearray, using
+    double hashing of one 128-bit BLAKE2b digest. Answers "maybe" or
+    "definitely not"; the index checks every "maybe" on disk.
+    """
+
+    def __init__(self, capacity, bits_per_id=BITS_PER_ID, hashes=BLOOM_HASHES, data=None):
+        self.capacity = capacity
+        self.hashes = hashes
+        self.size = max(8, capacity * bits_per_id)
+        self.bits = data if data is not None else bytearray(math.ceil(self.size / 8))
+
+    def _positions(self, key):
+        h = int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(), "little")
+        h1, h2 = h & _MASK64, (h >> 64) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+# -----------------------------------------------------------
+# Sorted run files
+# -----------------------------------------------------------
+class IdRun:
+    """
+    One spill file: sorted, unique 12-byte ids back to back, memory
+    mapped. Every INDEX_EVERY-th id is kept in memory, so a lookup is
+    one bisect in memory plus a binary search over one 48 KB window.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.count = os.path.getsize(path) // ID_BYTES
+        self._f = open(path, "rb")
+        self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b""
+        self.keys = [self.key(i) for i in range(0, self.count, INDEX_EVERY)]
+        self.last = self.key(self.count - 1) if self.count else None
+
+    def key(self, i):
+        return self._map[i * ID_BYTES:(i + 1) * ID_BYTES]
+
+    def __contains__(self, key):
+        if not self.count or key < self.keys[0] or key > self.last:
+            return False
+        block = bisect.bisect_right(self.keys, key) - 1
+        lo = block * INDEX_EVERY
+        hi = min(lo + INDEX_EVERY, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.count and self.key(lo) == key
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.key(i)
+
+    def close(self):
+        if self.count:
+            self._map.close()
+        self._f.close()
+
+def _write_run(path, keys):
+    """Write sorted unique `keys` to `path` atomically, streaming."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        buffer = []
+        for key in keys:
+            buffer.append(key)
+            if len(buffer) >= INDEX_EVERY:
+                f.write(b"".join(buffer))
+                buffer.clear()
+        f.write(b"".join(buffer))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _unique(sorted_keys):
+    last = None
+    for key in sorted_keys:
+        if key != last:
+            yield key
+            last = key
+
+# -----------------------------------------------------------
+# Exported-id index
+# -----------------------------------------------------------
+class DedupIndex:
+    """
+    Set of the `_id`s already exported, kept in directory `path`.
+
+    Ids are stored exactly in sorted run files (12 bytes per id on disk)
+    and summarized by a Bloom filter in memory, so most new ids are
+    ruled out without touching disk and only filter hits, i.e. real
+    duplicates plus ~1% false positives, pay for a binary search in
+    the memory-mapped runs. Runs are merged smallest first once there
+    are more than MAX_RUNS of them. When the filter fills, one for twice
+    the ids is built from the runs on a background thread and swapped
+    in, so commits (on upload threads) don't wait for the rebuild.
+
+    Memory per billion ids: 1.25 to 2.5 GB of Bloom filter
+    (BITS_PER_ID = 10; a grown filter has room for twice the ids it
+    holds), up to 3.75 GB while a grown filter is built next to the old
+    one, plus ~15 MB of run keys; 12 GB of run files on disk. A lookup
+    of a new id is one BLAKE2b hash and 7 bit tests (~5 us), a duplicate
+    adds a binary search (~15 us); a dropped document skips the
+    normalizer, serializer and compression (~30 us end to end).
+
+    `commit()` may be called from upload threads while the export loop
+    looks ids up. Layout of `path`:
+
+        index.json   {"runs": [...], "next_run": 12, "bloom": {... "runs": [...]}}
+        bloom.bin    filter bits as of the last close()
+        run_00011.ids
+    """
+
+    def __init__(self, path, capacity=INITIAL_CAPACITY):
+        self.path = path
+        self._lock = threading.Lock()
+        self._retired = []
+        # Filter being grown in the background, and the keys committed
+        # since its runs were listed (None when not growing)
+        self._grower = None
+        self._pending = None
+        os.makedirs(path, exist_ok=True)
+
+        self.state = {"runs": [], "next_run": 0, "bloom": None}
+        index_path = os.path.join(path, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+        # Leftovers of a crash between writing a run and recording it
+        for name in os.listdir(path):
+            if name.startswith("run_") and name not in self.state["runs"]:
+                os.remove(os.path.join(path, name))
+
+        self.runs = [IdRun(os.path.join(path, name)) for name in self.state["runs"]]
+        self.bloom = self._load_bloom(capacity)
+
+    def __len__(self):
+        return sum(run.count for run in self.runs)
+
+    def _load_bloom(self, capacity):
+        saved = self.state["bloom"]
+        bloom_path = os.path.join(self.path, "bloom.bin")
+        if saved and os.path.exists(bloom_path) and len(self) <= saved["capacity"]:
+            with open(bloom_path, "rb") as f:
+                bloom = BloomFilter(saved["capacity"], saved["bits_per_id"], saved["hashes"],
+                                    data=bytearray(f.read()))
+            covered = set(saved["runs"])
+        else:
+            bloom = BloomFilter(max(capacity, 2 * len(self)))
+            covered = set()
+        # Runs committed after the filter was last saved
+        for run in self.runs:
+            if run.name not in covered:
+                for key in run:
+                    bloom.add(key)
+        return bloom
+
+    def _save_state(self):
+        tmp_path = os.path.join(self.path, "index.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+
+    def __contains__(self, oid):
+        """True if `oid` (ObjectId or 12 bytes) was committed before."""
+        key = oid.binary if isinstance(oid, ObjectId) else oid
+        if key not in self.bloom:
+            return False
+        return any(key in run for run in self.runs)
+
+    def _new_run_path(self):
+        name = f"run_{self.state['next_run']:05d}.ids"
+        self.state["next_run"] += 1
+        return os.path.join(self.path, name)
+
+    def commit(self, ids):
+        """
+        Record `ids`, the concatenated 12-byte ids of one uploaded
+        shard, as exported: written to a new run file and added to the
+        filter. Starts growing the filter once it is full (see _grow).
+        """
+        keys = sorted(ids[i:i + ID_BYTES] for i in range(0, len(ids), ID_BYTES))
+        if not keys:
+            return
+        with self._lock:
+            path = self._new_run_path()
+            _write_run(path, _unique(keys))
+            run = IdRun(path)
+            # Swap in new lists so lookups never see one half-updated
+            self.runs = self.runs + [run]
+            self.state["runs"] = [r.name for r in self.runs]
+            self._save_state()
+
+            # The current filter keeps answering until the grown one is swapped in
+            for key in keys:
+                self.bloom.add(key)
+            if self._pending is not None:
+                self._pending.extend(keys)
+            elif len(self) > self.bloom.capacity:
+                self._pending = []
+                self._grower = threading.Thread(target=self._grow, args=(self.runs, 2 * len(self)),
+                                                name="dedup-bloom", daemon=True)
+                self._grower.start()
+
+            if len(self.runs) > MAX_RUNS:
+                self._compact()
+
+    def _grow(self, runs, capacity):
+        """Build a filter of `capacity` from `runs` plus the keys committed meanwhile, then swap it in."""
+        try:
+            bloom = BloomFilter(capacity)
+            for run in runs:
+                for key in run:
+                    bloom.add(key)
+        except Exception:
+            logging.exception("Growing the dedup filter failed")
+            bloom = None
+        with self._lock:
+            if bloom is not None:
+                for key in self._pending:
+                    bloom.add(key)
+                self.bloom = bloom
+                logging.info(f"Dedup filter grown to {capacity} ids")
+            self._pending = None
+            self._grower = None
+
+    def _compact(self):
+        by_size = sorted(self.runs, key=lambda r: r.count)
+        # Merge the smallest runs until MAX_RUNS remain, and at least two
+        merge = by_size[:max(2, len(self.runs) - MAX_RUNS + 1)]
+        path = self._new_run_path()
+        _write_run(path, _unique(heapq.merge(*merge)))
+        merged = IdRun(path)
+
+        self.runs = [r for r in self.runs if r not in merge] + [merged]
+        self.state["runs"] = [r.name for r in self.runs]
+        self._save_state()
+        # Lookups and a growing filter may still hold the old runs; they are
+        # closed and deleted on close() (mapped files can't be deleted on Windows)
+        self._retired.extend(merge)
+
+    def close(self):
+        """Save the filter so the next run doesn't rebuild it, and release the runs."""
+        grower = self._grower
+        if grower is not None:
+            grower.join()
+        with self._lock:
+            tmp_path = os.path.join(self.path, "bloom.bin.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(self.bloom.bits)
+            os.replace(tmp_path, os.path.join(self.path, "bloom.bin"))
+            self.state["bloom"] = {
+                "capacity": self.bloom.capacity,
+                "bits_per_id": self.bloom.size // self.bloom.capacity,
+                "hashes": self.bloom.hashes,
+                "runs": [r.name for r in self.runs],
+            }
+            self._save_state()
+
+            for run in self.runs + self._retired:
+                run.close()
+            for run in self._retired:
+                os.remove(run.path)
+            self._retired = []
@@ -1,31 +1,63 @@
+import argparse
+import collections
 import csv
-import json
+import multiprocessing
 import os
 import logging
+import re
+import time
 from google.oauth2 import service_account
 from google.cloud import storage
 from pymongo import MongoClient
-from bson import ObjectId
-from concurrent.futures import ThreadPoolExecutor
+from pymongo.errors import OperationFailure
+import bson
+from bson import Decimal128, ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from project6.checkpoint import ExportCheckpoint, TailCheckpoint
+from project6.columnar import arrow_schema, parquet_writer, rows_to_table
+from project6.dedup import DedupIndex
+from project6.compression import COMPRESSIONS, DEFAULT_COMPRESSION, compress_file, extension
+from project6.gcs_compose import upload_from_path
+from project6.gcs_stream import GCSStreamWriter
+from project6.geoip import IP_LOCATION_CSV, IpLocations
+from project6.manifest import DayManifests, shard_entry
+from project6.metrics import METRICS, METRICS_EVERY, MetricsReporter, profiling, suffixed_path
+from project6.serializers import DEFAULT_SERIALIZER, SERIALIZERS, get_serializer
+from project6.tuning import AdaptiveTuner, TunableCursor, load_tuning, save_tuning
+from project6.upload_queue import UploadQueue
+from datetime import date, datetime, timezone
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
 # -----------------------------------------------------------
 # Helper functions
 # -----------------------------------------------------------
+# Range of BigQuery INTEGER and the Parquet int64 column
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
 def convert_oid(val):
     """Convert MongoDB ObjectId to string."""
     if isinstance(val, ObjectId):
         return str(val)
     return val
 
-def cast_value(val, field_type):
-    """Cast value to appropriate type for BigQuery."""
+def cast_value(val, field_type, field=None):
+    """
+    Cast value to appropriate type for BigQuery. Values that can't be
+    cast (including integers outside INT64) become None and are counted
+    under `field` in METRICS.
+    """
     if val is None:
         return None
     try:
         if field_type == "STRING":
             return str(val)
         elif field_type == "INTEGER":
-            return int(val)
+            val = int(val)
+            if not INT64_MIN <= val <= INT64_MAX:
+                raise OverflowError(f"{val} is outside INT64")
+            return val
         elif field_type == "BOOLEAN":
             return bool(val)
         elif field_type == "FLOAT":
@@ -33,6 +65,7 @@ def cast_value(val, field_type):
         else:
             return val
     except Exception:
+        METRICS.cast_failure(field)
         return None
 
 def normalize_doc(doc, schema):
@@ -49,7 +82,7 @@ def normalize_doc(doc, schema):
             if field == "api_version" and val is not None:
                 out[field] = str(val)
             else:
-                out[field] = cast_value(val, field_schema)
+                out[field] = cast_value(val, field_schema, field)
 
             continue
 
@@ -74,9 +107,166 @@ def normalize_doc(doc, schema):
 
     return out
 
-def upload_file(blob, path):
-    """Upload a local file to GCS."""
-    blob.upload_from_filename(path, timeout=1800)
+# -----------------------------------------------------------
+# Compiled normalizer
+# -----------------------------------------------------------
+def _plain(val):
+    """`val` with RawBSONDocuments (also inside lists) decoded to dicts."""
+    if isinstance(val, RawBSONDocument):
+        return bson.decode(val.raw)
+    if isinstance(val, list):
+        return [_plain(item) for item in val]
+    return val
+
+def _cast_str(val, field=None):
+    try:
+        # A raw sub-document is written as the dict normalize_doc would see
+        return str(_plain(val))
+    except Exception:
+        METRICS.cast_failure(field)
+        return None
+
+def _cast_int(val, field=None):
+    try:
+        val = int(convert_oid(val))
+        if not INT64_MIN <= val <= INT64_MAX:
+            raise OverflowError(f"{val} is outside INT64")
+        return val
+    except Exception:
+        METRICS.cast_failure(field)
+        return None
+
+def _cast_float(val, field=None):
+    try:
+        return float(convert_oid(val))
+    except Exception:
+        METRICS.cast_failure(field)
+        return None
+
+def _cast_bool(val, field=None):
+    try:
+        return bool(convert_oid(val))
+    except Exception:
+        METRICS.cast_failure(field)
+        return None
+
+# Sub-documents are dicts, or RawBSONDocument when decoding lazily
+_DOCUMENT_TYPES = (dict, RawBSONDocument)
+
+def _repeated(arr, normalize):
+    if not isinstance(arr, list):
+        arr = [arr] if arr else []
+    return [normalize(item) for item in arr if isinstance(item, _DOCUMENT_TYPES)]
+
+def _record(sub, normalize):
+    if not isinstance(sub, _DOCUMENT_TYPES):
+        return None
+    return normalize(sub)
+
+# (fast-path exact type, fallback caster) per BigQuery type.
+# Values that already have the exact target type are returned as-is,
+# which is what cast_value would produce for them anyway.
+_CASTERS = {
+    "STRING": ("str", "_cast_str"),
+    "INTEGER": ("int", "_cast_int"),
+    "FLOAT": ("float", "_cast_float"),
+    "BOOLEAN": ("bool", "_cast_bool"),
+}
+
+def _field_expr(field, field_schema, namespace, prefix=""):
+    """Return a Python expression normalizing one field of `doc`."""
+    key = repr(field)
+    path = repr(prefix + field)
+
+    if isinstance(field_schema, str):
+        if field == "api_version":
+            # Same rule as normalize_doc: FORCE api_version to STRING ALWAYS
+            return f"(None if (v := get({key})) is None else str(v))"
+        if field_schema in _CASTERS:
+            exact, caster = _CASTERS[field_schema]
+            check = f"type(v) is {exact}"
+            if field_schema == "INTEGER":
+                # Python ints are unbounded; only INT64 ones skip the caster
+                check += " and INT64_MIN <= v <= INT64_MAX"
+            return f"(v if (v := get({key})) is None or {check} else {caster}(v, {path}))"
+        return f"convert_oid(get({key}))"
+
+    if isinstance(field_schema, dict):
+        sub_name = f"_sub{len(namespace)}"
+        namespace[sub_name] = compile_normalizer(field_schema["fields"], f"{prefix}{field}.")
+        if field_schema.get("type") == "REPEATED":
+            return f"_repeated(get({key}, []), {sub_name})"
+        return f"_record(get({key}, {{}}), {sub_name})"
+
+    return None
+
+def compile_normalizer(schema, prefix=""):
+    """
+    Compile a schema into a function equivalent to
+    `lambda doc: normalize_doc(doc, schema)`.
+
+    The schema is walked once; the result is a generated function that
+    builds the output dict in a single literal with one specialized
+    caster per field. Cast failures are counted per dotted field path
+    (e.g. `cart_products.amount`), starting with `prefix`.
+    """
+    namespace = {
+        "convert_oid": convert_oid,
+        "INT64_MIN": INT64_MIN,
+        "INT64_MAX": INT64_MAX,
+        "_cast_str": _cast_str,
+        "_cast_int": _cast_int,
+        "_cast_float": _cast_float,
+        "_cast_bool": _cast_bool,
+        "_repeated": _repeated,
+        "_record": _record,
+    }
+
+    items = []
+    for field, field_schema in schema.items():
+        expr = _field_expr(field, field_schema, namespace, prefix)
+        if expr is not None:
+            items.append(f"        {field!r}: {expr},")
+
+    source = "\n".join([
+        "def normalize(doc):",
+        "    get = doc.get",
+        "    return {",
+        *items,
+        "    }",
+    ])
+    exec(compile(source, "<compiled normalizer>", "exec"), namespace)
+    return namespace["normalize"]
+
+def schema_projection(schema):
+    """
+    Mongo projection of the top-level fields `schema` reads.
+
+    Nested fields are not projected: dotted paths into arrays would
+    change how non-document elements and empty sub-documents come back,
+    and with them the normalized output.
+    """
+    return {field: 1 for field in schema}
+
+def upload_file(blob, path, compression="none"):
+    """
+    Upload a local file to GCS, compressing it first unless `compression`
+    is 'none', and delete it once the upload succeeded (a failed upload
+    leaves it in place). Files over COMPOSE_THRESHOLD go up as parallel
+    parts (see gcs_compose.py). Returns (raw bytes, uploaded bytes).
+    """
+    raw_bytes = os.path.getsize(path)
+    with METRICS.timer("compress", 1, raw_bytes):
+        upload_path = compress_file(path, compression)
+    try:
+        uploaded_bytes = os.path.getsize(upload_path)
+        with METRICS.timer("upload", 1, uploaded_bytes):
+            upload_from_path(blob, upload_path, timeout=1800)
+    finally:
+        if upload_path != path:
+            os.remove(upload_path)
+    os.remove(path)
+    return raw_bytes, uploaded_bytes
 
 # -----------------------------------------------------------
 # Summary schema for normalization
@@ -88,6 +278,10 @@ summary_schema = {
     "device_id": "STRING",
     "email_address": "STRING",
     "ip": "STRING",
+    # Filled from ip_location_results.csv by --geoip (see geoip.py)
+    "country": "STRING",
+    "region": "STRING",
+    "city": "STRING",
     "local_time": "STRING",
     "resolution": "STRING",
     "current_url": "STRING",
@@ -153,113 +347,1296 @@ summary_schema = {
     }
 }
 
+# Rows of a shard: the summary_schema fields plus the event's UTC day,
+# which glamira_raw is partitioned on (see event_date)
+PARTITION_FIELD = "event_date"
+shard_schema = {**summary_schema, PARTITION_FIELD: "DATE"}
+
 # -----------------------------------------------------------
-# Main export function
+# Config
 # -----------------------------------------------------------
-def export_to_gcs():
-    LOG_DIR = r"D:\python try hard\unigap\project6\data\log"
-    os.makedirs(LOG_DIR, exist_ok=True)  # ensure folder exists
-    LOG_FILE = os.path.join(LOG_DIR, "export_to_gcs.log")
+LOG_DIR = r"D:\python try hard\unigap\project6\data\log"
+LOG_FILE = os.path.join(LOG_DIR, "export_to_gcs.log")
+
+MONGO_URL = "mongodb://localhost:27017/"
+# Wire compression negotiated with the server, e.g. "zstd,snappy,zlib"
+# for the remote VM (snappy/zstd need their optional packages)
+MONGO_COMPRESSORS = None
+DB_NAME = "countly"
+SUMMARY_COLLECTION = "summary"
+
+KEY_PATH = r"D:\python try hard\unigap\project6\data\json_key\fresh-ocean-475916-m2-d87215690697.json"
+GCP_PROJECT = "fresh-ocean-475916-m2"
+BUCKET_NAME = "twan_glamira"
+BLOB_PREFIX = "dataset_export/summary"
+
+TEMP_DIR = r"D:\python try hard\unigap\project6\data\tmp"
+SUMMARY_TMP_DIR = os.path.join(TEMP_DIR, "summary_export")
 
+FORMATS = ("jsonl", "parquet")
+
+MONGO_BATCH = 10000
+# A shard is cut once it holds this many bytes of rows (uncompressed
+# JSONL, or Arrow data for Parquet), whatever the doc size
+SHARD_BYTES = 1024 ** 3
+# Shards hold one event day each, under BLOB_PREFIX/dt=YYYY-MM-DD/; an
+# export loop keeps at most this many day shards open at once
+MAX_OPEN_DAYS = 8
+MAX_WORKERS = 8
+PROGRESS_EVERY = 100000
+
+# --adaptive: bounds of the tuned cursor batch size and upload
+# concurrency, and the values last learned per MONGO_URL (see tuning.py)
+MONGO_BATCH_BOUNDS = (1000, 100000)
+UPLOAD_BOUNDS = (2, 32)
+TUNING_FILE = os.path.join(TEMP_DIR, "summary_tuning.json")
+
+# Backpressure: the export blocks while MAX_WORKERS shards are uploading
+# or while temp files take more than MAX_TMP_BYTES
+MAX_TMP_BYTES = 20 * 1024 ** 3
+
+# -----------------------------------------------------------
+# Connections
+# -----------------------------------------------------------
+def setup_logging():
+    os.makedirs(LOG_DIR, exist_ok=True)  # ensure folder exists
     logging.basicConfig(
             filename=LOG_FILE,
             level=logging.INFO,
             format="%(asctime)s - %(levelname)s - %(message)s"
     )
 
-    logging.info("START export_to_gcs")
+def get_summary_collection(mongo_options=None):
+    """
+    Connect to the summary collection. `mongo_options` may set
+    `compressors` (wire compression) and `raw_bson` (decode documents
+    lazily as RawBSONDocument, so unread sub-documents are never turned
+    into Python objects).
+    """
+    opts = mongo_options or {}
+    compressors = opts.get("compressors") or MONGO_COMPRESSORS
 
-    try:
-        # MongoDB connection
-        MONGO_URL = "mongodb://localhost:27017/"
-        DB_NAME = "countly"
-        SUMMARY_COLLECTION = "summary"
-
-        logging.info("Connecting to MongoDB...")
-        client = MongoClient(MONGO_URL)
-        db = client[DB_NAME]
-        summary_col = db[SUMMARY_COLLECTION]
-        logging.info("Connected to MongoDB successfully")
-
-        # GCS authentication
-        KEY_PATH = r"D:\python try hard\unigap\project6\data\json_key\fresh-ocean-475916-m2-d87215690697.json"
-        credentials = service_account.Credentials.from_service_account_file(KEY_PATH)
-        storage_client = storage.Client(project="fresh-ocean-475916-m2", credentials=credentials)
-        BUCKET_NAME = "twan_glamira"
-        bucket = storage_client.bucket(BUCKET_NAME)
-        logging.info("GCS authentication successful")
-
-        # Temp folders
-        TEMP_DIR = r"D:\python try hard\unigap\project6\data\tmp"
-        SUMMARY_TMP_DIR = os.path.join(TEMP_DIR, "summary_export")
-        os.makedirs(SUMMARY_TMP_DIR, exist_ok=True)
-
-        # Export summary collection
-        logging.info("START exporting MongoDB summary collection")
-        MONGO_BATCH = 10000
-        FILE_BATCH = 1000000
-        MAX_WORKERS = 8
-
-        futures = []
-        executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
-
-        file_index = 0
-        file_docs = 0
-        total_docs = 0
-        f_out = None
-        current_filename = None
-        current_local_path = None
-        current_blob_path = None
-
-        cursor = summary_col.find({}, no_cursor_timeout=True).batch_size(MONGO_BATCH)
+    logging.info("Connecting to MongoDB...")
+    client = MongoClient(MONGO_URL, **({"compressors": compressors} if compressors else {}))
+    summary_col = client[DB_NAME][SUMMARY_COLLECTION]
+    if opts.get("raw_bson"):
+        summary_col = summary_col.with_options(
+            codec_options=CodecOptions(document_class=RawBSONDocument)
+        )
+    logging.info("Connected to MongoDB successfully")
+    return summary_col
+
+def find_summary(summary_col, query, mongo_options=None, sort=False, tuner=None):
+    """
+    Open a no-timeout cursor over `query`, projected to the fields of
+    `summary_schema` unless `projection` is off in `mongo_options`, with
+    its `batch_size` (MONGO_BATCH by default). `sort` orders by `_id`.
+    With a `tuner` the cursor's batch size follows `tuner.batch_size`
+    instead (see TunableCursor).
+    """
+    opts = mongo_options or {}
+    projection = schema_projection(summary_schema) if opts.get("projection", True) else None
+
+    if tuner is not None:
+        return TunableCursor(summary_col, query, tuner, projection=projection,
+                             sort={"_id": 1} if sort else None)
+    cursor = summary_col.find(query, projection, no_cursor_timeout=True)
+    if sort:
+        cursor = cursor.sort("_id", 1)
+    return cursor.batch_size(opts.get("batch_size") or MONGO_BATCH)
+
+def open_uploads(upload_options=None, tuner=None):
+    """
+    Upload queue for shard uploads (see UploadQueue). `upload_options`
+    may set `max_in_flight` (uploads running at once, default
+    MAX_WORKERS) and `max_tmp_bytes` (cap on SUMMARY_TMP_DIR, None for
+    no cap). With a `tuner` the limit is the tuner's upload
+    concurrency, up to the top of UPLOAD_BOUNDS.
+    """
+    options = upload_options or {}
+    max_in_flight = options.get("max_in_flight") or MAX_WORKERS
+    workers = UPLOAD_BOUNDS[1] if tuner is not None else max_in_flight
+    uploads = UploadQueue(
+        ThreadPoolExecutor(max_workers=workers),
+        max_in_flight=max_in_flight,
+        tmp_dir=SUMMARY_TMP_DIR,
+        max_tmp_bytes=options.get("max_tmp_bytes", MAX_TMP_BYTES),
+    )
+    if tuner is not None:
+        tuner.attach(uploads)
+    return uploads
+
+def open_tuner(adaptive, mongo_options=None, upload_options=None):
+    """
+    AdaptiveTuner for one export loop, or None unless `adaptive`. It
+    starts from the values the last adaptive run against MONGO_URL
+    ended with (TUNING_FILE), else from the cursor `batch_size` and
+    upload `max_in_flight` options.
+    """
+    if not adaptive:
+        return None
+    learned = load_tuning(TUNING_FILE, MONGO_URL)
+    if learned:
+        logging.info(f"Starting from the values tuned for {MONGO_URL}: {learned}")
+    return AdaptiveTuner(
+        batch_size=learned.get("batch_size") or (mongo_options or {}).get("batch_size") or MONGO_BATCH,
+        batch_bounds=MONGO_BATCH_BOUNDS,
+        uploads=learned.get("upload_concurrency") or (upload_options or {}).get("max_in_flight") or MAX_WORKERS,
+        upload_bounds=UPLOAD_BOUNDS,
+    )
+
+def save_tuner(tuner):
+    """Keep what `tuner` ended with for the next adaptive run against MONGO_URL."""
+    if tuner is not None:
+        os.makedirs(TEMP_DIR, exist_ok=True)
+        save_tuning(TUNING_FILE, MONGO_URL, tuner.values())
+        logging.info(f"Tuned for {MONGO_URL}: {tuner.values()} after {len(tuner.decisions)} changes")
+
+def start_metrics(metrics_options=None, suffix="", labels=None):
+    """
+    Start a MetricsReporter for this process. `metrics_options` may set
+    `path` (`.prom` for a Prometheus textfile, JSON otherwise; without
+    it reports are logged) and `every` (seconds between reports).
+    """
+    options = metrics_options or {}
+    return MetricsReporter(
+        path=suffixed_path(options.get("path"), suffix),
+        interval=options.get("every") or METRICS_EVERY,
+        labels={"job": "export", **(labels or {})},
+    ).start()
+
+def get_bucket():
+    credentials = service_account.Credentials.from_service_account_file(KEY_PATH)
+    storage_client = storage.Client(project=GCP_PROJECT, credentials=credentials)
+    bucket = storage_client.bucket(BUCKET_NAME)
+    logging.info("GCS authentication successful")
+    return bucket
+
+# -----------------------------------------------------------
+# Event days
+# -----------------------------------------------------------
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Days BigQuery can partition on, as days since the epoch
+_FIRST_DAY = date(1960, 1, 1).toordinal() - _EPOCH_ORDINAL
+_LAST_DAY = date(2159, 12, 31).toordinal() - _EPOCH_ORDINAL
+_days = {}
+
+def _day(n):
+    day = _days.get(n)
+    if day is None:
+        day = _days[n] = date.fromordinal(_EPOCH_ORDINAL + n)
+    return day
+
+def event_date(time_stamp, _id=None):
+    """
+    UTC day of an event: that of its normalized `time_stamp` (epoch
+    seconds), or of its ObjectId `_id`'s creation time when the time
+    stamp is null or outside the days BigQuery can partition on.
+    1970-01-01 when neither is usable.
+    """
+    if time_stamp is not None:
+        n = time_stamp // 86400
+        if _FIRST_DAY <= n <= _LAST_DAY:
+            return _day(n)
+    if isinstance(_id, ObjectId):
+        return _day(int.from_bytes(_id.binary[:4], "big") // 86400)
+    return _day(0)
+
+def day_prefix(day):
+    """Blob prefix of the shards of `day`, e.g. `.../summary/dt=2020-04-01`."""
+    return f"{BLOB_PREFIX}/dt={day.isoformat()}"
+
+# Shards of full exports: summary_00012.jsonl.gz, summary_p03_00012.jsonl.gz
+FULL_SHARD = re.compile(r"summary(_p\d{2})?_\d{5,}\.")
+
+def next_shard_index(bucket, shard_prefix):
+    """
+    One past the highest shard number named `{shard_prefix}_00000...`
+    on any day, so a run never overwrites shards that the current day
+    manifests list while it is still exporting.
+    """
+    pattern = re.compile(rf"{re.escape(shard_prefix)}_(\d{{5,}})\.")
+    last = -1
+    for blob in bucket.list_blobs(prefix=f"{BLOB_PREFIX}/dt="):
+        match = pattern.match(os.path.basename(blob.name))
+        if match:
+            last = max(last, int(match.group(1)))
+    return last + 1
+
+def clear_stale_shards(bucket, manifests):
+    """
+    Once a full export committed its day `manifests`, delete the shards
+    of earlier full exports (FULL_SHARD) from each day it wrote, i.e.
+    those its manifests no longer list. Shards of tail, incremental and
+    other runs are kept.
+    """
+    listed = {entry["name"] for entry in manifests.entries}
+    deleted = 0
+    for day in sorted({entry["day"] for entry in manifests.entries}):
+        for blob in bucket.list_blobs(prefix=f"{BLOB_PREFIX}/dt={day}/"):
+            if blob.name not in listed and FULL_SHARD.match(os.path.basename(blob.name)):
+                blob.delete()
+                deleted += 1
+    if deleted:
+        logging.info(f"Deleted {deleted} shards of earlier full exports")
+
+# -----------------------------------------------------------
+# Shard writer
+# -----------------------------------------------------------
+class JsonlShard:
+    """
+    Base for JSONL shards: docs are buffered and serialized MONGO_BATCH
+    at a time into one byte buffer, written with a single binary write
+    to `self._f`. The first batches double from one row, so `size`
+    soon knows the average row size.
+    """
+
+    def __init__(self, serializer=DEFAULT_SERIALIZER):
+        self._serialize = get_serializer(serializer)
+        self._rows = []
+        self.bytes_written = 0
+        self.rows_written = 0
+
+    @property
+    def size(self):
+        """Bytes written plus the buffered rows, at the average row size written so far."""
+        if not self.rows_written:
+            return self.bytes_written
+        return self.bytes_written + len(self._rows) * self.bytes_written // self.rows_written
+
+    def _flush(self):
+        if self._rows:
+            start = time.perf_counter()
+            data = self._serialize(self._rows)
+            serialized = time.perf_counter()
+            self._f.write(data)
+            self.bytes_written += len(data)
+            self.rows_written += len(self._rows)
+            METRICS.record("serialize", serialized - start, len(self._rows), len(data))
+            METRICS.record("write", time.perf_counter() - serialized, len(self._rows), len(data))
+            self._rows = []
+
+    def write_doc(self, doc):
+        self._rows.append(doc)
+        if len(self._rows) >= min(MONGO_BATCH, max(1, self.rows_written)):
+            self._flush()
+
+class LocalShard(JsonlShard):
+    """
+    JSONL shard written to a temp file under SUMMARY_TMP_DIR and
+    uploaded with `upload_file` once closed, so compression happens on
+    the upload pool.
+    """
+
+    def __init__(self, blob, executor, compression="none", serializer=DEFAULT_SERIALIZER):
+        super().__init__(serializer)
+        self.blob = blob
+        self.executor = executor
+        self.compression = compression
+        filename = os.path.basename(blob.name).removesuffix(extension(compression))
+        self.path = os.path.join(SUMMARY_TMP_DIR, filename)
+        self._f = open(self.path, "wb")
+
+    def close(self):
+        self._flush()
+        self._f.close()
+        return self.executor.submit(upload_file, self.blob, self.path, self.compression)
+
+    def abort(self):
+        self._rows = []
+        self._f.close()
+        os.remove(self.path)
+
+class StreamShard(JsonlShard):
+    """JSONL shard streamed straight to GCS through GCSStreamWriter."""
+
+    def __init__(self, blob, executor, compression="none", serializer=DEFAULT_SERIALIZER):
+        super().__init__(serializer)
+        self.blob = blob
+        self._f = GCSStreamWriter(blob, executor, compression=compression)
+
+    def close(self):
+        self._flush()
+        return self._f.close()
+
+    def abort(self):
+        self._rows = []
+        self._f.abort()
+
+class ParquetShard:
+    """
+    Parquet shard written to a temp file, one row group per MONGO_BATCH
+    docs (the first ones doubling from one row, see JsonlShard), and
+    uploaded once closed. `compression` is used as the Parquet column
+    codec, so the file itself is uploaded as-is.
+    """
+
+    def __init__(self, blob, executor, compression="none"):
+        self.blob = blob
+        self.executor = executor
+        self.path = os.path.join(SUMMARY_TMP_DIR, os.path.basename(blob.name))
+        self.schema = arrow_schema(shard_schema)
+        self._writer = parquet_writer(self.path, self.schema, compression=compression)
+        self._rows = []
+        # Arrow (uncompressed) size of the row groups written so far
+        self.bytes_written = 0
+        self.rows_written = 0
+
+    size = JsonlShard.size
+
+    def _flush(self):
+        if self._rows:
+            with METRICS.timer("serialize", len(self._rows)):
+                table = rows_to_table(self._rows, self.schema)
+            # Parquet encoding and the disk write happen together here
+            with METRICS.timer("write", len(self._rows), table.nbytes):
+                self._writer.write_table(table)
+            self.bytes_written += table.nbytes
+            self.rows_written += len(self._rows)
+            self._rows = []
+
+    def write_doc(self, doc):
+        self._rows.append(doc)
+        if len(self._rows) >= min(MONGO_BATCH, max(1, self.rows_written)):
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        return self.executor.submit(upload_file, self.blob, self.path)
+
+    def abort(self):
+        self._rows = []
+        self._writer.close()
+        os.remove(self.path)
+
+def shard_extension(file_format="jsonl", compression="none"):
+    """File-name suffix of a shard, e.g. '.jsonl.gz' or '.parquet'."""
+    if file_format == "parquet":
+        return ".parquet"
+    return ".jsonl" + extension(compression)
+
+def open_shard(blob, executor, stream=False, compression="none", file_format="jsonl",
+               serializer=DEFAULT_SERIALIZER):
+    """Open a shard that ends up in `blob`, streamed or via a temp file."""
+    if file_format == "parquet":
+        if stream:
+            raise ValueError("Parquet shards cannot be streamed")
+        return ParquetShard(blob, executor, compression=compression)
+    if stream:
+        return StreamShard(blob, executor, compression=compression, serializer=serializer)
+    return LocalShard(blob, executor, compression=compression, serializer=serializer)
+
+def write_shards(docs, bucket, executor, shard_prefix="summary", on_progress=None,
+                 first_index=0, on_shard=None, stream=False, compression=DEFAULT_COMPRESSION,
+                 file_format="jsonl", serializer=DEFAULT_SERIALIZER, profile=None, dedup=None,
+                 max_open_days=MAX_OPEN_DAYS, geoip=None, manifests=None,
+                 shard_bytes=None, tuner=None):
+    """
+    Normalize `docs` into per-day shards of about `shard_bytes` of rows
+    (SHARD_BYTES by default) named
+    `dt=YYYY-MM-DD/{shard_prefix}_00000.jsonl` under BLOB_PREFIX (plus
+    the `compression` suffix, e.g. `.jsonl.gz`, or `.parquet` for the
+    parquet `file_format`) and submit each finished shard for upload on
+    `executor`. Each doc goes to the shard of its `event_date`, which is
+    added to the row. With `stream` JSONL shards go straight to GCS
+    instead of through local temp files. `serializer` picks the JSONL
+    backend (see serializers.py).
+
+    Up to `max_open_days` day shards are open at once; opening another
+    submits the least recently written one. Streamed shards each hold
+    an upload slot while open, so with `stream` fewer than the
+    `executor`'s `max_in_flight` are kept open. With 1, shards are
+    submitted in the order of `docs`. Shard numbers run across days,
+    from `first_index`.
+
+    `executor` is normally an UploadQueue, which blocks this loop while
+    too many shards are in flight and raises once an upload failed.
+    `on_shard(index, blob_path, last_id, docs, future)` is called for
+    every submitted shard, with the `_id` of its last document.
+
+    Time spent waiting on the cursor and in the normalizer is added to
+    the mongo_fetch and normalize stages of METRICS once per
+    MONGO_BATCH docs. With `profile` set to a path, this loop is
+    sampled and the collapsed stacks are written there.
+
+    With a `dedup` DedupIndex, docs whose ObjectId `_id` is in the index
+    are dropped before normalization, and each shard's ids are
+    committed to it once the shard is uploaded.
+
+    With `geoip`, the path of an ip_location_results.csv, the country,
+    region and city of each doc's `ip` are looked up in an IpLocations
+    index built from it; the lookups go to the geoip stage of METRICS.
+
+    With `manifests`, a DayManifests, each uploaded shard is added to
+    it with its rows, size and CRC32C.
+
+    With an AdaptiveTuner `tuner`, it gets a `tick()` every MONGO_BATCH
+    docs to adjust the cursor batch size and upload concurrency.
+
+    Returns the number of docs written. Futures are not kept; byte
+    totals and errors are collected by the UploadQueue.
+    """
+    os.makedirs(SUMMARY_TMP_DIR, exist_ok=True)
+    normalize = compile_normalizer(summary_schema)
+    suffix = shard_extension(file_format, compression)
+    enrich = IpLocations.from_csv(geoip).enrich if geoip else None
+    shard_bytes = shard_bytes or SHARD_BYTES
+
+    file_index = first_index
+    total_docs = 0
+    # day -> open shard state, least recently written first
+    open_days = {}
+    day = None
+    current = None
+
+    lookups = skipped = 0
+
+    def submit(day):
+        state = open_days.pop(day)
+        future = state["shard"].close()
+        if dedup is not None:
+            ids = bytes(state["ids"])
+            future.add_done_callback(lambda f: f.exception() is None and dedup.commit(ids))
+        if manifests is not None:
+            blob, docs = state["shard"].blob, state["docs"]
+            future.add_done_callback(
+                lambda f: f.exception() is None and manifests.add(shard_entry(blob, day, docs))
+            )
+        if on_shard:
+            on_shard(state["index"], state["blob_path"], state["last_id"], state["docs"], future)
+        logging.info(f"Submitted {state['blob_path']} | docs: {state['docs']}, total: {total_docs}")
+
+    def open_day(day):
+        nonlocal file_index
+        limit = max_open_days
+        if stream:
+            # A streamed shard holds an upload slot from open to close,
+            # so the queue must have one to spare for the new shard or
+            # its submit() would wait on slots only this loop can free
+            limit = min(limit, getattr(executor, "max_in_flight", limit))
+        while open_days and len(open_days) >= limit:
+            submit(next(iter(open_days)))
+        blob_path = f"{day_prefix(day)}/{shard_prefix}_{file_index:05d}{suffix}"
+        shard = open_shard(bucket.blob(blob_path), executor, stream=stream,
+                           compression=compression, file_format=file_format,
+                           serializer=serializer)
+        open_days[day] = state = {
+            "shard": shard, "index": file_index, "blob_path": blob_path,
+            "docs": 0, "last_id": None, "ids": bytearray(),
+        }
+        file_index += 1
+        return state
+
+    clock = time.perf_counter
+    fetch_seconds = normalize_seconds = dedup_seconds = geoip_seconds = 0.0
+
+    with profiling(profile):
         try:
-            for doc in cursor:
-                normalized_doc = normalize_doc(doc, summary_schema)
-
-                # Open new file if needed
-                if f_out is None or file_docs >= FILE_BATCH:
-                    if f_out:
-                        f_out.close()
-                        futures.append(executor.submit(upload_file, bucket.blob(current_blob_path), current_local_path))
-                        logging.info(f"Submitted {current_blob_path} | docs: {total_docs}")
-
-                    current_filename = f"summary_{file_index:05d}.jsonl"
-                    current_local_path = os.path.join(SUMMARY_TMP_DIR, current_filename)
-                    current_blob_path = f"dataset_export/summary/{current_filename}"
-                    f_out = open(current_local_path, "w", encoding="utf-8")
-                    file_index += 1
-                    file_docs = 0
-
-                f_out.write(json.dumps(normalized_doc) + "\n")
-                file_docs += 1
+            fetch_start = clock()
+            for doc in docs:
+                fetched = clock()
+                fetch_seconds += fetched - fetch_start
+                oid = doc["_id"]
+                if dedup is not None and isinstance(oid, ObjectId):
+                    duplicate = oid in dedup
+                    checked = clock()
+                    dedup_seconds += checked - fetched
+                    lookups += 1
+                    skipped += duplicate
+                    if lookups % MONGO_BATCH == 0:
+                        METRICS.record("dedup", dedup_seconds, MONGO_BATCH)
+                        dedup_seconds = 0.0
+                    if duplicate:
+                        fetch_start = checked
+                        continue
+                    fetched = checked
+                normalized_doc = normalize(doc)
+                doc_day = normalized_doc[PARTITION_FIELD] = event_date(normalized_doc["time_stamp"], oid)
+                normalized = clock()
+                normalize_seconds += normalized - fetched
+                if enrich is not None:
+                    enrich(normalized_doc)
+                    geoip_seconds += clock() - normalized
+
+                # Switch to the doc's day shard, opening one if needed
+                if doc_day != day:
+                    day = doc_day
+                    current = open_days.pop(day, None)
+                    if current is not None:
+                        open_days[day] = current  # now most recently written
+                if current is not None and current["shard"].size >= shard_bytes:
+                    submit(day)
+                    current = None
+                if current is None:
+                    current = open_day(day)
+
+                current["shard"].write_doc(normalized_doc)
+                current["last_id"] = oid
+                current["docs"] += 1
+                if dedup is not None and isinstance(oid, ObjectId):
+                    current["ids"] += oid.binary
                 total_docs += 1
 
-                if total_docs % 100000 == 0:
-                    logging.info(f"Exported {total_docs} documents so far...")
+                if total_docs % MONGO_BATCH == 0:
+                    METRICS.record("mongo_fetch", fetch_seconds, MONGO_BATCH)
+                    METRICS.record("normalize", normalize_seconds, MONGO_BATCH)
+                    if enrich is not None:
+                        METRICS.record("geoip", geoip_seconds, MONGO_BATCH)
+                    fetch_seconds = normalize_seconds = geoip_seconds = 0.0
+                    if tuner is not None:
+                        tuner.tick()
+
+                if total_docs % PROGRESS_EVERY == 0:
+                    if on_progress:
+                        on_progress(total_docs)
+                    else:
+                        logging.info(f"Exported {total_docs} documents so far...")
+
+                fetch_start = clock()
+        except BaseException:
+            for state in open_days.values():
+                state["shard"].abort()
+            raise
+
+        METRICS.record("mongo_fetch", fetch_seconds + clock() - fetch_start, total_docs % MONGO_BATCH)
+        METRICS.record("normalize", normalize_seconds, total_docs % MONGO_BATCH)
+        if enrich is not None:
+            METRICS.record("geoip", geoip_seconds, total_docs % MONGO_BATCH)
+        if dedup is not None:
+            METRICS.record("dedup", dedup_seconds, lookups % MONGO_BATCH)
+            logging.info(f"Dropped {skipped} of {lookups} docs as already exported")
+
+        # Final files, in the order they were opened
+        for day in sorted(open_days, key=lambda d: open_days[d]["index"]):
+            submit(day)
+        logging.info(f"Submitted FINAL shards | docs: {total_docs}")
+
+    return total_docs
+
+# -----------------------------------------------------------
+# Incremental export
+# -----------------------------------------------------------
+CHECKPOINT_FILE = os.path.join(TEMP_DIR, "summary_checkpoint.json")
+# _ids of every exported document, for --dedup (see dedup.py)
+DEDUP_DIR = os.path.join(TEMP_DIR, "summary_dedup")
+
+def id_type(value):
+    """Comparison type of an `_id`: a range query only matches `_id`s of its bounds' type."""
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float, Decimal128)):
+        return "number"
+    return type(value).__name__
+
+def check_id_types(summary_col, start_after=None):
+    """
+    Raise unless the collection's `_id`s, and `start_after`, are all of
+    one comparison type, as `_id` ranges need. `_id`s sort by type
+    first, so the lowest and highest tell.
+    """
+    first = summary_col.find_one({}, {"_id": 1}, sort=[("_id", 1)])
+    last = summary_col.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    if first is None:
+        return
+    types = {id_type(first["_id"]), id_type(last["_id"])}
+    if start_after is not None:
+        types.add(id_type(start_after))
+    if len(types) > 1:
+        raise RuntimeError(
+            f"Incremental export needs _ids of one type, found {sorted(types)} "
+            f"(lowest {first['_id']!r}, highest {last['_id']!r}, high-water mark {start_after!r}). "
+            f"Use a full export instead."
+        )
+
+def export_incremental(checkpoint_path=CHECKPOINT_FILE, shard_options=None, mongo_options=None,
+                       upload_options=None, adaptive=False):
+    """
+    Export only documents with `_id` above the checkpoint's high-water
+    mark, in `_id` order, into day shards named
+    `dt=YYYY-MM-DD/summary_<run_id>_00000.jsonl`. Only one day shard is
+    open at a time, so every shard ends where the next one starts.
+
+    The collection's `_id`s must all be of one type (ObjectIds, strings
+    or numbers; see check_id_types), which the checkpoint keeps.
+
+    Each uploaded shard is recorded in the checkpoint. If a previous run
+    did not finish, it is resumed after its last contiguous uploaded
+    shard with the same run id and shard numbering, so re-exported
+    shards overwrite their earlier partial uploads.
+
+    `shard_options` are passed on to `write_shards`, `mongo_options` to
+    `get_summary_collection` and `find_summary`, `upload_options` to
+    `open_uploads`. `adaptive` tunes the cursor batch size and upload
+    concurrency as the run goes (see open_tuner).
 
-            # Final file
-            if f_out:
-                f_out.close()
-                futures.append(executor.submit(upload_file, bucket.blob(current_blob_path), current_local_path))
-                logging.info(f"Submitted FINAL {current_blob_path} | docs: {total_docs}")
+    Returns (docs, raw bytes, uploaded bytes) for this invocation.
+    """
+    checkpoint = ExportCheckpoint(checkpoint_path)
+    summary_col = get_summary_collection(mongo_options)
 
+    if checkpoint.run is None:
+        start_after = checkpoint.high_water_mark
+        check_id_types(summary_col, start_after)
+        new_docs = {"_id": {"$gt": start_after}} if start_after is not None else {}
+        last = summary_col.find_one(new_docs, {"_id": 1}, sort=[("_id", -1)])
+        if last is None:
+            logging.info(f"No new documents after {start_after}")
+            return 0, 0, 0
+        run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        checkpoint.start_run(run_id, start_after, last["_id"])
+        logging.info(f"Starting incremental run {run_id} after {start_after}")
+
+    run = checkpoint.run
+    first_index, resume_after = checkpoint.resume_point()
+    if first_index:
+        logging.info(f"Resuming run {run['run_id']} at shard {first_index} after {resume_after}")
+
+    query = {"_id": {"$lte": run["end"]}}
+    if resume_after is not None:
+        query["_id"]["$gt"] = resume_after
+
+    def on_shard(index, blob_path, last_id, docs, future):
+        def done(f):
+            if f.exception() is None:
+                checkpoint.shard_done(index, blob_path, last_id, docs)
+        future.add_done_callback(done)
+
+    bucket = get_bucket()
+    tuner = open_tuner(adaptive, mongo_options, upload_options)
+    uploads = open_uploads(upload_options, tuner)
+    try:
+        cursor = find_summary(summary_col, query, mongo_options, sort=True, tuner=tuner)
+        try:
+            total_docs = write_shards(
+                cursor, bucket, uploads,
+                shard_prefix=f"summary_{run['run_id']}",
+                first_index=first_index,
+                on_shard=on_shard,
+                # Shards are added to their day's manifest as uploaded
+                manifests=DayManifests(bucket, BLOB_PREFIX),
+                tuner=tuner,
+                # One day shard at a time keeps shards in _id order
+                max_open_days=1,
+                **(shard_options or {}),
+            )
         finally:
             cursor.close()
+        raw_bytes, uploaded_bytes = uploads.join()
+    finally:
+        # Shutdown also waits for the done-callbacks that record shards
+        uploads.shutdown(wait=True, cancel_futures=True)
+
+    checkpoint.finish_run()
+    save_tuner(tuner)
+    logging.info(f"Incremental run {run['run_id']} complete. High-water mark: {run['end']}")
+    return total_docs, raw_bytes, uploaded_bytes
+
+# -----------------------------------------------------------
+# Change-stream tailing
+# -----------------------------------------------------------
+TAIL_CHECKPOINT_FILE = os.path.join(TEMP_DIR, "summary_tail.json")
+# A tail shard is uploaded once it holds ROLL_BYTES of rows or its
+# first event is ROLL_SECONDS old, whichever comes first
+ROLL_BYTES = 64 * 1024 * 1024
+ROLL_SECONDS = 60
+# How long one getMore waits for new events, so idle shards still roll
+TAIL_AWAIT_MS = 1000
+# ChangeStreamFatalError, ChangeStreamHistoryLost: the resume token is
+# no longer in the oplog, so the events after it can't be replayed
+HISTORY_LOST_CODES = (280, 286)
+
+def history_lost(error, resume_token):
+    """Error telling how to recover from a resume token the oplog no longer holds."""
+    return RuntimeError(
+        f"Change stream cannot resume after {resume_token}, the oplog no longer holds it ({error}). "
+        f"Backfill the missed inserts with --incremental or a full export, then delete the "
+        f"tail checkpoint to tail from now."
+    )
+
+def watch_summary(summary_col, resume_token=None, mongo_options=None):
+    """
+    Change stream of inserts into the summary collection, resumed after
+    `resume_token`. `fullDocument` is projected to the fields of
+    `summary_schema` unless `projection` is off in `mongo_options`.
+    """
+    opts = mongo_options or {}
+    pipeline = [{"$match": {"operationType": "insert"}}]
+    if opts.get("projection", True):
+        fields = {f"fullDocument.{field}": 1 for field in schema_projection(summary_schema)}
+        pipeline.append({"$project": {"operationType": 1, **fields}})
+    try:
+        return summary_col.watch(
+            pipeline,
+            resume_after=resume_token,
+            max_await_time_ms=TAIL_AWAIT_MS,
+            batch_size=opts.get("batch_size") or MONGO_BATCH,
+        )
+    except OperationFailure as e:
+        if e.code in HISTORY_LOST_CODES:
+            raise history_lost(e, resume_token) from e
+        raise
+
+def export_tail(checkpoint_path=TAIL_CHECKPOINT_FILE, shard_options=None, mongo_options=None,
+                upload_options=None, tail_options=None, stop=None, dedup=None):
+    """
+    Continuously export inserts into the summary collection from a
+    change stream, resuming after the token in `checkpoint_path`.
+
+    Events are normalized like the batch export into day shards named
+    `dt=YYYY-MM-DD/summary_tail_<run_id>_00000.jsonl.gz`. A shard is
+    uploaded as soon as it holds `roll_bytes` of rows or is
+    `roll_seconds` old (see `tail_options`, ROLL_BYTES and
+    ROLL_SECONDS), or when an event of another day arrives, so the
+    GCS-triggered loader appends it to its glamira_raw partition within
+    about a minute. The resume token is saved once every shard up to it
+    is uploaded.
+
+    Every uploaded shard is added to its day's manifest (see
+    DayManifests). Runs until `stop` (a threading.Event) is set or on
+    Ctrl+C; the open shard is then uploaded and its token saved. With a `dedup`
+    DedupIndex, events already exported (e.g. replayed after a crash)
+    are dropped.
+
+    The same happens before raising when the stream ends for good: it
+    was invalidated (the collection was dropped or renamed), or its
+    resume token fell off the oplog (HISTORY_LOST_CODES; also raised
+    when starting from such a token), so events were missed.
+
+    Returns (docs, raw bytes, uploaded bytes).
+    """
+    os.makedirs(SUMMARY_TMP_DIR, exist_ok=True)
+    checkpoint = TailCheckpoint(checkpoint_path)
+    summary_col = get_summary_collection(mongo_options)
+    bucket = get_bucket()
+    manifests = DayManifests(bucket, BLOB_PREFIX)
+
+    opts = tail_options or {}
+    roll_bytes = opts.get("roll_bytes") or ROLL_BYTES
+    roll_seconds = opts.get("roll_seconds") or ROLL_SECONDS
+    shard_options = dict(shard_options or {})
+    shard_options.pop("profile", None)
+    # Tail shards roll by roll_bytes instead
+    shard_options.pop("shard_bytes", None)
+    geoip = shard_options.pop("geoip", None)
+    enrich = IpLocations.from_csv(geoip).enrich if geoip else None
+    suffix = shard_extension(shard_options.get("file_format", "jsonl"),
+                                 shard_options.get("compression", DEFAULT_COMPRESSION))
+
+    normalize = compile_normalizer(summary_schema)
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    clock = time.perf_counter
+    # (upload future, resume token after the shard's last event), in order
+    pending = collections.deque()
+    shard = None
+    shard_day = None
+    shard_ids = bytearray()
+    shard_docs = 0
+    opened_at = 0.0
+    index = 0
+    total_docs = 0
+    normalize_seconds = 0.0
+
+    def roll(token):
+        nonlocal shard, shard_ids, normalize_seconds
+        blob, day, docs = shard.blob, shard_day, shard_docs
+        future = shard.close()
+        if dedup is not None:
+            ids, shard_ids = bytes(shard_ids), bytearray()
+            future.add_done_callback(lambda f: f.exception() is None and dedup.commit(ids))
+        future.add_done_callback(
+            lambda f: f.exception() is None and manifests.add(shard_entry(blob, day, docs))
+        )
+        pending.append((future, token))
+        METRICS.record("normalize", normalize_seconds, shard_docs)
+        normalize_seconds = 0.0
+        logging.info(
+            f"Rolled {blob.name} | docs: {shard_docs}, {shard.bytes_written} bytes, "
+            f"age {clock() - opened_at:.1f}s"
+        )
+        shard = None
+
+    def save_uploaded():
+        # Move the token past the longest prefix of uploaded shards
+        token = None
+        shards = 0
+        while pending and pending[0][0].done():
+            future, token = pending.popleft()
+            future.result()
+            shards += 1
+        if token is not None:
+            checkpoint.save(token, shards)
+
+    logging.info(f"Tailing summary changes after {checkpoint.resume_token} (run {run_id})")
+    # Why the stream ended for good, raised once the open shard is uploaded
+    ended = None
+    uploads = open_uploads(upload_options)
+    try:
+        with watch_summary(summary_col, checkpoint.resume_token, mongo_options) as changes:
+            try:
+                while stop is None or not stop.is_set():
+                    if not changes.alive:
+                        ended = RuntimeError(
+                            f"Change stream invalidated after {changes.resume_token} "
+                            f"({SUMMARY_COLLECTION} dropped or renamed?)"
+                        )
+                        break
+                    # Token after the previous event, where a shard ends
+                    # when this event belongs to another day
+                    previous_token = changes.resume_token
+                    change = changes.try_next()
+                    if change is not None:
+                        doc = change["fullDocument"]
+                        oid = doc["_id"]
+                        if dedup is not None and isinstance(oid, ObjectId) and oid in dedup:
+                            continue
+                        start = clock()
+                        normalized_doc = normalize(doc)
+                        day = normalized_doc[PARTITION_FIELD] = event_date(normalized_doc["time_stamp"], oid)
+                        if enrich is not None:
+                            enrich(normalized_doc)
+                        normalize_seconds += clock() - start
+                        if shard is not None and day != shard_day:
+                            roll(previous_token)
+                        if shard is None:
+                            blob_path = f"{day_prefix(day)}/summary_tail_{run_id}_{index:05d}{suffix}"
+                            shard = open_shard(bucket.blob(blob_path), uploads, **shard_options)
+                            shard_day = day
+                            opened_at = clock()
+                            shard_docs = 0
+                            index += 1
+                        if dedup is not None and isinstance(oid, ObjectId):
+                            shard_ids += oid.binary
+                        shard.write_doc(normalized_doc)
+                        shard_docs += 1
+                        total_docs += 1
+
+                    if shard is not None and (shard.size >= roll_bytes
+                                              or clock() - opened_at >= roll_seconds):
+                        roll(changes.resume_token)
+                    elif shard is None and not pending and changes.resume_token is not None:
+                        # Idle with everything shipped: skip filtered events on restart
+                        checkpoint.save(changes.resume_token)
+                    save_uploaded()
+            except KeyboardInterrupt:
+                logging.info("Stopping the tail")
+            except OperationFailure as e:
+                if e.code not in HISTORY_LOST_CODES:
+                    raise
+                ended = history_lost(e, changes.resume_token)
 
-        # Wait for all uploads to finish
-        for f in futures:
-            f.result()
+            if shard is not None:
+                roll(changes.resume_token)
+        raw_bytes, uploaded_bytes = uploads.join()
+        save_uploaded()
+    except BaseException:
+        if shard is not None:
+            shard.abort()
+        raise
+    finally:
+        uploads.shutdown(wait=True, cancel_futures=True)
 
-        executor.shutdown(wait=True)
+    logging.info(f"Tail stopped. Docs: {total_docs}, shards: {index}, resume token: {checkpoint.resume_token}")
+    if ended is not None:
+        raise ended
+    return total_docs, raw_bytes, uploaded_bytes
+
+# -----------------------------------------------------------
+# Partitioning
+# -----------------------------------------------------------
+SAMPLE_PER_PARTITION = 100
+
+def compute_split_points(summary_col, partitions):
+    """
+    Return up to `partitions - 1` ascending `_id` split points.
+
+    Split points are quantiles of a random `$sample` of `_id`s, so ranges
+    hold roughly equal document counts even when inserts were bursty.
+    If sampling returns nothing useful, fall back to evenly spaced
+    ObjectIds between the collection's min and max ObjectId `_id`.
+    Split points are always ObjectIds; `_id`s of other types go to the
+    first range (see range_query).
+    """
+    if partitions <= 1:
+        return []
+
+    sample = summary_col.aggregate([
+        {"$sample": {"size": partitions * SAMPLE_PER_PARTITION}},
+        {"$project": {"_id": 1}},
+    ])
+    ids = sorted({d["_id"] for d in sample if isinstance(d["_id"], ObjectId)})
+
+    if len(ids) >= partitions:
+        points = [ids[len(ids) * i // partitions] for i in range(1, partitions)]
+    else:
+        object_ids = {"_id": {"$type": "objectId"}}
+        first = summary_col.find_one(object_ids, {"_id": 1}, sort=[("_id", 1)])
+        last = summary_col.find_one(object_ids, {"_id": 1}, sort=[("_id", -1)])
+        if not first or not last:
+            return []
+        lo = int.from_bytes(first["_id"].binary, "big")
+        hi = int.from_bytes(last["_id"].binary, "big")
+        points = [
+            ObjectId((lo + (hi - lo) * i // partitions).to_bytes(12, "big"))
+            for i in range(1, partitions)
+        ]
+
+    # Drop duplicates so no range is empty by construction
+    return sorted(set(points))
+
+def partition_ranges(split_points):
+    """Turn split points into [(lo, hi), ...] with open ends as None."""
+    bounds = [None, *split_points, None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def range_query(lo, hi):
+    """
+    Mongo filter for lo <= _id < hi (None means unbounded).
+
+    Comparisons only match `_id`s of the bounds' type, so a range that
+    starts unbounded also takes every `_id` that isn't an ObjectId;
+    the ranges of partition_ranges then cover the whole collection.
+    """
+    cond = {}
+    if lo is not None:
+        cond["$gte"] = lo
+    if hi is not None:
+        cond["$lt"] = hi
+    if not cond:
+        return {}
+    if lo is None:
+        return {"$or": [{"_id": cond}, {"_id": {"$not": {"$type": "objectId"}}}]}
+    return {"_id": cond}
+
+def export_partition(partition, lo, hi, progress_queue=None, shard_options=None, mongo_options=None,
+                     upload_options=None, metrics_options=None, adaptive=False):
+    """
+    Worker-process entry point: export one `_id` range with its own
+    Mongo cursor, GCS client, normalizer and shard sequence.
+
+    The worker reports its own METRICS, and profile if asked, to the
+    configured paths with a `_pNN` suffix. With `adaptive` it tunes its
+    own cursor and uploads (see open_tuner).
+
+    Returns (partition, docs, raw bytes, uploaded bytes, manifest
+    entries of its shards); the coordinator writes the day manifests.
+    """
+    setup_logging()
+    summary_col = get_summary_collection(mongo_options)
+    bucket = get_bucket()
+
+    suffix = f"_p{partition:02d}"
+    shard_options = dict(shard_options or {})
+    shard_options["profile"] = suffixed_path(shard_options.get("profile"), suffix)
+    reporter = start_metrics(metrics_options, suffix, labels={"partition": partition})
+
+    def on_progress(docs):
+        if progress_queue is not None:
+            progress_queue.put((partition, docs))
+
+    manifests = DayManifests(bucket, BLOB_PREFIX, replace=True)
+    tuner = open_tuner(adaptive, mongo_options, upload_options)
+    uploads = open_uploads(upload_options, tuner)
+    try:
+        cursor = find_summary(summary_col, range_query(lo, hi), mongo_options, tuner=tuner)
+        try:
+            shard_prefix = f"summary_p{partition:02d}"
+            total_docs = write_shards(
+                cursor, bucket, uploads,
+                shard_prefix=shard_prefix,
+                first_index=next_shard_index(bucket, shard_prefix),
+                on_progress=on_progress,
+                manifests=manifests,
+                tuner=tuner,
+                **shard_options,
+            )
+        finally:
+            cursor.close()
+        raw_bytes, uploaded_bytes = uploads.join()
+    finally:
+        uploads.shutdown(wait=True, cancel_futures=True)
+        reporter.stop()
+
+    save_tuner(tuner)
+    logging.info(f"Partition {partition} complete. Docs: {total_docs}")
+    return partition, total_docs, raw_bytes, uploaded_bytes, manifests.entries
+
+def export_partitioned(partitions, shard_options=None, mongo_options=None, upload_options=None,
+                       metrics_options=None, adaptive=False):
+    """
+    Coordinator: split the collection into `partitions` `_id` ranges,
+    export each in its own process and merge progress and failures.
+    Once every partition succeeded, the manifest of each day written
+    is replaced to list the shards of all partitions, and the shards of
+    earlier full exports of those days are deleted.
+
+    Returns (docs, raw bytes, uploaded bytes) summed over partitions.
+    """
+    summary_col = get_summary_collection(mongo_options)
+    ranges = partition_ranges(compute_split_points(summary_col, partitions))
+    manifests = DayManifests(get_bucket(), BLOB_PREFIX, replace=True)
+    logging.info(f"Exporting {len(ranges)} partitions")
+
+    progress = {}
+    failures = []
+    total_docs = raw_bytes = uploaded_bytes = 0
+
+    with multiprocessing.Manager() as manager:
+        progress_queue = manager.Queue()
+
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            pending = {
+                pool.submit(export_partition, i, lo, hi, progress_queue, shard_options,
+                            mongo_options, upload_options, metrics_options, adaptive): i
+                for i, (lo, hi) in enumerate(ranges)
+            }
+
+            while pending:
+                done, _ = wait(pending, timeout=5, return_when=FIRST_COMPLETED)
+
+                while not progress_queue.empty():
+                    partition, docs = progress_queue.get()
+                    progress[partition] = docs
+                if progress:
+                    logging.info(f"Exported {sum(progress.values())} documents so far...")
+
+                for f in done:
+                    partition = pending.pop(f)
+                    try:
+                        _, docs, raw, uploaded, entries = f.result()
+                        manifests.entries.extend(entries)
+                        progress[partition] = docs
+                        total_docs += docs
+                        raw_bytes += raw
+                        uploaded_bytes += uploaded
+                    except Exception as e:
+                        logging.error(f"Partition {partition} failed: {e}")
+                        failures.append((partition, e))
+
+    if failures:
+        failed = ", ".join(str(p) for p, _ in sorted(failures, key=lambda x: x[0]))
+        raise RuntimeError(f"{len(failures)} partition(s) failed: {failed}")
+
+    manifests.commit()
+    clear_stale_shards(manifests.bucket, manifests)
+    return total_docs, raw_bytes, uploaded_bytes
+
+# -----------------------------------------------------------
+# Main export function
+# -----------------------------------------------------------
+def export_to_gcs(partitions=1, incremental=False, stream=False, compression=DEFAULT_COMPRESSION,
+                  file_format="jsonl", serializer=DEFAULT_SERIALIZER, mongo_options=None,
+                  upload_options=None, metrics_options=None, profile=None, dedup=False,
+                  tail=False, tail_options=None, geoip=None, shard_bytes=None, adaptive=False):
+    """
+    Export the summary collection to GCS as JSONL shards, one day of
+    events per shard under `dt=YYYY-MM-DD/` (see `write_shards`), each
+    day listed with row counts and checksums in its `_manifest.json`
+    (see DayManifests). Once it succeeded, a full export replaces the
+    manifest of every day it wrote, and its earlier shards of that day,
+    so load_data.py loads exactly this run's shards.
+
+    With `partitions` > 1 the collection is split into `_id` ranges that
+    are exported in parallel worker processes. With `incremental` only
+    documents newer than the checkpoint's high-water mark are exported.
+    With `stream` shards are uploaded as they are written, without
+    local temp files. Shards are compressed with `compression` (gzip by
+    default, which BigQuery loads directly) on the upload threads.
+    `file_format` 'parquet' writes columnar shards instead of JSONL,
+    with `compression` as the Parquet codec. `serializer` selects the
+    JSON backend ('auto' uses orjson when installed). `mongo_options`
+    tunes the Mongo side (see `get_summary_collection` and
+    `find_summary`), `upload_options` the upload backpressure (see
+    `open_uploads`). `metrics_options` configures the per-stage metrics
+    reports (see `start_metrics`); `profile` is a path for collapsed
+    stacks sampled from the export loop. With `dedup` documents whose
+    `_id` was exported by an earlier dedup run are dropped, so shards
+    can be appended to glamira_raw without duplicates (see DEDUP_DIR).
+    With `tail` inserts are exported continuously from a change stream
+    instead (see `export_tail` for `tail_options`). `geoip` is the path
+    of an ip_location_results.csv whose country, region and city are
+    added to every doc by its `ip` (see geoip.py). Shards are cut at
+    `shard_bytes` of rows (SHARD_BYTES by default). With `adaptive` the
+    cursor batch size and upload concurrency are tuned while the export
+    runs, starting from what the last adaptive run ended with (see
+    open_tuner and tuning.py).
+    """
+    setup_logging()
+    logging.info("START export_to_gcs")
+    started = time.perf_counter()
+    shard_options = {
+        "stream": stream,
+        "compression": compression,
+        "file_format": file_format,
+        "serializer": serializer,
+        "profile": profile,
+        "geoip": geoip,
+        "shard_bytes": shard_bytes,
+    }
+    # Partition workers run their own reporters
+    reporter = start_metrics(metrics_options) if partitions <= 1 else None
+
+    try:
+        logging.info("START exporting MongoDB summary collection")
+
+        if incremental and partitions > 1:
+            raise ValueError("incremental export does not support partitions")
+        if tail and (incremental or partitions > 1):
+            raise ValueError("tail supports neither partitions nor incremental export")
+        if tail and adaptive:
+            # Change stream batches are sized by the server's await time
+            raise ValueError("tail does not support adaptive tuning")
+        if dedup and (incremental or partitions > 1):
+            # Incremental runs never re-export; a resumed run would also
+            # overwrite shards whose ids were already committed
+            raise ValueError("dedup supports neither partitions nor incremental export")
+
+        if tail:
+            dedup_index = DedupIndex(DEDUP_DIR) if dedup else None
+            try:
+                total_docs, raw_bytes, uploaded_bytes = export_tail(
+                    shard_options=shard_options, mongo_options=mongo_options,
+                    upload_options=upload_options, tail_options=tail_options, dedup=dedup_index,
+                )
+            finally:
+                if dedup_index is not None:
+                    dedup_index.close()
+        elif incremental:
+            total_docs, raw_bytes, uploaded_bytes = export_incremental(
+                shard_options=shard_options, mongo_options=mongo_options,
+                upload_options=upload_options, adaptive=adaptive,
+            )
+        elif partitions > 1:
+            total_docs, raw_bytes, uploaded_bytes = export_partitioned(
+                partitions, shard_options=shard_options, mongo_options=mongo_options,
+                upload_options=upload_options, metrics_options=metrics_options, adaptive=adaptive,
+            )
+        else:
+            summary_col = get_summary_collection(mongo_options)
+            bucket = get_bucket()
+
+            dedup_index = DedupIndex(DEDUP_DIR) if dedup else None
+            # Dedup runs only add shards, to the day manifests as they go
+            manifests = DayManifests(bucket, BLOB_PREFIX, replace=not dedup)
+            tuner = open_tuner(adaptive, mongo_options, upload_options)
+            uploads = open_uploads(upload_options, tuner)
+            try:
+                cursor = find_summary(summary_col, {}, mongo_options, tuner=tuner)
+                try:
+                    total_docs = write_shards(cursor, bucket, uploads, dedup=dedup_index,
+                                              first_index=next_shard_index(bucket, "summary"),
+                                              manifests=manifests, tuner=tuner, **shard_options)
+                finally:
+                    cursor.close()
+
+                # Wait for all uploads to finish
+                raw_bytes, uploaded_bytes = uploads.join()
+            finally:
+                # Shutdown also waits for the done-callbacks that commit
+                # ids and collect manifest entries
+                uploads.shutdown(wait=True, cancel_futures=True)
+                if dedup_index is not None:
+                    dedup_index.close()
+            if manifests.replace:
+                manifests.commit()
+                clear_stale_shards(bucket, manifests)
+            save_tuner(tuner)
+
+        elapsed = time.perf_counter() - started
         logging.info(f"MongoDB export complete. Total docs: {total_docs}")
+        logging.info(
+            f"Uploaded {uploaded_bytes} bytes ({compression}) vs {raw_bytes} bytes uncompressed "
+            f"({uploaded_bytes / max(raw_bytes, 1):.1%}) in {elapsed:.1f}s"
+        )
         print("SUCCESS: Export completed.")
 
     except Exception as e:
         logging.exception("ERROR in export_to_gcs")
         print("FAILED. Check export_to_gcs.log.")
 
+    finally:
+        if reporter:
+            reporter.stop()
+
 # -----------------------------------------------------------
 # Run export
 # -----------------------------------------------------------
 if __name__ == "__main__":
-    export_to_gcs()
+    parser = argparse.ArgumentParser(description="Export the summary collection to GCS")
+    parser.add_argument("--partitions", type=int, default=1,
+                        help="number of _id ranges exported in parallel processes")
+    parser.add_argument("--incremental", action="store_true",
+                        help="export only documents newer than the checkpoint, resuming an unfinished run")
+    parser.add_argument("--stream", action="store_true",
+                        help="upload shards as they are written instead of via local temp files")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default=DEFAULT_COMPRESSION,
+                        help="shard compression (only gzip is loadable by BigQuery)")
+    parser.add_argument("--format", dest="file_format", choices=FORMATS, default="jsonl",
+                        help="shard file format (parquet needs pyarrow)")
+    parser.add_argument("--serializer", choices=SERIALIZERS, default=DEFAULT_SERIALIZER,
+                        help="JSONL serializer backend")
+    parser.add_argument("--mongo-compressors",
+                        help='wire compression to negotiate, e.g. "zstd,snappy,zlib"')
+    parser.add_argument("--mongo-batch", type=int, default=MONGO_BATCH,
+                        help="documents per cursor batch")
+    parser.add_argument("--raw-bson", action="store_true",
+                        help="decode documents lazily as RawBSONDocument")
+    parser.add_argument("--no-projection", dest="projection", action="store_false",
+                        help="fetch whole documents instead of the summary_schema fields")
+    parser.add_argument("--max-inflight", type=int, default=MAX_WORKERS,
+                        help="shards uploading at once before the export blocks")
+    parser.add_argument("--shard-mb", type=float, default=SHARD_BYTES / 1024 ** 2,
+                        help="cut a shard once it holds this many MB of rows (uncompressed)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="tune --mongo-batch and --max-inflight while exporting, "
+                             "starting from the last adaptive run's values")
+    parser.add_argument("--max-tmp-gb", type=float, default=MAX_TMP_BYTES / 1024 ** 3,
+                        help="pause the export while local temp shards take more than this (0 disables)")
+    parser.add_argument("--metrics",
+                        help="write per-stage metrics to this file (.prom: Prometheus textfile, else JSON)")
+    parser.add_argument("--metrics-every", type=float, default=METRICS_EVERY,
+                        help="seconds between metrics reports")
+    parser.add_argument("--dedup", action="store_true",
+                        help="drop documents exported by an earlier --dedup run (not with --partitions/--incremental)")
+    parser.add_argument("--tail", action="store_true",
+                        help="export inserts continuously from a change stream (needs a replica set)")
+    parser.add_argument("--roll-mb", type=float, default=ROLL_BYTES / 1024 ** 2,
+                        help="with --tail, upload a shard once it holds this many MB of rows")
+    parser.add_argument("--roll-seconds", type=float, default=ROLL_SECONDS,
+                        help="with --tail, upload a shard once its first event is this old")
+    parser.add_argument("--geoip", nargs="?", const=IP_LOCATION_CSV,
+                        help="add country/region/city from this ip_location_results.csv "
+                             "(default path if no value)")
+    parser.add_argument("--profile",
+                        help="sample the export loop and write collapsed stacks to this file")
+    args = parser.parse_args()
+
+    export_to_gcs(
+        partitions=args.partitions,
+        incremental=args.incremental,
+        stream=args.stream,
+        compression=args.compression,
+        file_format=args.file_format,
+        serializer=args.serializer,
+        mongo_options={
+            "compressors": args.mongo_compressors,
+            "batch_size": args.mongo_batch,
+            "raw_bson": args.raw_bson,
+            "projection": args.projection,
+        },
+        upload_options={
+            "max_in_flight": args.max_inflight,
+            "max_tmp_bytes": int(args.max_tmp_gb * 1024 ** 3) or None,
+        },
+        metrics_options={"path": args.metrics, "every": args.metrics_every},
+        profile=args.profile,
+        dedup=args.dedup,
+        tail=args.tail,
+        tail_options={
+            "roll_bytes": int(args.roll_mb * 1024 ** 2),
+            "roll_seconds": args.roll_seconds,
+        },
+        geoip=args.geoip,
+        shard_bytes=int(args.shard_mb * 1024 ** 2),
+        adaptive=args.adaptive,
+    )
@@ -1,14 +1,114 @@
-import csv
-import json
+import argparse
+import collections
 import os
 import logging
+import time
 from google.oauth2 import service_account
 from google.cloud import storage
 from pymongo import MongoClient
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from project6.compression import COMPRESSIONS, DEFAULT_COMPRESSION, compress_file, extension
+from project6.csv_convert import DEFAULT_ENGINE, ENGINES, convert_csv, csv_chunks, field_types, merge_parts
+from project6.gcs_compose import upload_from_path
+from project6.manifest import Manifest, file_fingerprint, same_content
+from project6.load_data import crawl_product_ids_schema, ip_location_schema, product_ids_to_crawl_schema
+from project6.metrics import METRICS, METRICS_EVERY, MetricsReporter
+from project6.serializers import DEFAULT_SERIALIZER, SERIALIZERS
+
+# Columns are cast to the types BigQuery loads them as (see load_data.py)
+CSV_SCHEMAS = {
+    "ip_location_results": ip_location_schema,
+    "product_ids_to_crawl": product_ids_to_crawl_schema,
+    "product_info": crawl_product_ids_schema,
+}
+
+# Fingerprints of the exported CSVs and their uploads, in TEMP_DIR
+MANIFEST_NAME = "csv_export_manifest.json"
+
+# CSVs larger than CHUNK_BYTES are converted in parallel byte-range chunks
+CHUNK_BYTES = 64 * 1024 * 1024
+CONVERT_WORKERS = os.cpu_count() or 1
+UPLOAD_WORKERS = 3
+
+
+def compress_and_upload(blob, jsonl_file, compression, storage_client):
+    """
+    Compress a converted JSONL file and upload it to `blob`.
+    Returns (raw bytes, uploaded bytes).
+    """
+    raw_bytes = os.path.getsize(jsonl_file)
+    with METRICS.timer("compress", 1, raw_bytes):
+        upload_path = compress_file(jsonl_file, compression)
+    uploaded_bytes = os.path.getsize(upload_path)
+
+    # IMPORTANT: Force passing the client for credentials
+    # (large files go up as parallel composite parts, see gcs_compose.py)
+    with METRICS.timer("upload", 1, uploaded_bytes):
+        upload_from_path(
+            blob,
+            upload_path,
+            timeout=1200,
+            client=storage_client
+        )
+
+    if upload_path != jsonl_file:
+        os.remove(upload_path)
+
+    logging.info(f"Upload successful: {blob.name}")
+    return raw_bytes, uploaded_bytes
+
+
+def convert_part(csv_file, out_path, types, byte_range, options):
+    """
+    Conversion task for the process pool: convert one chunk of
+    `csv_file` (the whole file if `byte_range` is None).
+    Returns (rows, seconds, cast failures per column); metrics are
+    recorded by the parent, worker processes have their own METRICS.
+    """
+    started = time.perf_counter()
+    failures = collections.Counter()
+    rows = convert_csv(csv_file, out_path, types, byte_range=byte_range, failures=failures, **options)
+    return rows, time.perf_counter() - started, failures
+
+
+def merge_and_upload(blob, jsonl_file, parts, file_format, parquet_compression,
+                     compression, storage_client):
+    """
+    Upload task: merge converted chunks into `jsonl_file`, then
+    compress and upload it. Returns (raw bytes, uploaded bytes, seconds).
+    """
+    started = time.perf_counter()
+    if parts != [jsonl_file]:
+        merge_parts(parts, jsonl_file, file_format, parquet_compression)
+    raw_bytes, uploaded_bytes = compress_and_upload(blob, jsonl_file, compression, storage_client)
+    return raw_bytes, uploaded_bytes, time.perf_counter() - started
+
+
+def is_unchanged(entry, source, settings, remote):
+    """
+    True if the manifest `entry` of a CSV recorded the same source bytes
+    and conversion settings, and `remote`, its GCS object (None if
+    missing), is still the generation that run uploaded.
+    """
+    return (
+        entry is not None and remote is not None
+        and same_content(entry["source"], source)
+        and entry["settings"] == settings
+        and entry["generation"] == remote.generation
+        and entry["crc32c"] == remote.crc32c
+    )
 
 
-def export_to_gcs():
+def export_to_gcs(compression=DEFAULT_COMPRESSION, serializer=DEFAULT_SERIALIZER,
+                  engine=DEFAULT_ENGINE, file_format="jsonl",
+                  convert_workers=CONVERT_WORKERS, chunk_bytes=CHUNK_BYTES,
+                  metrics_options=None, force=False):
+    """
+    Convert the three CSVs and upload them to GCS. A CSV whose bytes,
+    conversion settings and uploaded object are unchanged since the
+    last export (see MANIFEST_NAME) is skipped, unless `force`.
+    """
 
     # -----------------------------------------------------------
     # Logging setup
@@ -74,68 +174,169 @@ def export_to_gcs():
             os.makedirs(TEMP_DIR)
             logging.info(f"Created TEMP directory: {TEMP_DIR}")
 
-        # -----------------------------------------------------------
-        # Process each CSV
-        # -----------------------------------------------------------
-        for csv_file in csv_files:
-            logging.info(f"Processing file: {csv_file}")
-
-            base_name = os.path.splitext(os.path.basename(csv_file))[0]
-            # timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            # jsonl_file = os.path.join(TEMP_DIR, f"{base_name}_{timestamp}.jsonl")
-
-            jsonl_file = os.path.join(TEMP_DIR, f"{base_name}.jsonl")
-
-            logging.info(f"Converting {csv_file} to {jsonl_file}")
-
-            # Convert CSV → JSONL
-            with open(csv_file, "r", encoding="utf-8") as f_in, \
-                 open(jsonl_file, "w", encoding="utf-8") as f_out:
-
-                reader = csv.reader(f_in)
-                headers = next(reader)
-
-                batch = []
-                batch_size = 50000
-                total = 0
-
-                for row in reader:
-                    doc = {headers[i]: row[i] for i in range(len(headers))}
-                    batch.append(doc)
-                    total += 1
-
-                    if len(batch) >= batch_size:
-                        for item in batch:
-                            f_out.write(json.dumps(item) + "\n")
-                        batch.clear()
-
-                # Write final batch
-                for item in batch:
-                    f_out.write(json.dumps(item) + "\n")
-
-            logging.info(f"CSV → JSONL complete. Rows: {total}")
-
+        options = {
+            "file_format": file_format,
+            "engine": engine,
+            "serializer": serializer,
+            "compression": compression,
+        }
+        # Parquet is compressed per column chunk by convert_csv
+        file_compression = "none" if file_format == "parquet" else compression
+        bucket = storage_client.bucket(BUCKET_NAME)
+        manifest = Manifest(os.path.join(TEMP_DIR, MANIFEST_NAME))
+
+        # Conversions are CPU-bound and run in worker processes; uploads
+        # wait on the network and run on threads. A file's upload starts
+        # as soon as its last chunk is converted.
+        if convert_workers > 0:
+            convert_pool = ProcessPoolExecutor(max_workers=convert_workers)
+        else:
+            convert_pool = ThreadPoolExecutor(max_workers=1)
+        upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+        metrics_options = metrics_options or {}
+        reporter = MetricsReporter(
+            path=metrics_options.get("path"),
+            interval=metrics_options.get("every") or METRICS_EVERY,
+            labels={"job": "export_csv"},
+        ).start()
+        started = time.perf_counter()
+
+        try:
             # -----------------------------------------------------------
-            # Upload to GCS
+            # Submit every chunk of every CSV
             # -----------------------------------------------------------
-            bucket = storage_client.bucket(BUCKET_NAME)
-
-            # blob_path = f"project6_export/{base_name}_{timestamp}.jsonl"
-
-            blob_path = f"dataset_export/{base_name}.jsonl"
-            blob = bucket.blob(blob_path)
-
-            logging.info(f"Uploading to gs://{BUCKET_NAME}/{blob_path}")
-
-            # IMPORTANT: Force passing the client for credentials
-            blob.upload_from_filename(
-                jsonl_file,
-                timeout=1200,
-                client=storage_client
-            )
-
-            logging.info(f"Upload successful: {blob_path}")
+            files = {}
+            part_futures = {}
+            skipped = 0
+            for csv_file in csv_files:
+                base_name = os.path.splitext(os.path.basename(csv_file))[0]
+                # timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                # jsonl_file = os.path.join(TEMP_DIR, f"{base_name}_{timestamp}.jsonl")
+
+                jsonl_file = os.path.join(TEMP_DIR, f"{base_name}.{file_format}")
+                types = field_types(CSV_SCHEMAS.get(base_name, []))
+
+                # blob_path = f"project6_export/{base_name}_{timestamp}.jsonl"
+
+                if file_format == "parquet":
+                    blob_path = f"dataset_export/{base_name}.parquet"
+                else:
+                    blob_path = f"dataset_export/{base_name}.jsonl{extension(compression)}"
+
+                # Skip the CSV if neither it nor its upload changed
+                entry = manifest.get(base_name)
+                with METRICS.timer("fingerprint", 1):
+                    source = file_fingerprint(csv_file, entry and entry["source"])
+                settings = {"file_format": file_format, "compression": compression, "types": types}
+                if not force and is_unchanged(entry, source, settings, bucket.get_blob(blob_path)):
+                    if source != entry["source"]:
+                        manifest.put(base_name, {**entry, "source": source})  # touched only
+                    logging.info(f"{base_name}: unchanged since {entry['exported_at']}, skipped")
+                    skipped += 1
+                    continue
+
+                # Large CSVs are split at line ends into byte ranges
+                # converted in parallel, then merged before upload
+                ranges = csv_chunks(csv_file, chunk_bytes)
+                if len(ranges) == 1:
+                    parts = [(jsonl_file, None)]
+                else:
+                    parts = [(f"{jsonl_file}.part{i:04d}", r) for i, r in enumerate(ranges)]
+
+                logging.info(f"Converting {csv_file} to {jsonl_file} in {len(parts)} chunk(s)")
+
+                files[base_name] = {
+                    "blob_path": blob_path,
+                    "source": source,
+                    "settings": settings,
+                    "jsonl_file": jsonl_file,
+                    "parts": [part for part, _ in parts],
+                    "pending": len(parts),
+                    "rows": 0,
+                    "convert_seconds": 0.0,
+                }
+                for part, byte_range in parts:
+                    future = convert_pool.submit(convert_part, csv_file, part, types, byte_range, options)
+                    part_futures[future] = base_name
 
+            # -----------------------------------------------------------
+            # Upload each file once all of its chunks are converted
+            # -----------------------------------------------------------
+            upload_futures = {}
+            for future in as_completed(part_futures):
+                base_name = part_futures[future]
+                info = files[base_name]
+                rows, seconds, failures = future.result()
+                METRICS.record("convert", seconds, rows)
+                for column, count in failures.items():
+                    METRICS.cast_failure(f"{base_name}.{column}", count)
+                info["rows"] += rows
+                info["convert_seconds"] += seconds
+                info["pending"] -= 1
+                if info["pending"]:
+                    continue
+
+                info["converted_at"] = time.perf_counter() - started
+                logging.info(f"CSV → {file_format} complete: {base_name}. Rows: {info['rows']}")
+
+                blob_path = info["blob_path"]
+                blob = bucket.blob(blob_path)
+                info["blob"] = blob
+
+                logging.info(f"Uploading to gs://{BUCKET_NAME}/{blob_path}")
+
+                upload = upload_pool.submit(
+                    merge_and_upload, blob, info["jsonl_file"], info["parts"],
+                    file_format, compression, file_compression, storage_client,
+                )
+                upload.add_done_callback(
+                    lambda _, info=info: info.update(uploaded_at=time.perf_counter() - started)
+                )
+                upload_futures[upload] = base_name
+
+            raw_bytes = 0
+            uploaded_bytes = 0
+            for future in as_completed(upload_futures):
+                base_name = upload_futures[future]
+                info = files[base_name]
+                raw, uploaded, upload_seconds = future.result()
+                raw_bytes += raw
+                uploaded_bytes += uploaded
+
+                # Record what was uploaded, for the next run's skip check
+                blob = info["blob"]
+                blob.reload(client=storage_client)
+                manifest.put(base_name, {
+                    "source": info["source"],
+                    "settings": info["settings"],
+                    "blob": blob.name,
+                    "generation": blob.generation,
+                    "crc32c": blob.crc32c,
+                    "rows": info["rows"],
+                    "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                })
+
+                # Per-file stage timings: CPU time of the conversion
+                # chunks, upload time, and when each stage finished
+                logging.info(
+                    f"{base_name}: {info['rows']} rows in {len(info['parts'])} chunk(s) | "
+                    f"convert {info['convert_seconds']:.1f}s "
+                    f"({info['rows'] / max(info['convert_seconds'], 1e-9):,.0f} rows/sec), "
+                    f"done at +{info['converted_at']:.1f}s | "
+                    f"merge+upload {upload_seconds:.1f}s, done at +{info['uploaded_at']:.1f}s"
+                )
+        finally:
+            convert_pool.shutdown(cancel_futures=True)
+            upload_pool.shutdown(cancel_futures=True)
+            reporter.stop()
+
+        elapsed = time.perf_counter() - started
+        logging.info(
+            f"Uploaded {uploaded_bytes} bytes ({file_compression}) vs {raw_bytes} bytes uncompressed "
+            f"({uploaded_bytes / max(raw_bytes, 1):.1%}) in {elapsed:.1f}s end to end"
+        )
+        if skipped:
+            logging.info(f"{skipped} of {len(csv_files)} files unchanged and skipped")
         logging.info("All files exported successfully")
         print("SUCCESS: Export completed.")
 
@@ -145,4 +346,35 @@ def export_to_gcs():
 
 
 if __name__ == "__main__":
-    export_to_gcs()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export CSV files to GCS as JSONL")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default=DEFAULT_COMPRESSION,
+                        help="output compression (only gzip is loadable by BigQuery)")
+    parser.add_argument("--serializer", choices=SERIALIZERS, default=DEFAULT_SERIALIZER,
+                        help="JSONL serializer backend")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="CSV reader (arrow casts whole columns, needs pyarrow)")
+    parser.add_argument("--format", dest="file_format", choices=("jsonl", "parquet"), default="jsonl",
+                        help="output file format")
+    parser.add_argument("--convert-workers", type=int, default=CONVERT_WORKERS,
+                        help="conversion processes (0 converts in this process, one chunk at a time)")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES // (1024 * 1024),
+                        help="split CSVs larger than this into parallel chunks (0 disables)")
+    parser.add_argument("--metrics", default=None,
+                        help="write stage metrics to this file (.prom for Prometheus, else JSON); "
+                             "default: log them")
+    parser.add_argument("--metrics-every", type=float, default=METRICS_EVERY,
+                        help="seconds between metrics reports")
+    parser.add_argument("--force", action="store_true",
+                        help="convert and upload every CSV, even if unchanged since the last export")
+    args = parser.parse_args()
+
+    export_to_gcs(
+        compression=args.compression,
+        serializer=args.serializer,
+        engine=args.engine,
+        file_format=args.file_format,
+        convert_workers=args.convert_workers,
+        chunk_bytes=args.chunk_mb * 1024 * 1024,
+        metrics_options={"path": args.metrics, "every": args.metrics_every},
+        force=args.force,
+    )
\ No newline at end of file
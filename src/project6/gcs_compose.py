@@ -0,0 +1,132 @@
+import base64
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import google_crc32c
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+from project6.gcs_stream import UPLOAD_TIMEOUT
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+# Files at least this large are uploaded as parallel parts + compose
+COMPOSE_THRESHOLD = 256 * 1024 * 1024
+PART_SIZE = 32 * 1024 * 1024
+# Parts buffered or uploading at once in this process, across all files
+# (the upload pools run several composite uploads side by side)
+MAX_PARALLEL_PARTS = 8
+# GCS composes at most 32 source objects per request
+MAX_COMPOSE_SOURCES = 32
+
+_part_executor = None
+_part_executor_lock = threading.Lock()
+_part_slots = threading.BoundedSemaphore(MAX_PARALLEL_PARTS)
+
+# -----------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------
+def encode_crc32c(checksum):
+    """Base64 big-endian CRC32C, the form GCS uses in `blob.crc32c`."""
+    return base64.b64encode(checksum.digest()).decode("ascii")
+
+def _upload_part(part, data, client=None, timeout=UPLOAD_TIMEOUT):
+    # checksum=None: the CRC32C is already set on the part and is
+    # verified by GCS, so the client doesn't hash the data again
+    try:
+        part.upload_from_string(
+            data,
+            content_type="application/octet-stream",
+            client=client,
+            checksum=None,
+            timeout=timeout,
+            retry=DEFAULT_RETRY,
+        )
+    finally:
+        _part_slots.release()
+
+def part_executor():
+    """Process-wide pool uploading the parts of every composite upload."""
+    global _part_executor
+    if _part_executor is None:
+        with _part_executor_lock:
+            if _part_executor is None:
+                _part_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_PARTS,
+                                                    thread_name_prefix="gcs-part")
+    return _part_executor
+
+# -----------------------------------------------------------
+# Parallel composite upload
+# -----------------------------------------------------------
+def upload_composite(blob, path, part_size=None, client=None, timeout=UPLOAD_TIMEOUT):
+    """
+    Upload `path` to `blob` as parallel part objects stitched together
+    with GCS compose, then delete the parts. `client` and `timeout` are
+    used for every part upload and the compose.
+
+    The file is read once. Each part's CRC32C and the whole file's
+    CRC32C are computed from the same buffers that are uploaded. GCS
+    checks every part against its CRC32C, and the composed object's
+    CRC32C is compared with the whole-file value, so nothing is read
+    twice. Parts grow beyond `part_size` (PART_SIZE by default) when
+    needed to stay within one compose request. Parts go up on one
+    process-wide pool, and at most MAX_PARALLEL_PARTS of them, of all
+    files, are buffered or uploading at once.
+
+    Returns the number of bytes uploaded.
+    """
+    size = os.path.getsize(path)
+    part_size = max(part_size or PART_SIZE, math.ceil(size / MAX_COMPOSE_SOURCES))
+    whole = google_crc32c.Checksum()
+    parts = []
+    futures = []
+
+    try:
+        with open(path, "rb") as f:
+            while True:
+                _part_slots.acquire()
+                # Fail fast instead of reading and sending the rest
+                failed = next((ft for ft in futures if ft.done() and ft.exception() is not None), None)
+                data = f.read(part_size) if failed is None else b""
+                if not data:
+                    _part_slots.release()
+                    break
+                whole.update(data)
+                part = blob.bucket.blob(f"{blob.name}.part{len(parts):04d}")
+                part.crc32c = encode_crc32c(google_crc32c.Checksum(data))
+                parts.append(part)
+                futures.append(part_executor().submit(_upload_part, part, data, client, timeout))
+
+        for future in futures:
+            future.result()
+
+        blob.compose(parts, client=client, timeout=timeout, retry=DEFAULT_RETRY)
+        expected = encode_crc32c(whole)
+        if blob.crc32c != expected:
+            blob.delete(client=client, timeout=timeout)
+            raise ValueError(
+                f"CRC32C mismatch for {blob.name}: composed {blob.crc32c}, local {expected}"
+            )
+        return size
+    finally:
+        if parts:
+            # Parts still uploading would be left behind
+            for future in futures:
+                future.exception()
+            blob.bucket.delete_blobs(parts, on_error=lambda _: None, client=client, timeout=timeout)
+
+def upload_from_path(blob, path, threshold=COMPOSE_THRESHOLD, **kwargs):
+    """
+    Upload `path` to `blob`: in one stream below `threshold` bytes
+    (None disables composite uploads), as a parallel composite upload
+    from there on. Extra keyword arguments (e.g. `client`, `timeout`)
+    go to `upload_from_filename`; composite uploads take `client` and
+    `timeout` only.
+    """
+    if threshold is not None and os.path.getsize(path) >= threshold:
+        upload_composite(blob, path, **kwargs)
+    else:
+        kwargs.setdefault("timeout", UPLOAD_TIMEOUT)
+        blob.upload_from_filename(path, **kwargs)
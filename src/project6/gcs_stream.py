@@ -0,0 +1,116 @@
+import queue
+import time
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+from project6.compression import compressor
+from project6.metrics import METRICS
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+# Resumable-upload chunks must be a multiple of 256 KB
+CHUNK_SIZE = 64 * 256 * 1024  # 16 MB
+MAX_PENDING_CHUNKS = 4
+UPLOAD_TIMEOUT = 1800
+
+_CLOSED = object()
+_ABORTED = object()
+
+# -----------------------------------------------------------
+# Streaming shard writer
+# -----------------------------------------------------------
+class GCSStreamWriter:
+    """
+    File-like object that streams a shard straight to a GCS blob
+    through resumable-upload chunks, with no local temp file.
+
+    `write()` takes bytes or text (encoded as UTF-8) and buffers it
+    until CHUNK_SIZE bytes, then hands the chunk to an upload task
+    running on `executor`. At most MAX_PENDING_CHUNKS chunks are queued,
+    so a slow upload blocks the producer instead of growing memory.
+
+    Chunks are compressed with `compression` on the upload task, off the
+    producer thread.
+
+    `close()` flushes the last chunk and returns the upload future,
+    without waiting for it. The future resolves to (raw bytes, uploaded
+    bytes) and fails if the upload failed.
+    `abort()` drops the shard without finalizing the GCS object.
+    Uses the same retry policy and timeout as `upload_from_filename`.
+    """
+
+    def __init__(self, blob, executor, chunk_size=CHUNK_SIZE, max_pending=MAX_PENDING_CHUNKS,
+                 compression="none"):
+        self.blob = blob
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self._buffer = bytearray()
+        self._chunks = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._future = executor.submit(self._upload)
+
+    def _upload(self):
+        chunk = None
+        raw_bytes = uploaded_bytes = 0
+        try:
+            comp = compressor(self.compression)
+            f_out = self.blob.open(
+                "wb",
+                chunk_size=self.chunk_size,
+                retry=DEFAULT_RETRY,
+                timeout=UPLOAD_TIMEOUT,
+            )
+            while True:
+                chunk = self._chunks.get()
+                if chunk is _ABORTED:
+                    # Not closing f_out leaves the GCS object unfinalized
+                    raise RuntimeError(f"Upload of {self.blob.name} aborted")
+                if chunk is _CLOSED:
+                    break
+                start = time.perf_counter()
+                data = comp.compress(chunk) if comp is not None else chunk
+                compressed = time.perf_counter()
+                raw_bytes += len(chunk)
+                uploaded_bytes += len(data)
+                f_out.write(data)
+                METRICS.record("compress", compressed - start, 1, len(chunk))
+                METRICS.record("upload", time.perf_counter() - compressed, 1, len(data))
+            if comp is not None:
+                tail = comp.flush()
+                uploaded_bytes += len(tail)
+                f_out.write(tail)
+            f_out.close()
+            return raw_bytes, uploaded_bytes
+        except Exception as e:
+            self._error = e
+            # Keep draining so the producer never blocks on a dead upload
+            while chunk is not _CLOSED and chunk is not _ABORTED:
+                chunk = self._chunks.get()
+            raise
+
+    def _put(self, item):
+        if self._error is not None:
+            # Fail fast: stop the drain loop and surface the upload error
+            self._chunks.put(_ABORTED)
+            self._future.result()
+        self._chunks.put(item)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def close(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self._put(_CLOSED)
+        return self._future
+
+    def abort(self):
+        self._buffer.clear()
+        self._chunks.put(_ABORTED)
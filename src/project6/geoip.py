@@ -0,0 +1,140 @@
+import array
+import bisect
+import csv
+import logging
+import socket
+import sys
+import time
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+IP_LOCATION_CSV = r"D:\python try hard\unigap\project6\data\csv\ip_location_results.csv"
+GEO_FIELDS = ("country", "region", "city")
+
+# -----------------------------------------------------------
+# IP location index
+# -----------------------------------------------------------
+def ipv4_int(ip):
+    """Dotted-quad `ip` as an unsigned 32-bit int, or None if it isn't exactly one."""
+    try:
+        packed = socket.inet_aton(ip)
+    except (OSError, TypeError, ValueError):
+        return None
+    # inet_aton also takes '010.0.0.1' (octal), '10.1', '167772161' and
+    # trailing junk; only the canonical form is the address itself
+    if socket.inet_ntoa(packed) != ip:
+        return None
+    return int.from_bytes(packed, "big")
+
+class IpLocations:
+    """
+    Read-only map of ip -> (country, region, city), as loaded from
+    ip_location_results.csv, without one dict per row.
+
+    IPv4 addresses are kept as a sorted array of 32-bit ints, with a
+    parallel array holding for each address the index of its location,
+    a (country, region, city) tuple of interned strings stored once per
+    distinct location. A third array holds where each /16 starts, so a
+    lookup is one inet_aton (checked against inet_ntoa) and a bisect
+    over a few entries (~2 us). That is about 11 bytes per address with
+    the locations, against ~470 for a dict of ip -> row dict (see
+    bench_geoip). Anything else in the ip column (IPv6, junk) goes to a
+    small plain dict.
+    """
+
+    def __init__(self, ips, location_ids, locations, other=None):
+        self.ips = ips
+        self.location_ids = location_ids
+        self.locations = locations
+        self.other = other or {}
+        # starts[p] is the first address >= p << 16
+        self.starts = array.array("I", (bisect.bisect_left(ips, p << 16) for p in range(65537)))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build the index from (ip, country, region, city) rows; the last row of an ip wins."""
+        interned = {}
+        ips = array.array("I")
+        location_ids = array.array("I")
+        other = {}
+        for ip, country, region, city in rows:
+            ip = ip.strip()
+            location = (
+                sys.intern(country) if country else None,
+                sys.intern(region) if region else None,
+                sys.intern(city) if city else None,
+            )
+            location_id = interned.setdefault(location, len(interned))
+            n = ipv4_int(ip)
+            if n is None:
+                other[ip] = location_id
+            else:
+                ips.append(n)
+                location_ids.append(location_id)
+
+        # Sort both columns by address, dropping all but the last row of an ip
+        order = sorted(range(len(ips)), key=ips.__getitem__)
+        sorted_ips = array.array("I")
+        sorted_ids = array.array("I")
+        for i in order:
+            if sorted_ips and sorted_ips[-1] == ips[i]:
+                sorted_ids[-1] = location_ids[i]
+            else:
+                sorted_ips.append(ips[i])
+                sorted_ids.append(location_ids[i])
+
+        locations = list(interned)
+        return cls(sorted_ips, sorted_ids, locations,
+                   {ip: locations[i] for ip, i in other.items()})
+
+    @classmethod
+    def from_csv(cls, path=IP_LOCATION_CSV):
+        """Load ip_location_results.csv (columns ip, country, region, city, in any order)."""
+        started = time.perf_counter()
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            columns = [header.index(name) for name in ("ip", *GEO_FIELDS)]
+            index = cls.from_rows(
+                tuple(row[c] if c < len(row) else "" for c in columns) for row in reader
+            )
+        logging.info(
+            f"Loaded {len(index)} IP locations ({len(index.locations)} distinct) from {path} "
+            f"in {time.perf_counter() - started:.1f}s, {index.nbytes() / 1024 ** 2:.1f} MB"
+        )
+        return index
+
+    def __len__(self):
+        return len(self.ips) + len(self.other)
+
+    def nbytes(self):
+        """Approximate memory held by the index, strings included."""
+        strings = {id(s): s for location in self.locations for s in location if s}
+        return (
+            self.ips.itemsize * len(self.ips)
+            + self.location_ids.itemsize * len(self.location_ids)
+            + self.starts.itemsize * len(self.starts)
+            + sys.getsizeof(self.locations)
+            + sum(sys.getsizeof(location) for location in self.locations)
+            + sum(sys.getsizeof(s) for s in strings.values())
+            + sys.getsizeof(self.other)
+        )
+
+    def lookup(self, ip):
+        """(country, region, city) of `ip`, or None if it is not in the index."""
+        n = ipv4_int(ip)
+        if n is None:
+            return self.other.get(ip)
+        p = n >> 16
+        end = self.starts[p + 1]
+        i = bisect.bisect_left(self.ips, n, self.starts[p], end)
+        if i < end and self.ips[i] == n:
+            return self.locations[self.location_ids[i]]
+        return None
+
+    def enrich(self, row):
+        """Set the GEO_FIELDS of a normalized row from its `ip` (None when unknown)."""
+        location = self.lookup(row["ip"]) if row["ip"] else None
+        row["country"], row["region"], row["city"] = location or (None, None, None)
+        return row
@@ -1,25 +1,52 @@
+import argparse
 import os
 import logging
-from google.cloud import bigquery
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery, storage
+from project6.manifest import DAY_MANIFEST, Manifest
+from project6.metrics import METRICS, METRICS_EVERY, MetricsReporter
 
 # -------------------------------------------------
 # LOGGING SETUP
 # -------------------------------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s"
+    )
 
 # -------------------------------------------------
 # AUTHENTICATION
 # -------------------------------------------------
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = (
-    r"D:\python try hard\unigap\project6\data\json_key\fresh-ocean-475916-m2-d87215690697.json"
-)
+KEY_PATH = r"D:\python try hard\unigap\project6\data\json_key\fresh-ocean-475916-m2-d87215690697.json"
+
+def setup_credentials():
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", KEY_PATH)
 
 # -------------------------------------------------
 # GENERIC LOAD FUNCTION
 # -------------------------------------------------
+def load_job_config(schema, write_mode, source_format):
+    job_config = bigquery.LoadJobConfig(
+        source_format=source_format,
+        schema=schema,                # Explicit schema
+        write_disposition=write_mode  # TRUNCATE or APPEND
+    )
+
+    if source_format == bigquery.SourceFormat.PARQUET:
+        # Parquet files carry their own schema; list inference maps
+        # list<struct> columns to REPEATED RECORD like the JSONL schema
+        job_config.schema = None
+        parquet_options = bigquery.ParquetOptions()
+        parquet_options.enable_list_inference = True
+        job_config.parquet_options = parquet_options
+    return job_config
+
+
 def load_jsonl_to_bigquery(
     project_id,
     dataset_id,
@@ -27,21 +54,19 @@ def load_jsonl_to_bigquery(
     gcs_uri,
     schema,
     write_mode=bigquery.WriteDisposition.WRITE_TRUNCATE,  # DEFAULT = FULL RELOAD
+    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,  # or PARQUET
+    client=None,  # shared client; a new one is created if omitted
 ):
-    client = bigquery.Client(project=project_id)
+    client = client or bigquery.Client(project=project_id)
     table_ref = f"{project_id}.{dataset_id}.{table_id}"
-
-    job_config = bigquery.LoadJobConfig(
-        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-        schema=schema,                # Explicit schema
-        write_disposition=write_mode  # TRUNCATE or APPEND
-    )
+    job_config = load_job_config(schema, write_mode, source_format)
 
     logging.info("--------------------------------------------------")
     logging.info("START LOAD JOB")
     logging.info(f"Table: {table_ref}")
     logging.info(f"Source: {gcs_uri}")
     logging.info(f"Write mode: {write_mode}")
+    logging.info(f"Format: {source_format}")
     logging.info("--------------------------------------------------")
 
     load_job = client.load_table_from_uri(
@@ -52,9 +77,396 @@ def load_jsonl_to_bigquery(
 
     load_job.result()  # Wait until finished
 
+    if "$" in table_id:
+        # One partition (table$YYYYMMDD): report the rows loaded into it
+        logging.info(f"SUCCESS | {table_ref} | Rows in partition: {load_job.output_rows}")
+        logging.info("--------------------------------------------------")
+        return load_job.output_rows
+
     table = client.get_table(table_ref)
-    logging.info(f"SUCCESS | Rows in table: {table.num_rows}")
+    logging.info(f"SUCCESS | {table_ref} | Rows in table: {table.num_rows}")
     logging.info("--------------------------------------------------")
+    return table.num_rows
+
+
+# -------------------------------------------------
+# MANIFEST LOADS THROUGH A STAGING TABLE
+# -------------------------------------------------
+# Staging tables left by a failed load are dropped by BigQuery after this
+STAGING_EXPIRATION = timedelta(days=1)
+
+
+def read_manifest(gcs_uri, storage_client):
+    bucket_name, _, path = gcs_uri.removeprefix("gs://").partition("/")
+    blob = storage_client.bucket(bucket_name).blob(path)
+    return bucket_name, json.loads(blob.download_as_bytes())
+
+
+def check_shards(storage_client, bucket_name, manifest_path, shards):
+    """Raise unless every shard is in GCS with the manifest's size and CRC32C."""
+    prefix = manifest_path.rsplit("/", 1)[0] + "/"
+    found = {blob.name: blob for blob in storage_client.list_blobs(bucket_name, prefix=prefix)}
+    problems = []
+    for shard in shards:
+        blob = found.get(shard["name"])
+        if blob is None:
+            problems.append(f"{shard['name']} is missing")
+        elif blob.size != shard["bytes"] or blob.crc32c != shard["crc32c"]:
+            problems.append(f"{shard['name']} changed since the export")
+    if problems:
+        raise ValueError(f"{len(problems)} shards don't match {manifest_path}: {'; '.join(problems[:5])}")
+
+
+def load_from_manifest(
+    project_id,
+    dataset_id,
+    table_id,
+    gcs_uri,
+    schema,
+    write_mode=bigquery.WriteDisposition.WRITE_TRUNCATE,
+    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+    client=None,
+    storage_client=None,
+):
+    """
+    Load exactly the shards listed in the day manifest at `gcs_uri`
+    (see manifest.DayManifests) into `table_id`, usually a
+    `table$YYYYMMDD` partition, through a staging table:
+
+    1. every shard must be in GCS with the manifest's size and CRC32C;
+    2. the shards are loaded into `<table>__staging_<YYYYMMDD>`, a
+       table partitioned and clustered like `table`;
+    3. the staging row count must equal the manifest's;
+    4. one copy job replaces the partition with the staging one
+       (`write_mode`), and the staging table is dropped.
+
+    A failure at any step leaves `table_id` as it was; a failed staging
+    table is kept for a look and expires after STAGING_EXPIRATION.
+    Returns the rows loaded.
+    """
+    client = client or bigquery.Client(project=project_id)
+    storage_client = storage_client or storage.Client(project=project_id)
+    base, _, partition = table_id.partition("$")
+    table_ref = f"{project_id}.{dataset_id}.{table_id}"
+    staging_ref = f"{project_id}.{dataset_id}.{base}__staging_{partition or 'full'}"
+    decorator = f"${partition}" if partition else ""
+
+    bucket_name, manifest = read_manifest(gcs_uri, storage_client)
+    manifest_path = gcs_uri.removeprefix(f"gs://{bucket_name}/")
+    uris = [f"gs://{bucket_name}/{shard['name']}" for shard in manifest["shards"]]
+    logging.info(f"{table_ref}: {len(uris)} shards, {manifest['rows']} rows in {gcs_uri}")
+    check_shards(storage_client, bucket_name, manifest_path, manifest["shards"])
+
+    # Staging table shaped like the target, so the copy is allowed
+    target = client.get_table(f"{project_id}.{dataset_id}.{base}")
+    staging = bigquery.Table(staging_ref, schema=target.schema)
+    staging.time_partitioning = target.time_partitioning
+    staging.clustering_fields = target.clustering_fields
+    staging.expires = datetime.now(timezone.utc) + STAGING_EXPIRATION
+    client.delete_table(staging_ref, not_found_ok=True)
+    client.create_table(staging)
+
+    job_config = load_job_config(schema, bigquery.WriteDisposition.WRITE_TRUNCATE, source_format)
+    load_job = client.load_table_from_uri(uris, staging_ref + decorator, job_config=job_config)
+    load_job.result()
+    if load_job.output_rows != manifest["rows"]:
+        raise ValueError(
+            f"{staging_ref}: loaded {load_job.output_rows} rows, manifest lists {manifest['rows']}"
+        )
+
+    copy_config = bigquery.CopyJobConfig(write_disposition=write_mode)
+    client.copy_table(staging_ref + decorator, table_ref, job_config=copy_config).result()
+    client.delete_table(staging_ref, not_found_ok=True)
+    logging.info(f"SUCCESS | {table_ref} | {load_job.output_rows} rows swapped in from {staging_ref}")
+    return load_job.output_rows
+
+
+# -------------------------------------------------
+# LOAD ORCHESTRATOR
+# -------------------------------------------------
+MAX_PARALLEL_LOADS = 4
+
+def run_loads(specs, project_id=None, dataset_id=None, max_parallel=MAX_PARALLEL_LOADS, client=None):
+    """
+    Run the table loads described by `specs` concurrently.
+
+    Each spec is a dict with `table_id`, `gcs_uri` and `schema`, and
+    optionally `write_mode` and `source_format` (see
+    load_jsonl_to_bigquery). Specs with `from_manifest` load the
+    manifest at `gcs_uri` instead (see load_from_manifest). All jobs share one client; at most
+    `max_parallel` run at a time, so the whole step takes about as
+    long as the slowest table.
+
+    Returns one result dict per spec, in spec order:
+    {"table", "status": "success" | "failed", "rows", "seconds", "error"}.
+    """
+    project_id = project_id or PROJECT_ID
+    dataset_id = dataset_id or DATASET_ID
+    client = client or bigquery.Client(project=project_id)
+    storage_client = None
+    if any(spec.get("from_manifest") for spec in specs):
+        storage_client = storage.Client(project=project_id)
+
+    def run(spec):
+        started = time.perf_counter()
+        spec = dict(spec)
+        if spec.pop("from_manifest", False):
+            rows = load_from_manifest(
+                project_id,
+                dataset_id,
+                client=client,
+                storage_client=storage_client,
+                **spec
+            )
+        else:
+            rows = load_jsonl_to_bigquery(
+                project_id,
+                dataset_id,
+                client=client,
+                **spec
+            )
+        seconds = time.perf_counter() - started
+        METRICS.record(f"load.{spec['table_id']}", seconds, rows or 0)
+        return rows, seconds
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = {executor.submit(run, spec): i for i, spec in enumerate(specs)}
+        for f in as_completed(futures):
+            spec = specs[futures[f]]
+            try:
+                rows, seconds = f.result()
+                results[futures[f]] = {
+                    "table": spec["table_id"], "status": "success",
+                    "rows": rows, "seconds": seconds, "error": None,
+                }
+            except Exception as e:
+                logging.exception(f"FAILED | {spec['table_id']}")
+                results[futures[f]] = {
+                    "table": spec["table_id"], "status": "failed",
+                    "rows": None, "seconds": None, "error": str(e),
+                }
+
+    return [results[i] for i in range(len(specs))]
+
+
+# -------------------------------------------------
+# DAY-PARTITIONED TABLES
+# -------------------------------------------------
+def ensure_partitioned_table(client, table_ref, schema, partition_field, clustering_fields=None,
+                             recreate=False):
+    """
+    Create `table_ref` partitioned by day on the DATE column
+    `partition_field` and clustered on `clustering_fields`, unless it
+    exists. Columns of `schema` the table lacks are added to it. A
+    table partitioned otherwise (e.g. a glamira_raw created by full
+    reloads) raises, or with `recreate` is dropped and created again,
+    losing its rows.
+    """
+    try:
+        table = client.get_table(table_ref)
+    except NotFound:
+        table = None
+
+    if table is not None:
+        partitioning = table.time_partitioning
+        if (partitioning is not None and partitioning.field == partition_field
+                and partitioning.type_ == bigquery.TimePartitioningType.DAY):
+            if table.clustering_fields != clustering_fields:
+                table.clustering_fields = clustering_fields
+                client.update_table(table, ["clustering_fields"])
+                logging.info(f"{table_ref} now clustered on {clustering_fields}")
+            existing = {field.name for field in table.schema}
+            added = [field for field in schema if field.name not in existing]
+            if added:
+                # New columns go last; BigQuery can't reorder existing ones
+                table.schema = list(table.schema) + added
+                table = client.update_table(table, ["schema"])
+                logging.info(f"Added columns {[field.name for field in added]} to {table_ref}")
+            return table
+        if not recreate:
+            raise ValueError(
+                f"{table_ref} exists but is not partitioned by day on {partition_field}; "
+                f"drop it or load with --recreate"
+            )
+        logging.warning(f"Dropping {table_ref} to recreate it partitioned on {partition_field}")
+        client.delete_table(table_ref)
+
+    table = bigquery.Table(table_ref, schema=schema)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field=partition_field,
+    )
+    table.clustering_fields = clustering_fields
+    table = client.create_table(table)
+    logging.info(f"Created {table_ref}, partitioned on {partition_field}, clustered on {clustering_fields}")
+    return table
+
+
+def list_days(gcs_uri, storage_client=None):
+    """
+    Days with an export under `gcs_uri` (a URI containing `dt={day}`),
+    i.e. the `dt=YYYY-MM-DD/` prefixes in its bucket, sorted.
+    """
+    bucket_name, _, path = gcs_uri.removeprefix("gs://").partition("/")
+    prefix = path.split("{day}")[0]
+    storage_client = storage_client or storage.Client(project=PROJECT_ID)
+
+    blobs = storage_client.list_blobs(bucket_name, prefix=prefix, delimiter="/")
+    for _ in blobs:
+        pass  # prefixes are collected page by page
+    days = []
+    for sub_prefix in blobs.prefixes:
+        day = sub_prefix[len(prefix):].rstrip("/")
+        try:
+            date.fromisoformat(day)
+        except ValueError:
+            logging.warning(f"Skipping gs://{bucket_name}/{sub_prefix}: not a dt=YYYY-MM-DD prefix")
+            continue
+        days.append(day)
+    return sorted(days)
+
+
+def manifest_days(gcs_uri, manifest_name, storage_client=None):
+    """Days under `gcs_uri` (a URI containing `dt={day}`) whose prefix holds `manifest_name`."""
+    bucket_name, _, path = gcs_uri.removeprefix("gs://").partition("/")
+    prefix = path.split("{day}")[0]
+    storage_client = storage_client or storage.Client(project=PROJECT_ID)
+    days = set()
+    for blob in storage_client.list_blobs(bucket_name, prefix=prefix):
+        day, _, name = blob.name[len(prefix):].partition("/")
+        if name == manifest_name:
+            days.add(day)
+    return days
+
+
+def partition_specs(spec, days=None, storage_client=None):
+    """
+    Turn a day-partitioned spec into one load spec per day, loaded into
+    `table_id$YYYYMMDD` with WRITE_TRUNCATE so each load replaces only
+    that day's partition. A day whose prefix holds the spec's
+    `manifest_name` loads exactly the shards listed there (see
+    load_from_manifest); other days load the `{day}` URI. `days`
+    defaults to every day exported to GCS.
+    """
+    storage_client = storage_client or storage.Client(project=PROJECT_ID)
+    if days is None:
+        days = list_days(spec["gcs_uri"], storage_client)
+    with_manifest = set()
+    if spec.get("manifest_name"):
+        with_manifest = manifest_days(spec["gcs_uri"], spec["manifest_name"], storage_client)
+    specs = []
+    for day in days:
+        day = date.fromisoformat(day).isoformat()
+        gcs_uri = spec["gcs_uri"].format(day=day)
+        day_spec = {
+            "table_id": f"{spec['table_id']}${day.replace('-', '')}",
+            "gcs_uri": gcs_uri,
+            "schema": spec["schema"],
+            "write_mode": bigquery.WriteDisposition.WRITE_TRUNCATE,
+            **({"source_format": spec["source_format"]} if "source_format" in spec else {}),
+        }
+        if day in with_manifest:
+            day_spec["gcs_uri"] = f"{gcs_uri.rsplit('/', 1)[0]}/{spec['manifest_name']}"
+            day_spec["from_manifest"] = True
+        elif spec.get("manifest_name"):
+            logging.warning(f"No {spec['manifest_name']} for {day}, loading every file of {gcs_uri}")
+        specs.append(day_spec)
+    return specs
+
+
+def prepare_loads(specs, days=None, recreate=False, client=None):
+    """
+    Expand the day-partitioned specs among `specs` (see partition_specs),
+    creating their tables first, and return the flat list of loads.
+    """
+    client = client or bigquery.Client(project=PROJECT_ID)
+    loads = []
+    for spec in specs:
+        if "partition_field" not in spec:
+            loads.append(spec)
+            continue
+        ensure_partitioned_table(
+            client,
+            f"{PROJECT_ID}.{DATASET_ID}.{spec['table_id']}",
+            spec["schema"],
+            spec["partition_field"],
+            spec.get("clustering_fields"),
+            recreate=recreate,
+        )
+        day_specs = partition_specs(spec, days)
+        logging.info(f"{spec['table_id']}: loading {len(day_specs)} day partitions")
+        loads.extend(day_specs)
+    return loads
+
+
+# -------------------------------------------------
+# SKIPPING UNCHANGED LOADS
+# -------------------------------------------------
+def source_versions(gcs_uri, storage_client):
+    """
+    {object name: [generation, crc32c]} of the objects `gcs_uri` loads
+    (a single object, or one `*` wildcard).
+    """
+    bucket_name, _, path = gcs_uri.removeprefix("gs://").partition("/")
+    prefix, wildcard, suffix = path.partition("*")
+    if not wildcard:
+        blob = storage_client.bucket(bucket_name).get_blob(path)
+        return {path: [blob.generation, blob.crc32c]} if blob else {}
+    return {
+        blob.name: [blob.generation, blob.crc32c]
+        for blob in storage_client.list_blobs(bucket_name, prefix=prefix)
+        if blob.name.endswith(suffix)
+    }
+
+
+def load_fingerprint(spec, versions):
+    """What a load depends on: its source objects, schema and settings."""
+    return {
+        "objects": versions,
+        "schema": [field.to_api_repr() for field in spec["schema"]],
+        "write_mode": str(spec.get("write_mode", bigquery.WriteDisposition.WRITE_TRUNCATE)),
+        "source_format": str(spec.get("source_format", bigquery.SourceFormat.NEWLINE_DELIMITED_JSON)),
+    }
+
+
+def skip_unchanged(loads, manifest, client, storage_client=None, force=False):
+    """
+    Drop the loads whose source objects (by generation and CRC32C),
+    schema and settings are those of their last successful load in
+    `manifest`, as long as the table was not created after that load.
+
+    Returns (loads to run, their fingerprints, number skipped). With
+    `force` nothing is skipped, but fingerprints are still returned.
+    """
+    storage_client = storage_client or storage.Client(project=PROJECT_ID)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        versions = list(executor.map(lambda spec: source_versions(spec["gcs_uri"], storage_client), loads))
+
+    created = {}
+
+    def table_created(table_id):
+        base = table_id.split("$")[0]
+        if base not in created:
+            try:
+                created[base] = client.get_table(f"{PROJECT_ID}.{DATASET_ID}.{base}").created.timestamp()
+            except NotFound:
+                created[base] = None
+        return created[base]
+
+    to_run, fingerprints = [], []
+    for spec, spec_versions in zip(loads, versions):
+        fingerprint = load_fingerprint(spec, spec_versions)
+        entry = manifest.get(spec["table_id"])
+        if (not force and spec_versions and entry is not None
+                and entry["fingerprint"] == fingerprint
+                and table_created(spec["table_id"]) is not None
+                and table_created(spec["table_id"]) <= entry["loaded_at"]):
+            logging.info(f"SKIP | {spec['table_id']} | sources unchanged since the last load")
+            continue
+        to_run.append(spec)
+        fingerprints.append(fingerprint)
+    return to_run, fingerprints, len(loads) - len(to_run)
 
 
 # -------------------------------------------------
@@ -63,6 +475,13 @@ def load_jsonl_to_bigquery(
 PROJECT_ID = "fresh-ocean-475916-m2"
 DATASET_ID = "glamira_dataset"
 
+# Exporters gzip their output by default (BigQuery reads gzip JSONL
+# directly); use ".jsonl" for files exported with --compression none
+JSONL_EXT = ".jsonl.gz"
+
+# Source object versions of every successful load (see skip_unchanged)
+LOAD_MANIFEST_FILE = r"D:\python try hard\unigap\project6\data\tmp\load_manifest.json"
+
 # -------------------------------------------------
 # SCHEMAS
 # -------------------------------------------------
@@ -104,6 +523,10 @@ summary_schema = [
     bigquery.SchemaField("device_id", "STRING"),
     bigquery.SchemaField("email_address", "STRING"),
     bigquery.SchemaField("ip", "STRING"),
+    # From ip_location_results.csv when exported with --geoip
+    bigquery.SchemaField("country", "STRING"),
+    bigquery.SchemaField("region", "STRING"),
+    bigquery.SchemaField("city", "STRING"),
     bigquery.SchemaField("local_time", "STRING"),
     bigquery.SchemaField("resolution", "STRING"),
     bigquery.SchemaField("current_url", "STRING"),
@@ -175,45 +598,102 @@ summary_schema = [
             bigquery.SchemaField("value_label", "STRING"),
         ],
     ),
+
+    # UTC day of time_stamp, added by the exporter; glamira_raw is partitioned on it
+    bigquery.SchemaField("event_date", "DATE"),
 ]
 
 # -------------------------------------------------
 # LOAD JOBS
 # -------------------------------------------------
+LOAD_SPECS = [
+    # FULL RELOAD TABLES (ROW COUNT STAYS CONSTANT)
+    {
+        "table_id": "ip_locations",
+        "gcs_uri": f"gs://twan_glamira/dataset_export/ip_location_results{JSONL_EXT}",
+        "schema": ip_location_schema,
+    },
+    {
+        "table_id": "product_ids_to_crawl",
+        "gcs_uri": f"gs://twan_glamira/dataset_export/product_ids_to_crawl{JSONL_EXT}",
+        "schema": product_ids_to_crawl_schema,
+    },
+    {
+        "table_id": "crawl_product",
+        "gcs_uri": f"gs://twan_glamira/dataset_export/product_info{JSONL_EXT}",
+        "schema": crawl_product_ids_schema,
+    },
+    # DAY-PARTITIONED TABLE: one load per exported day, each replacing
+    # only its own partition (see partition_specs)
+    {
+        "table_id": "glamira_raw",
+        "gcs_uri": f"gs://twan_glamira/dataset_export/summary/dt={{day}}/*{JSONL_EXT}",
+        "schema": summary_schema,
+        "partition_field": "event_date",
+        "clustering_fields": ["collection", "store_id", "product_id"],
+        # Written by export.py next to each day's shards
+        "manifest_name": DAY_MANIFEST,
+    },
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load exported files from GCS into BigQuery")
+    parser.add_argument("--max-parallel", type=int, default=MAX_PARALLEL_LOADS,
+                        help="load jobs running at the same time")
+    parser.add_argument("--tables", nargs="*",
+                        help="only load these tables (default: all)")
+    parser.add_argument("--days", nargs="*",
+                        help="only replace these YYYY-MM-DD partitions of day-partitioned tables "
+                             "(default: every exported day)")
+    parser.add_argument("--recreate", action="store_true",
+                        help="drop and recreate a day-partitioned table that exists unpartitioned")
+    parser.add_argument("--force", action="store_true",
+                        help="load every table, even if its source files are unchanged since the last load")
+    parser.add_argument("--metrics", default=None,
+                        help="write load metrics to this file (.prom for Prometheus, else JSON); "
+                             "default: log them")
+    parser.add_argument("--metrics-every", type=float, default=METRICS_EVERY,
+                        help="seconds between metrics reports")
+    args = parser.parse_args()
+
+    setup_logging()
+    setup_credentials()
+
+    specs = [spec for spec in LOAD_SPECS if not args.tables or spec["table_id"] in args.tables]
+    if args.days is not None and not args.tables:
+        # A backfill of some days leaves the full-reload tables alone
+        specs = [spec for spec in specs if "partition_field" in spec]
+
+    client = bigquery.Client(project=PROJECT_ID)
+    loads = prepare_loads(specs, days=args.days, recreate=args.recreate, client=client)
+    manifest = Manifest(LOAD_MANIFEST_FILE)
+    loads, fingerprints, skipped = skip_unchanged(loads, manifest, client, force=args.force)
+
+    reporter = MetricsReporter(path=args.metrics, interval=args.metrics_every,
+                               labels={"job": "load_data"}).start()
+    started = time.perf_counter()
+    try:
+        results = run_loads(loads, max_parallel=args.max_parallel, client=client)
+        elapsed = time.perf_counter() - started
+        METRICS.record("load", elapsed, sum(r["rows"] or 0 for r in results))
+    finally:
+        reporter.stop()
+
+    for r, fingerprint in zip(results, fingerprints):
+        if r["status"] == "success":
+            logging.info(f"{r['table']}: {r['rows']} rows in {r['seconds']:.1f}s")
+            manifest.put(r["table"], {"fingerprint": fingerprint, "rows": r["rows"],
+                                      "loaded_at": time.time()})
+        else:
+            logging.error(f"{r['table']}: FAILED ({r['error']})")
+    logging.info(f"All loads finished in {elapsed:.1f}s ({skipped} unchanged, skipped)")
 
-# FULL RELOAD TABLES (ROW COUNT STAYS CONSTANT)
-load_jsonl_to_bigquery(
-    PROJECT_ID,
-    DATASET_ID,
-    "ip_locations",
-    "gs://twan_glamira/dataset_export/ip_location_results.jsonl",
-    ip_location_schema
-)
-
-load_jsonl_to_bigquery(
-    PROJECT_ID,
-    DATASET_ID,
-    "product_ids_to_crawl",
-    "gs://twan_glamira/dataset_export/product_ids_to_crawl.jsonl",
-    product_ids_to_crawl_schema
-)
-
-load_jsonl_to_bigquery(
-    PROJECT_ID,
-    DATASET_ID,
-    "crawl_product",
-    "gs://twan_glamira/dataset_export/product_info.jsonl",
-    crawl_product_ids_schema
-)
-
-# APPEND-ONLY TABLE
-load_jsonl_to_bigquery(
-    PROJECT_ID,
-    DATASET_ID,
-    "glamira_raw",
-    "gs://twan_glamira/dataset_export/summary/summary_*.jsonl",
-    summary_schema
-   # bigquery.WriteDisposition.WRITE_APPEND
-)
+    if any(r["status"] == "failed" for r in results):
+        print("FAILED. Check the log.")
+        raise SystemExit(1)
+    print("SUCCESS: Load completed.")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from google.api_core.exceptions import PreconditionFailed
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+HASH_CHUNK = 1024 * 1024
+# Lists the shards of one export day, next to them in dt=YYYY-MM-DD/
+DAY_MANIFEST = "_manifest.json"
+
+# -----------------------------------------------------------
+# File fingerprints
+# -----------------------------------------------------------
+def hash_file(path):
+    """SHA-256 hex digest of the file at `path`, read HASH_CHUNK at a time."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_fingerprint(path, previous=None):
+    """
+    {"size", "mtime_ns", "sha256"} of `path`. When size and mtime equal
+    those of the `previous` fingerprint, its hash is reused and the
+    file is not read.
+    """
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and all(previous.get(k) == v for k, v in fingerprint.items()):
+        fingerprint["sha256"] = previous["sha256"]
+    else:
+        fingerprint["sha256"] = hash_file(path)
+    return fingerprint
+
+def same_content(a, b):
+    """True if two fingerprints describe the same bytes (mtime may differ)."""
+    return bool(a and b) and a["size"] == b["size"] and a["sha256"] == b["sha256"]
+
+# -----------------------------------------------------------
+# Manifest
+# -----------------------------------------------------------
+class Manifest:
+    """
+    Named entries describing the inputs and outputs of work done
+    earlier, kept in a local JSON file, so a run can skip what would
+    come out the same. Entries are plain dicts, e.g. for a CSV export:
+
+        {"product_info": {"source": {"size": ..., "mtime_ns": ..., "sha256": "..."},
+                          "settings": {...}, "blob": "...", "generation": 17..., "crc32c": "..."}}
+
+    `put()` rewrites the file atomically and may be called from threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+# -----------------------------------------------------------
+# Day manifests of export shards
+# -----------------------------------------------------------
+def shard_entry(blob, day, rows):
+    """Manifest entry of the uploaded shard `blob`, holding `rows` rows of `day`."""
+    if blob.size is None or blob.crc32c is None:
+        blob.reload()
+    return {"name": blob.name, "day": day.isoformat(), "rows": rows,
+            "bytes": blob.size, "crc32c": blob.crc32c}
+
+class DayManifests:
+    """
+    The DAY_MANIFEST next to each day's shards in GCS
+    (`{prefix}/dt=YYYY-MM-DD/_manifest.json`), listing exactly the
+    shards a loader should load for that day:
+
+        {"day": "2020-04-01", "rows": 1234, "bytes": 56789, "updated_at": "...",
+         "shards": [{"name": ".../summary_00000.jsonl.gz", "day": "2020-04-01",
+                     "rows": 1234, "bytes": 56789, "crc32c": "..."}]}
+
+    With `replace` (full exports) `add()` only collects entries and
+    `commit()` rewrites the manifest of every day written to list
+    those shards alone, so shards of an earlier, larger run are no
+    longer loaded. Otherwise (incremental, dedup and tail runs) each
+    entry is merged into its day's manifest when added, replacing an
+    entry of the same name. Merges use generation preconditions, so
+    concurrent writers don't drop each other's entries.
+    """
+
+    def __init__(self, bucket, prefix, replace=False):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.replace = replace
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def path(self, day):
+        return f"{self.prefix}/dt={day}/{DAY_MANIFEST}"
+
+    def add(self, entry):
+        if self.replace:
+            self.entries.append(entry)
+        else:
+            self._write(entry["day"], [entry], merge=True)
+
+    def commit(self):
+        """Write the manifests of the collected entries; returns the number of days."""
+        by_day = {}
+        for entry in self.entries:
+            by_day.setdefault(entry["day"], []).append(entry)
+        for day, entries in sorted(by_day.items()):
+            self._write(day, entries)
+        logging.info(f"Wrote manifests of {len(by_day)} days, {len(self.entries)} shards")
+        return len(by_day)
+
+    def _write(self, day, entries, merge=False):
+        blob_path = self.path(day)
+        with self._lock:
+            while True:
+                try:
+                    self._try_write(blob_path, day, entries, merge)
+                    return
+                except PreconditionFailed:
+                    logging.info(f"{blob_path} changed while merging, retrying")
+
+    def _try_write(self, blob_path, day, entries, merge):
+        shards = {}
+        generation = None
+        if merge:
+            current = self.bucket.get_blob(blob_path)
+            # 0: the manifest must still not exist when written
+            generation = current.generation if current is not None else 0
+            if current is not None:
+                data = json.loads(current.download_as_bytes(if_generation_match=generation))
+                shards = {shard["name"]: shard for shard in data["shards"]}
+        shards.update((entry["name"], entry) for entry in entries)
+        shards = sorted(shards.values(), key=lambda shard: shard["name"])
+        manifest = {
+            "day": day,
+            "rows": sum(shard["rows"] for shard in shards),
+            "bytes": sum(shard["bytes"] for shard in shards),
+            "updated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "shards": shards,
+        }
+        self.bucket.blob(blob_path).upload_from_string(
+            json.dumps(manifest, indent=2), content_type="application/json",
+            if_generation_match=generation,
+        )
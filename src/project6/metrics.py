@@ -0,0 +1,245 @@
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+METRICS_EVERY = 30          # seconds between periodic reports
+PROFILE_INTERVAL = 0.005    # seconds between stack samples
+PROMETHEUS_PREFIX = "project6"
+
+# -----------------------------------------------------------
+# Per-stage counters
+# -----------------------------------------------------------
+class Metrics:
+    """
+    Process-wide telemetry: cumulative seconds, item counts and bytes
+    per pipeline stage (e.g. mongo_fetch, normalize, serialize, write,
+    compress, upload), plus per-field cast failures.
+
+    Hot loops should sum timings locally and call `record()` once per
+    batch; every call takes a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.perf_counter()
+            self.stages = {}
+            self.cast_failures = collections.Counter()
+
+    def record(self, stage, seconds=0.0, count=0, nbytes=0):
+        """Add `seconds`, `count` items and `nbytes` bytes to `stage`."""
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"seconds": 0.0, "count": 0, "bytes": 0})
+            totals["seconds"] += seconds
+            totals["count"] += count
+            totals["bytes"] += nbytes
+
+    @contextmanager
+    def timer(self, stage, count=0, nbytes=0):
+        """Time the `with` block into `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, count, nbytes)
+
+    def cast_failure(self, field, count=1):
+        """Count values of `field` that could not be cast and became null."""
+        with self._lock:
+            self.cast_failures[field] += count
+
+    def snapshot(self):
+        """Point-in-time copy of every counter, with derived rates."""
+        with self._lock:
+            stages = {}
+            for stage, totals in self.stages.items():
+                seconds = totals["seconds"]
+                stages[stage] = {
+                    **totals,
+                    "per_sec": totals["count"] / seconds if seconds else None,
+                    "bytes_per_sec": totals["bytes"] / seconds if seconds else None,
+                }
+            return {
+                "timestamp": time.time(),
+                "elapsed": time.perf_counter() - self.started,
+                "stages": stages,
+                "cast_failures": dict(self.cast_failures),
+            }
+
+    def to_prometheus(self, labels=None):
+        """Render the counters in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+            for sample_labels, value in samples:
+                pairs = {**sample_labels, **(labels or {})}
+                label_text = ",".join(f'{k}="{v}"' for k, v in pairs.items())
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{label_text} {value}")
+
+        stages = sorted(snap["stages"].items())
+        metric("stage_seconds_total", "counter", "Cumulative seconds spent in a stage.",
+               [({"stage": s}, t["seconds"]) for s, t in stages])
+        metric("stage_items_total", "counter", "Items processed by a stage.",
+               [({"stage": s}, t["count"]) for s, t in stages])
+        metric("stage_bytes_total", "counter", "Bytes processed by a stage.",
+               [({"stage": s}, t["bytes"]) for s, t in stages])
+        metric("cast_failures_total", "counter", "Values that failed to cast and were nulled.",
+               [({"field": f}, n) for f, n in sorted(snap["cast_failures"].items())])
+        metric("elapsed_seconds", "gauge", "Seconds since the counters were reset.",
+               [({}, snap["elapsed"])])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, labels=None):
+        """
+        Atomically write the counters to `path`: Prometheus textfile
+        format for a `.prom` path, JSON otherwise.
+        """
+        if path.endswith(".prom"):
+            text = self.to_prometheus(labels)
+        else:
+            text = json.dumps({**self.snapshot(), "labels": labels or {}}, indent=2)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+METRICS = Metrics()
+
+def suffixed_path(path, suffix):
+    """`metrics.prom` + '_p03' -> `metrics_p03.prom` (None stays None)."""
+    if path is None:
+        return None
+    root, ext = os.path.splitext(path)
+    return f"{root}{suffix}{ext}"
+
+# -----------------------------------------------------------
+# Periodic reporting
+# -----------------------------------------------------------
+class MetricsReporter:
+    """
+    Background thread that writes `metrics` to `path` every `interval`
+    seconds (see Metrics.write), or logs them as one JSON line when no
+    path is given. `stop()` writes a final report.
+    """
+
+    def __init__(self, metrics=METRICS, path=None, interval=METRICS_EVERY, labels=None):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.labels = labels
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+
+    def report(self):
+        try:
+            if self.path:
+                self.metrics.write(self.path, self.labels)
+            else:
+                logging.info("METRICS " + json.dumps(self.metrics.snapshot()))
+        except Exception:
+            logging.exception("Writing metrics failed")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.report()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+# -----------------------------------------------------------
+# Sampling profiler
+# -----------------------------------------------------------
+class SamplingProfiler:
+    """
+    Statistical profiler for one thread: a background thread samples
+    its Python stack every `interval` seconds via sys._current_frames.
+    Overhead is independent of how hot the sampled code is, unlike
+    cProfile, so the hot loop runs at close to full speed.
+
+    `write_collapsed()` emits "frame;frame;frame count" lines that
+    flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def top(self, n=10):
+        """The `n` functions most often on top of the stack, with sample counts."""
+        leaves = collections.Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def write_collapsed(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+@contextmanager
+def profiling(path=None, interval=PROFILE_INTERVAL):
+    """
+    Sample the calling thread while the `with` block runs and write
+    collapsed stacks to `path`. No-op when `path` is None.
+    """
+    if path is None:
+        yield None
+        return
+    profiler = SamplingProfiler(interval=interval).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.write_collapsed(path)
+        total = sum(profiler.samples.values()) or 1
+        hot = ", ".join(f"{name} {count / total:.0%}" for name, count in profiler.top(5))
+        logging.info(f"Profile written to {path} ({total} samples). Hottest: {hot}")
@@ -0,0 +1,76 @@
+import datetime
+import json
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+# "auto" uses orjson when it is installed and falls back to the stdlib.
+DEFAULT_SERIALIZER = "auto"
+SERIALIZERS = ("auto", "json", "orjson")
+
+# -----------------------------------------------------------
+# Backends
+# -----------------------------------------------------------
+# Each backend turns a list of rows into one UTF-8 JSONL byte buffer,
+# so callers make one binary write per batch instead of one text
+# write per row.
+
+def _iso_date(value):
+    # Dates (e.g. the exporter's event_date) are written like orjson does
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# Same settings as json.dumps, built once so the C encoder is reused
+_encode = json.JSONEncoder(default=_iso_date).encode
+
+def _json_lines(rows):
+    """Stdlib backend: same text as `json.dumps(row)` per line, dates as ISO strings."""
+    if not rows:
+        return b""
+    encode = _encode
+    return ("\n".join([encode(row) for row in rows]) + "\n").encode("utf-8")
+
+def _orjson_lines(rows):
+    """
+    orjson backend: compact UTF-8 output, encoded straight to bytes.
+    Rows orjson rejects (e.g. integers wider than 64 bits) fall back to
+    the stdlib one by one.
+    """
+    import orjson
+
+    dumps = orjson.dumps
+    try:
+        return b"".join([dumps(row, option=orjson.OPT_APPEND_NEWLINE) for row in rows])
+    except orjson.JSONEncodeError:
+        out = []
+        for row in rows:
+            try:
+                out.append(dumps(row, option=orjson.OPT_APPEND_NEWLINE))
+            except orjson.JSONEncodeError:
+                out.append(_json_lines([row]))
+        return b"".join(out)
+
+def _has_orjson():
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def get_serializer(name=DEFAULT_SERIALIZER):
+    """
+    Return a function `rows -> bytes` producing JSONL for `rows`.
+
+    'json' always uses the stdlib; 'orjson' requires the orjson package;
+    'auto' picks orjson when available.
+    """
+    if name == "auto":
+        name = "orjson" if _has_orjson() else "json"
+    if name == "json":
+        return _json_lines
+    if name == "orjson":
+        if not _has_orjson():
+            raise ImportError("The orjson serializer requires the 'orjson' package")
+        return _orjson_lines
+    raise ValueError(f"Unknown serializer: {name!r}, expected one of {SERIALIZERS}")
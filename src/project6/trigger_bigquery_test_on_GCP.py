@@ -1,6 +1,11 @@
+import hashlib
 import logging
 import os
+import re
+import threading
+import time
 from flask import Request, jsonify
+from google.api_core.exceptions import Conflict, NotFound
 from google.cloud import bigquery
 
 # -------------------------------------------------
@@ -16,8 +21,358 @@ TABLE_MAP = {
     "summary": "glamira_raw"
 }
 
+# Exports may be plain or gzip JSONL or Parquet; BigQuery cannot load zstd JSONL
+SOURCE_FORMATS = {
+    ".jsonl": bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+    ".jsonl.gz": bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+    ".parquet": bigquery.SourceFormat.PARQUET,
+}
+
+# Day-partitioned tables: objects under a dt=YYYY-MM-DD/ prefix are
+# appended to that day's partition through a table$YYYYMMDD decorator.
+# Must match the table load_data.py creates.
+PARTITIONED_TABLES = {
+    "glamira_raw": {
+        "field": "event_date",
+        "clustering_fields": ["collection", "store_id", "product_id"],
+    },
+}
+DAY_PREFIX_RE = re.compile(r"(?:^|/)dt=(\d{4})-(\d{2})-(\d{2})/")
+
+# Table schemas are cached per instance for this many seconds
+SCHEMA_CACHE_TTL = 300
+
+# Micro-batching: with a window > 0, events for the same table that
+# arrive on one instance within the window share one load job. A batch
+# is submitted early once it reaches the file or byte limit. Needs
+# Cloud Run concurrency > 1 to see more than one event at a time.
+COALESCE_WINDOW_SECONDS = float(os.environ.get("COALESCE_WINDOW_SECONDS", "0"))
+COALESCE_MAX_FILES = int(os.environ.get("COALESCE_MAX_FILES", "100"))
+COALESCE_MAX_BYTES = int(os.environ.get("COALESCE_MAX_BYTES", str(50 * 1024**3)))
+
+# Async mode: submit the load job and answer 202 right away; poll
+# GET ?job_id=... for its status
+ASYNC_LOADS = os.environ.get("ASYNC_LOADS", "0") == "1"
+
+# Location of the dataset's jobs, needed to look jobs up by id
+BQ_LOCATION = os.environ.get("BQ_LOCATION") or None
+
+# Redeliveries of an event whose job failed get a new job id, up to this many times
+MAX_JOB_ATTEMPTS = 5
+
 logging.basicConfig(level=logging.INFO)
 
+# -------------------------------------------------
+# WARM STATE (reused across requests on an instance)
+# -------------------------------------------------
+# First matching prefix wins, in TABLE_MAP order
+TABLE_PREFIX_RE = re.compile("|".join(re.escape(prefix) for prefix in TABLE_MAP))
+
+_client = None
+_client_lock = threading.Lock()
+
+_schema_cache = {}  # table_id -> (expires_at, schema)
+_schema_lock = threading.Lock()
+
+
+def get_client():
+    """Process-level BigQuery client, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = bigquery.Client(project=PROJECT_ID)
+    return _client
+
+
+def get_table_schema(client, table_id):
+    """Schema of `table_id`, fetched at most once per SCHEMA_CACHE_TTL."""
+    now = time.monotonic()
+    with _schema_lock:
+        cached = _schema_cache.get(table_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    schema = client.get_table(table_id).schema
+    with _schema_lock:
+        _schema_cache[table_id] = (now + SCHEMA_CACHE_TTL, schema)
+    return schema
+
+
+def invalidate_schema(table_id=None):
+    """Drop the cached schema of `table_id` (decorator ignored), or of every table."""
+    with _schema_lock:
+        if table_id is None:
+            _schema_cache.clear()
+        else:
+            _schema_cache.pop(table_id.split("$")[0], None)
+
+
+def route_table(base):
+    """Target table for a lower-cased object basename, or None."""
+    match = TABLE_PREFIX_RE.match(base)
+    return TABLE_MAP[match.group(0)] if match else None
+
+
+def partition_decorator(table_name, file_name):
+    """
+    `$YYYYMMDD` for an object under `dt=YYYY-MM-DD/` bound for a
+    day-partitioned table, else "" (the load goes to the whole table).
+    """
+    if table_name not in PARTITIONED_TABLES:
+        return ""
+    match = DAY_PREFIX_RE.search(file_name)
+    return f"${''.join(match.groups())}" if match else ""
+
+
+# -------------------------------------------------
+# IDEMPOTENT JOBS
+# -------------------------------------------------
+def load_job_id(bucket, name, generation):
+    """
+    Deterministic job id for one GCS object version, so redelivered
+    finalize events map to the same load job.
+    """
+    digest = hashlib.sha256(f"{bucket}/{name}#{generation}".encode("utf-8")).hexdigest()
+    return f"gcs_load_{digest[:40]}"
+
+
+def batch_job_id(objects):
+    """
+    Deterministic job id for a batch of (bucket, name, generation)
+    object versions, in any order: the same as `load_job_id` for one
+    object. None unless every generation is known.
+    """
+    if not objects or any(not generation for _, _, generation in objects):
+        return None
+    if len(objects) == 1:
+        return load_job_id(*objects[0])
+    key = "\n".join(f"{bucket}/{name}#{generation}" for bucket, name, generation in sorted(objects))
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return f"gcs_batch_{digest[:40]}"
+
+
+def attempt_ids(job_id):
+    """`job_id`, then the ids its retries run under."""
+    yield job_id
+    for attempt in range(1, MAX_JOB_ATTEMPTS):
+        yield f"{job_id}_retry{attempt}"
+
+
+def loading_job(client, job_id):
+    """
+    The job that loads (or loaded) the data of the job `job_id`: the
+    first of it and its retries that did not fail, following a claim
+    (see claim_object). None if each failed or the next was never
+    submitted.
+    """
+    for attempt_id in attempt_ids(job_id):
+        try:
+            job = client.get_job(attempt_id, location=BQ_LOCATION)
+        except NotFound:
+            return None
+        if job.job_type == "query":
+            job = loading_job(client, job.labels["load_job"])
+            if job is not None:
+                return job
+        elif job.state != "DONE" or job.error_result is None:
+            return job
+    return None
+
+
+def submit_load(client, uri, table_id, job_config, job_id=None):
+    """
+    Submit a load job of `uri` (one URI or a list) under `job_id`. If that job already exists and
+    did not fail, return it instead of loading the file again. If it
+    failed, retry under `<job_id>_retry<n>`.
+    """
+    if job_id is None:
+        return client.load_table_from_uri(uri, table_id, job_config=job_config)
+
+    for attempt_id in attempt_ids(job_id):
+        try:
+            return client.load_table_from_uri(
+                uri,
+                table_id,
+                job_id=attempt_id,
+                job_config=job_config
+            )
+        except Conflict:
+            job = client.get_job(attempt_id, location=BQ_LOCATION)
+            if job.job_type == "query":
+                # The object's claim from a batch (see claim_object)
+                job = loading_job(client, job.labels["load_job"])
+                if job is not None:
+                    logging.info(f"Duplicate delivery, loaded by batch job {job.job_id} ({job.state})")
+                    return job
+            elif job.state != "DONE" or job.error_result is None:
+                logging.info(f"Duplicate delivery, reusing job {attempt_id} ({job.state})")
+                return job
+            logging.info(f"Job {attempt_id} failed earlier, retrying")
+
+    raise RuntimeError(f"Load of {uri} failed {MAX_JOB_ATTEMPTS} times")
+
+
+def claim_object(client, source, batch_job):
+    """
+    Record that the object version `source` (bucket, name, generation)
+    is loaded by the batch job `batch_job`, as a no-op `SELECT 1` query
+    job under the object's own job id (see load_job_id) labelled with
+    it. Job ids are unique, so a redelivery of the object in another
+    batch, or alone, finds the job that loads it. Returns None once
+    claimed, or that job.
+    """
+    for claim_id in attempt_ids(load_job_id(*source)):
+        try:
+            client.query(
+                "SELECT 1",
+                job_id=claim_id,
+                job_config=bigquery.QueryJobConfig(labels={"load_job": batch_job}),
+                location=BQ_LOCATION
+            )
+            return None
+        except Conflict:
+            job = loading_job(client, claim_id)
+            if job is not None:
+                return job
+            logging.info(f"Claim {claim_id} is of a failed load, retrying")
+
+    raise RuntimeError(f"Load of gs://{source[0]}/{source[1]} failed {MAX_JOB_ATTEMPTS} times")
+
+
+def job_status(job_id):
+    """HTTP response describing the load job `job_id`, 404 if there is none."""
+    try:
+        job = get_client().get_job(job_id, location=BQ_LOCATION)
+    except NotFound:
+        return (f"Job {job_id} not found", 404)
+    if job.state == "DONE" and job.error_result is not None and job.destination is not None:
+        # The table may have changed under the cached schema
+        invalidate_schema(f"{job.destination.project}.{job.destination.dataset_id}.{job.destination.table_id}")
+
+    return jsonify({
+        "job_id": job.job_id,
+        "state": job.state,
+        "error": job.error_result,
+        "rows_loaded": job.output_rows if job.state == "DONE" else None
+    })
+
+
+# -------------------------------------------------
+# MICRO-BATCHED LOADS
+# -------------------------------------------------
+class LoadBatch:
+    """
+    URIs bound for one table that are loaded by a single job, with the
+    (bucket, name, generation) of each object for the job id. `existing`
+    maps the URIs an earlier job already loads to that job.
+    """
+
+    def __init__(self, client, table_id, job_config):
+        self.client = client
+        self.table_id = table_id
+        self.job_config = job_config
+        self.uris = []
+        self.objects = []
+        self.existing = {}
+        self.bytes = 0
+        self.timer = None
+        self.job = None
+        self.error = None
+        self.done = threading.Event()
+
+
+_batches = {}  # (table_id, source_format) -> open LoadBatch
+_batches_lock = threading.Lock()
+
+
+def submit_batch(batch):
+    """
+    Submit one load job over every URI in `batch`, under the batch's
+    deterministic job id, and wake its waiters once it finished (with
+    ASYNC_LOADS, once it is submitted).
+
+    Each object of a batch of several is claimed for the job first (see
+    claim_object): objects a redelivery already brought in through
+    another job are left out and answered with that job, so a batch
+    with different companions never loads them twice.
+    """
+    try:
+        job_id = batch_job_id(batch.objects)
+        if job_id is not None and len(batch.objects) > 1:
+            for uri, source in zip(batch.uris, batch.objects):
+                job = claim_object(batch.client, source, job_id)
+                if job is not None:
+                    logging.info(f"{uri} is loaded by job {job.job_id}, leaving it out")
+                    batch.existing[uri] = job
+            batch.uris = [uri for uri in batch.uris if uri not in batch.existing]
+
+        if batch.uris:
+            logging.info(f"Loading {len(batch.uris)} files → {batch.table_id}")
+            batch.job = submit_load(
+                batch.client,
+                batch.uris,
+                batch.table_id,
+                batch.job_config,
+                job_id=job_id
+            )
+        if not ASYNC_LOADS:
+            for job in {*batch.existing.values(), batch.job} - {None}:
+                job.result()
+    except Exception as e:
+        # The table may have changed under the cached schema
+        invalidate_schema(batch.table_id)
+        batch.error = e
+    finally:
+        batch.done.set()
+
+
+def _flush_batch(key, batch):
+    with _batches_lock:
+        if _batches.get(key) is not batch:
+            return  # already submitted on a size limit
+        del _batches[key]
+    submit_batch(batch)
+
+
+def coalesced_load(client, table_id, uri, size, job_config, source=None):
+    """
+    Add `uri`, the object version `source` (bucket, name, generation),
+    to the open batch for its table and wait until the batch's load job
+    finishes (with ASYNC_LOADS, until it is submitted). Returns the job
+    loading `uri` and the URIs it loads; raises the batch's error.
+    """
+    key = (table_id, job_config.source_format)
+    full = None
+
+    with _batches_lock:
+        batch = _batches.get(key)
+        if batch is None:
+            batch = LoadBatch(client, table_id, job_config)
+            batch.timer = threading.Timer(COALESCE_WINDOW_SECONDS, _flush_batch, args=(key, batch))
+            batch.timer.daemon = True
+            batch.timer.start()
+            _batches[key] = batch
+
+        batch.uris.append(uri)
+        batch.objects.append(source or (None, uri, None))
+        batch.bytes += size
+        if len(batch.uris) >= COALESCE_MAX_FILES or batch.bytes >= COALESCE_MAX_BYTES:
+            del _batches[key]
+            full = batch
+
+    if full is not None:
+        full.timer.cancel()
+        submit_batch(full)
+
+    batch.done.wait()
+    if batch.error is not None:
+        raise batch.error
+    if uri in batch.existing:
+        return batch.existing[uri], [uri]
+    return batch.job, batch.uris
+
+
 # -------------------------------------------------
 # CLOUD RUN ENTRYPOINT (HTTP)
 # -------------------------------------------------
@@ -25,9 +380,16 @@ def trigger_bigquery_load(request: Request):
     """
     HTTP Cloud Run service.
     Triggered by GCS finalized event or manual test.
+    GET ?job_id=... reports the status of a load job.
     """
 
     try:
+        if request.method == "GET":
+            job_id = request.args.get("job_id")
+            if not job_id:
+                return ("Missing job_id", 400)
+            return job_status(job_id)
+
         event = request.get_json(silent=True)
         if not event:
             return ("No JSON body received", 400)
@@ -46,11 +408,15 @@ def trigger_bigquery_load(request: Request):
         # -----------------------------
         base = os.path.basename(file_name).lower()
 
-        table_name = None
-        for prefix, table in TABLE_MAP.items():
-            if base.startswith(prefix):
-                table_name = table
-                break
+        source_format = next(
+            (fmt for suffix, fmt in SOURCE_FORMATS.items() if base.endswith(suffix)),
+            None
+        )
+        if not source_format:
+            logging.info("File is not JSONL, gzip JSONL or Parquet. Skipping.")
+            return ("Ignored", 200)
+
+        table_name = route_table(base)
 
         if not table_name:
             logging.info("File not mapped to any table. Skipping.")
@@ -59,37 +425,102 @@ def trigger_bigquery_load(request: Request):
         # -----------------------------
         # BigQuery setup
         # -----------------------------
-        client = bigquery.Client(project=PROJECT_ID)
+        client = get_client()
 
         table_id = f"{PROJECT_ID}.{DATASET_ID}.{table_name}"
         uri = f"gs://{bucket}/{file_name}"
+        partitioning = PARTITIONED_TABLES.get(table_name)
 
-        # 🔥 SINGLE SOURCE OF TRUTH: FETCH TABLE SCHEMA
-        table = client.get_table(table_id)
+        # 🔥 SINGLE SOURCE OF TRUTH: TABLE SCHEMA (cached per instance)
+        try:
+            schema = get_table_schema(client, table_id)
+        except NotFound:
+            if partitioning is None or source_format != bigquery.SourceFormat.PARQUET:
+                raise
+            # The load creates the table from the Parquet schema
+            logging.info(f"{table_id} not found, creating it partitioned on {partitioning['field']}")
+            schema = None
 
         job_config = bigquery.LoadJobConfig(
-            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-            schema=table.schema,  # ✅ reuse existing schema
+            source_format=source_format,
+            schema=schema,  # ✅ reuse existing schema
             write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
             ignore_unknown_values=True
         )
 
+        if partitioning is not None:
+            # Same partitioning and clustering as the table; rows outside
+            # the decorator's day fail the load instead of landing elsewhere
+            job_config.time_partitioning = bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY,
+                field=partitioning["field"],
+            )
+            job_config.clustering_fields = partitioning["clustering_fields"]
+            table_id += partition_decorator(table_name, file_name)
+
+        if source_format == bigquery.SourceFormat.PARQUET:
+            # Parquet carries its own schema; map list<struct> to REPEATED
+            job_config.schema = None
+            parquet_options = bigquery.ParquetOptions()
+            parquet_options.enable_list_inference = True
+            job_config.parquet_options = parquet_options
+
+        # Same object version → same job id, so redeliveries never load twice
+        generation = event.get("generation")
+
+        if COALESCE_WINDOW_SECONDS > 0:
+            job, files = coalesced_load(client, table_id, uri, int(event.get("size") or 0), job_config,
+                                        source=(bucket, file_name, generation))
+
+            if ASYNC_LOADS:
+                logging.info(f"Submitted batched job {job.job_id}")
+                return (jsonify({
+                    "status": "accepted",
+                    "table": table_name,
+                    "job_id": job.job_id,
+                    "state": job.state,
+                    "files": files
+                }), 202)
+
+            logging.info(f"Batched load completed successfully: {job.job_id}")
+
+            return jsonify({
+                "status": "success",
+                "table": table_name,
+                "rows_loaded": job.output_rows,
+                "job_id": job.job_id,
+                "files": files
+            })
+
         logging.info(f"Loading {uri} → {table_id}")
 
-        load_job = client.load_table_from_uri(
-            uri,
-            table_id,
-            job_config=job_config
-        )
+        job_id = load_job_id(bucket, file_name, generation) if generation else None
+
+        load_job = submit_load(client, uri, table_id, job_config, job_id=job_id)
+
+        if ASYNC_LOADS:
+            logging.info(f"Submitted job {load_job.job_id}")
+            return (jsonify({
+                "status": "accepted",
+                "table": table_name,
+                "job_id": load_job.job_id,
+                "state": load_job.state
+            }), 202)
 
-        load_job.result()
+        try:
+            load_job.result()
+        except Exception:
+            # The table may have changed under the cached schema
+            invalidate_schema(table_id)
+            raise
 
         logging.info("Load completed successfully")
 
         return jsonify({
             "status": "success",
             "table": table_name,
-            "rows_loaded": load_job.output_rows
+            "rows_loaded": load_job.output_rows,
+            "job_id": load_job.job_id
         })
 
     except Exception as e:
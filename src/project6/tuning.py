@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import threading
+import time
+from project6.metrics import METRICS
+
+# -----------------------------------------------------------
+# Config
+# -----------------------------------------------------------
+TUNE_WINDOW = 5.0       # seconds of measurements behind each decision
+SOURCE_BOUND = 0.25     # share of a window waiting on Mongo round trips that makes the source the bottleneck
+SINK_BOUND = 0.10       # share of a window blocked on uploads that makes the sink the bottleneck
+MIN_GAIN = 0.10         # a change is kept only if its throughput rose by this much
+HOLD_WINDOWS = 3        # windows a knob is left alone after a change was reverted
+IDLE_WINDOWS = 3        # windows in a row a stage is not the bottleneck before its knob shrinks
+
+# -----------------------------------------------------------
+# Hill-climbing knobs
+# -----------------------------------------------------------
+class Knob:
+    """
+    One tuned value within [low, high]. While its stage is the
+    bottleneck it is grown one step per window; a step that does not
+    raise the stage's throughput by MIN_GAIN is undone and the knob is
+    held for HOLD_WINDOWS windows.
+
+    Once the stage has not been the bottleneck for IDLE_WINDOWS windows
+    in a row it is shrunk one step, giving back batch memory or upload
+    connections it no longer needs; a shrink that costs more than
+    MIN_GAIN of the throughput is undone and held the same way.
+    """
+
+    def __init__(self, name, value, low, high, grow, shrink, log=None):
+        self.name = name
+        self.low = low
+        self.high = high
+        self.value = min(high, max(low, value))
+        self.grow = grow
+        self.shrink = shrink
+        self.log = log
+        # (value, throughput, grew) before the last step, until it is judged
+        self._before = None
+        self._hold = 0
+        self._idle = 0
+
+    def step(self, bottleneck, throughput, why):
+        """Judge the last step and maybe take another; returns True if the value changed."""
+        if self._before is not None:
+            value, before, grew = self._before
+            self._before = None
+            if throughput < before * (1 + MIN_GAIN if grew else 1 - MIN_GAIN):
+                self._hold = HOLD_WINDOWS
+                self._set(value, f"{why}; {throughput:,.0f}/s vs {before:,.0f}/s before, reverting")
+                return True
+        self._idle = 0 if bottleneck else self._idle + 1
+        if self._hold:
+            self._hold -= 1
+            return False
+        if bottleneck and self.value < self.high:
+            self._before = (self.value, throughput, True)
+            self._set(min(self.high, self.grow(self.value)), why)
+            return True
+        if self._idle >= IDLE_WINDOWS and self.value > self.low:
+            self._idle = 0
+            self._before = (self.value, throughput, False)
+            self._set(max(self.low, self.shrink(self.value)),
+                      f"{why}; not the bottleneck for {IDLE_WINDOWS} windows, shrinking")
+            return True
+        return False
+
+    def _set(self, value, why):
+        logging.info(f"TUNE {self.name} {self.value} -> {value}: {why}")
+        if self.log is not None:
+            self.log.append({"time": time.time(), "knob": self.name, "from": self.value,
+                             "to": value, "why": why})
+        self.value = value
+
+# -----------------------------------------------------------
+# Adaptive controller
+# -----------------------------------------------------------
+class AdaptiveTuner:
+    """
+    Tunes the Mongo cursor batch size and the upload concurrency of
+    one export loop while it runs, from what the last TUNE_WINDOW
+    seconds looked like:
+
+    - batch_size doubles while waiting on round trips (reported by
+      TunableCursor through `fetched()`) takes more than SOURCE_BOUND
+      of the window, as long as docs per second of waiting keep rising:
+      a far server (high latency per getMore) ends up with big batches,
+      localhost stays small.
+    - upload concurrency grows by 2 while the export is blocked on
+      full upload slots (the upload_wait stage of METRICS) for more
+      than SINK_BOUND of the window, as long as the docs exported per
+      second (the normalize stage) keep rising.
+
+    Each is halved (batch_size) or lowered by 2 (uploads) once its
+    stage has stopped being the bottleneck for IDLE_WINDOWS windows,
+    unless that costs throughput (see Knob).
+
+    `tick()` is called from the export loop; decisions are logged as
+    `TUNE ...` lines and kept in `decisions`. `values()` can be saved
+    and passed back as the start values of the next run.
+    """
+
+    def __init__(self, batch_size, batch_bounds, uploads, upload_bounds, window=None,
+                 clock=time.perf_counter):
+        self.decisions = []
+        self.batch = Knob("batch_size", batch_size, *batch_bounds, grow=lambda v: v * 2,
+                          shrink=lambda v: v // 2, log=self.decisions)
+        self.uploads = Knob("upload_concurrency", uploads, *upload_bounds, grow=lambda v: v + 2,
+                            shrink=lambda v: v - 2, log=self.decisions)
+        self.window = window or TUNE_WINDOW
+        self.clock = clock
+        self.queue = None
+        self._lock = threading.Lock()
+        self._start_window()
+
+    @property
+    def batch_size(self):
+        return self.batch.value
+
+    def attach(self, queue):
+        """Drive the `max_in_flight` of an UploadQueue."""
+        self.queue = queue
+        queue.set_max_in_flight(self.uploads.value)
+
+    def values(self):
+        return {"batch_size": self.batch.value, "upload_concurrency": self.uploads.value}
+
+    def _start_window(self):
+        self._started = self.clock()
+        self._stages = METRICS.snapshot()["stages"]
+        self._fetch_seconds = 0.0
+        self._fetch_docs = 0
+        self._round_trips = 0
+
+    def fetched(self, docs, seconds):
+        """One Mongo round trip returned `docs` after `seconds`."""
+        with self._lock:
+            self._fetch_seconds += seconds
+            self._fetch_docs += docs
+            self._round_trips += 1
+
+    def tick(self):
+        """Decide once a window has passed since the last decision."""
+        elapsed = self.clock() - self._started
+        if elapsed < self.window:
+            return
+        stages = METRICS.snapshot()["stages"]
+
+        def delta(stage, key):
+            return stages.get(stage, {}).get(key, 0) - self._stages.get(stage, {}).get(key, 0)
+
+        with self._lock:
+            fetch_seconds, docs, round_trips = self._fetch_seconds, self._fetch_docs, self._round_trips
+        fetch_share = fetch_seconds / elapsed
+        fetch_rate = docs / fetch_seconds if fetch_seconds else 0.0
+        self.batch.step(
+            fetch_share > SOURCE_BOUND, fetch_rate,
+            f"{fetch_share:.0%} of {elapsed:.1f}s waiting on {round_trips} round trips "
+            f"({fetch_seconds / max(round_trips, 1) * 1000:.0f} ms each)",
+        )
+
+        wait_share = delta("upload_wait", "seconds") / elapsed
+        export_rate = delta("normalize", "count") / elapsed
+        if self.uploads.step(
+            wait_share > SINK_BOUND, export_rate,
+            f"{wait_share:.0%} of {elapsed:.1f}s blocked on uploads, "
+            f"{delta('upload', 'bytes') / elapsed / 1024 ** 2:.1f} MB/s uploaded",
+        ) and self.queue is not None:
+            self.queue.set_max_in_flight(self.uploads.value)
+
+        self._start_window()
+
+def load_tuning(path, key):
+    """Values saved by `save_tuning` under `key`, or {}."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get(key, {})
+
+def save_tuning(path, key, values):
+    """Remember the tuned `values` of a run against `key` (e.g. the Mongo URL)."""
+    saved = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    saved[key] = values
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(saved, f, indent=2)
+    os.replace(tmp_path, path)
+
+# -----------------------------------------------------------
+# Cursor with a batch size that can change
+# -----------------------------------------------------------
+class TunableCursor:
+    """
+    Iterates a find, asking for `tuner.batch_size` documents in each
+    getMore, so the batch size follows the tuner while the cursor runs
+    (a pymongo Cursor's is fixed once it has started). Each round trip
+    is reported to `tuner.fetched()`. The find and its getMores share
+    one explicit session, as the server requires.
+    """
+
+    def __init__(self, collection, query, tuner, projection=None, sort=None):
+        self.collection = collection
+        self.tuner = tuner
+        self._database = collection.database
+        self._session = self._database.client.start_session()
+        self._find = {"filter": query, "noCursorTimeout": True}
+        if projection is not None:
+            self._find["projection"] = projection
+        if sort is not None:
+            self._find["sort"] = sort
+        self._id = None
+        self._docs = iter(())
+
+    def _command(self, *args, **kwargs):
+        start = time.perf_counter()
+        reply = self._database.command(*args, session=self._session,
+                                       codec_options=self.collection.codec_options, **kwargs)
+        return reply["cursor"], time.perf_counter() - start
+
+    def _fetch(self):
+        batch_size = self.tuner.batch_size
+        if self._id is None:
+            cursor, seconds = self._command("find", self.collection.name, batchSize=batch_size,
+                                            **self._find)
+            batch = cursor["firstBatch"]
+        else:
+            cursor, seconds = self._command("getMore", self._id, collection=self.collection.name,
+                                            batchSize=batch_size)
+            batch = cursor["nextBatch"]
+        self._id = cursor["id"]
+        self._docs = iter(batch)
+        self.tuner.fetched(len(batch), seconds)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            for doc in self._docs:
+                return doc
+            if self._id == 0:
+                raise StopIteration
+            self._fetch()
+
+    def close(self):
+        if self._id:
+            self._database.command("killCursors", self.collection.name, cursors=[self._id],
+                                   session=self._session)
+        self._id = 0
+        self._session.end_session()
@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+import time
+
+from project6.metrics import METRICS
+
+# -----------------------------------------------------------
+# Bounded upload queue
+# -----------------------------------------------------------
+class UploadQueue:
+    """
+    Wraps an executor so at most `max_in_flight` upload tasks are
+    submitted and not yet finished. `submit()` blocks the producer
+    until one finishes, and also while the files in `tmp_dir` take more
+    than `max_tmp_bytes`, so local disk holds a few shards instead of
+    everything the uploads have not caught up with.
+
+    Every task must return (raw bytes, uploaded bytes); the totals are
+    kept on the queue. The first failed task fails the queue: the next
+    `submit()` or `join()` raises instead of exporting more shards
+    that would be thrown away.
+    """
+
+    def __init__(self, executor, max_in_flight, tmp_dir=None, max_tmp_bytes=None):
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.tmp_dir = tmp_dir
+        self.max_tmp_bytes = max_tmp_bytes
+        self.raw_bytes = 0
+        self.uploaded_bytes = 0
+        self._in_flight = 0
+        self._error = None
+        self._cond = threading.Condition()
+
+    def _run(self, fn, args, kwargs):
+        # Bookkeeping happens inside the task, so it is complete before
+        # anyone waiting on the future or on join() wakes up
+        try:
+            raw, uploaded = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._cond:
+                if self._error is None:
+                    self._error = e
+                self._in_flight -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self.raw_bytes += raw
+            self.uploaded_bytes += uploaded
+            self._in_flight -= 1
+            self._cond.notify_all()
+        return raw, uploaded
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError(f"Upload failed: {self._error}") from self._error
+
+    def set_max_in_flight(self, max_in_flight):
+        """Change the limit; at most the executor's workers actually run at once."""
+        with self._cond:
+            self.max_in_flight = max_in_flight
+            self._cond.notify_all()
+
+    def tmp_bytes(self):
+        """Bytes used by the files directly under `tmp_dir`."""
+        if not self.tmp_dir or not os.path.isdir(self.tmp_dir):
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(self.tmp_dir) if entry.is_file())
+
+    def _over_disk_cap(self):
+        return self.max_tmp_bytes is not None and self.tmp_bytes() > self.max_tmp_bytes
+
+    def submit(self, fn, *args, **kwargs):
+        """Submit `fn(*args, **kwargs)`, blocking while the queue is full."""
+        with self._cond:
+            paused = False
+            waited = time.perf_counter()
+            while True:
+                self._check()
+                if self._in_flight < self.max_in_flight and not self._over_disk_cap():
+                    break
+                if self._in_flight == 0:
+                    # Nothing in flight can free disk (e.g. the shard
+                    # being submitted is larger than the cap itself)
+                    break
+                if not paused and self._in_flight < self.max_in_flight:
+                    logging.info(f"Temp files over {self.max_tmp_bytes} bytes, pausing export")
+                paused = True
+                self._cond.wait()
+            self._in_flight += 1
+        # Time the producer was blocked by backpressure
+        METRICS.record("upload_wait", time.perf_counter() - waited, 1)
+        return self.executor.submit(self._run, fn, args, kwargs)
+
+    def join(self):
+        """
+        Wait for every submitted task and return (raw bytes, uploaded
+        bytes). Raises as soon as any task fails.
+        """
+        with self._cond:
+            while self._in_flight and self._error is None:
+                self._cond.wait()
+            self._check()
+            return self.raw_bytes, self.uploaded_bytes
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from project6 import export
+from project6.metrics import METRICS
+
+from fakes import FakeBucket
+
+
+@pytest.fixture
+def export_dirs(tmp_path, monkeypatch):
+    """Point export.py's log, temp and state paths at `tmp_path`."""
+    monkeypatch.setattr(export, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(export, "LOG_FILE", str(tmp_path / "export_to_gcs.log"))
+    monkeypatch.setattr(export, "TEMP_DIR", str(tmp_path))
+    monkeypatch.setattr(export, "SUMMARY_TMP_DIR", str(tmp_path / "summary_export"))
+    monkeypatch.setattr(export, "CHECKPOINT_FILE", str(tmp_path / "summary_checkpoint.json"))
+    monkeypatch.setattr(export, "DEDUP_DIR", str(tmp_path / "summary_dedup"))
+    monkeypatch.setattr(export, "TUNING_FILE", str(tmp_path / "summary_tuning.json"))
+    os.makedirs(export.SUMMARY_TMP_DIR, exist_ok=True)
+    METRICS.reset()
+    return tmp_path
+
+
+@pytest.fixture
+def bucket():
+    return FakeBucket()
@@ -0,0 +1,317 @@
+"""
+Test doubles for the summary collection and the GCS bucket: docs come
+from benchmark.synthetic_docs, objects are kept in memory.
+"""
+import time
+import types
+
+import bson
+import google_crc32c
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from google.api_core.exceptions import BadRequest, PreconditionFailed
+
+from project6.benchmark import synthetic_docs
+from project6.gcs_compose import encode_crc32c
+
+
+class FakeSummaryCollection:
+    """
+    Stand-in for the summary collection. Cursors generate synthetic
+    docs a batch at a time and hand them out decoded from BSON, as a
+    real cursor does (as RawBSONDocument with `raw_bson`), projected
+    like the server would. Time spent generating and encoding is kept
+    in `source_seconds` so it can be left out of the export's rate.
+    Each batch takes `latency` more seconds, like a far server's round
+    trip. `watch()` replays the same docs as a change stream, and
+    `database.command()` serves the find and getMore commands of a
+    TunableCursor.
+    """
+
+    name = "summary"
+
+    def __init__(self, n_docs, seed=0, raw_bson=False, rate=None, stop=None, linger=0.0, latency=0.0):
+        self.n_docs = n_docs
+        self.seed = seed
+        self.raw_bson = raw_bson
+        self.latency = latency
+        self.codec_options = CodecOptions(document_class=RawBSONDocument if raw_bson else dict)
+        self.database = FakeDatabase(self)
+        self.source_seconds = 0.0
+        # Change streams (see FakeChangeStream)
+        self.rate = rate
+        self.stop = stop
+        self.linger = linger
+        self.streams = []
+
+    def find(self, query=None, projection=None, no_cursor_timeout=False):
+        return FakeCursor(self, projection)
+
+    def watch(self, pipeline=None, resume_after=None, max_await_time_ms=1000, batch_size=None):
+        stream = FakeChangeStream(self, resume_after, max_await_time_ms / 1000)
+        self.streams.append(stream)
+        return stream
+
+    def next_batch(self, docs, projection, batch_size):
+        """Up to `batch_size` of `docs`, projected and decoded, after `latency`."""
+        start = time.perf_counter()
+        batch = []
+        for doc in docs:
+            if projection:
+                doc = {k: v for k, v in doc.items() if k == "_id" or k in projection}
+            batch.append(bson.encode(doc))
+            if len(batch) >= batch_size:
+                break
+        self.source_seconds += time.perf_counter() - start
+        time.sleep(self.latency)
+        return [RawBSONDocument(data) if self.raw_bson else bson.decode(data) for data in batch]
+
+
+class FakeSession:
+    def end_session(self):
+        pass
+
+
+class FakeDatabase:
+    """The find, getMore and killCursors commands over a FakeSummaryCollection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.client = types.SimpleNamespace(start_session=FakeSession)
+        self._cursors = {}
+
+    def command(self, name, value, session=None, codec_options=None, batchSize=None,
+                projection=None, **kwargs):
+        col = self.collection
+        if name == "killCursors":
+            for cursor_id in kwargs["cursors"]:
+                self._cursors.pop(cursor_id, None)
+            return {"ok": 1}
+        if name == "find":
+            cursor_id = len(self._cursors) + 1
+            self._cursors[cursor_id] = (synthetic_docs(col.n_docs, col.seed), projection)
+        else:
+            cursor_id = value
+        docs, projection = self._cursors[cursor_id]
+        batch = col.next_batch(docs, projection, batchSize)
+        if len(batch) < batchSize:
+            del self._cursors[cursor_id]
+            cursor_id = 0
+        key = "firstBatch" if name == "find" else "nextBatch"
+        return {"cursor": {"id": cursor_id, key: batch}, "ok": 1}
+
+
+class FakeCursor:
+    def __init__(self, collection, projection):
+        self.collection = collection
+        self.projection = projection
+        self._batch_size = 1000
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, n):
+        self._batch_size = n
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        col = self.collection
+        docs = synthetic_docs(col.n_docs, col.seed)
+        while True:
+            batch = col.next_batch(docs, self.projection, self._batch_size)
+            if not batch:
+                return
+            yield from batch
+
+
+class FakeChangeStream:
+    """
+    Simulated change stream of the collection's synthetic docs as
+    inserts, `rate` per second (None: as fast as they are read). Resume
+    tokens are event positions. `try_next()` waits up to `await_seconds`
+    for the next event, like a getMore with max_await_time_ms, and sets
+    the collection's `stop` event once it has been drained for `linger`
+    seconds. `emitted` keeps the time each event was handed out.
+    """
+
+    def __init__(self, collection, resume_after=None, await_seconds=1.0):
+        self.collection = collection
+        self.await_seconds = await_seconds
+        self.position = int(resume_after["_data"], 16) if resume_after else 0
+        self._docs = synthetic_docs(collection.n_docs, collection.seed)
+        for _ in range(self.position):
+            next(self._docs)
+        self._started = time.perf_counter()
+        self._drained_at = None
+        self.emitted = []
+        # Set when an invalidate event closed the stream
+        self.invalidated = False
+
+    @property
+    def resume_token(self):
+        return {"_data": f"{self.position:016x}"}
+
+    @property
+    def alive(self):
+        return not self.invalidated
+
+    def try_next(self):
+        col = self.collection
+        now = time.perf_counter()
+        if col.rate:
+            due = self._started + len(self.emitted) / col.rate
+            if due > now:
+                time.sleep(min(due - now, self.await_seconds))
+                if due > time.perf_counter():
+                    return None
+        doc = next(self._docs, None)
+        if doc is None:
+            self._drained_at = self._drained_at or now
+            if now - self._drained_at >= col.linger and col.stop is not None:
+                col.stop.set()
+            time.sleep(min(self.await_seconds, 0.05))
+            return None
+        self.position += 1
+        self.emitted.append(time.perf_counter())
+        return {"_id": self.resume_token, "operationType": "insert",
+                "fullDocument": bson.decode(bson.encode(doc))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeBlob:
+    """
+    Object of a FakeBucket. Objects written from memory (strings,
+    composite parts and what they compose to) keep their bytes and
+    real CRC32C; files only their size, with a made-up CRC32C.
+    """
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        # CRC32C set before an upload, checked like GCS does
+        self._crc32c = None
+
+    @property
+    def size(self):
+        return self.bucket.objects.get(self.name)
+
+    @property
+    def crc32c(self):
+        if self.name in self.bucket.data:
+            return encode_crc32c(google_crc32c.Checksum(self.bucket.data[self.name]))
+        size = self.size
+        return None if size is None else f"fake-{size}"
+
+    @crc32c.setter
+    def crc32c(self, value):
+        self._crc32c = value
+
+    @property
+    def generation(self):
+        return self.bucket.generations.get(self.name)
+
+    def reload(self, **kwargs):
+        pass
+
+    def upload_from_filename(self, path, **kwargs):
+        # Read the file as the real client would; only its size and
+        # line count (rows of an uncompressed JSONL shard) are kept
+        size = lines = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                size += len(chunk)
+                lines += chunk.count(b"\n")
+        if self.bucket.bandwidth:
+            time.sleep(size / self.bucket.bandwidth)
+        self.bucket.objects[self.name] = size
+        self.bucket.lines[self.name] = lines
+        self.bucket.finished[self.name] = time.perf_counter()
+
+    def upload_from_string(self, data, if_generation_match=None, **kwargs):
+        if if_generation_match is not None and if_generation_match != (self.generation or 0):
+            raise PreconditionFailed(self.name)
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        if self._crc32c is not None and self._crc32c != encode_crc32c(google_crc32c.Checksum(data)):
+            raise BadRequest(f"Provided CRC32C doesn't match calculated CRC32C of {self.name}")
+        self._store(data)
+
+    def _store(self, data):
+        self.bucket.objects[self.name] = len(data)
+        self.bucket.data[self.name] = data
+        self.bucket.generations[self.name] = (self.generation or 0) + 1
+
+    def download_as_bytes(self, **kwargs):
+        return self.bucket.data[self.name]
+
+    def open(self, mode="wb", **kwargs):
+        return FakeWriter(self)
+
+    def compose(self, sources, **kwargs):
+        data = b"".join(self.bucket.data[source.name] for source in sources)
+        if self.bucket.corrupt_compose:
+            data = data[:-1]
+        self._store(data)
+
+    def delete(self, **kwargs):
+        for objects in (self.bucket.objects, self.bucket.lines, self.bucket.finished,
+                        self.bucket.data, self.bucket.generations):
+            objects.pop(self.name, None)
+
+
+class FakeWriter:
+    def __init__(self, blob):
+        self.blob = blob
+        self.size = 0
+        self.lines = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self.lines += data.count(b"\n")
+
+    def close(self):
+        self.blob.bucket.objects[self.blob.name] = self.size
+        self.blob.bucket.lines[self.blob.name] = self.lines
+        self.blob.bucket.finished[self.blob.name] = time.perf_counter()
+
+
+class FakeBucket:
+    """
+    Stand-in GCS bucket that records the size of every object written.
+    With `bandwidth`, each upload from a file goes at that many bytes
+    per second, like one slow connection.
+    """
+
+    def __init__(self, bandwidth=None, corrupt_compose=False):
+        self.bandwidth = bandwidth
+        # Drop the last byte of composed objects, to fail their CRC32C check
+        self.corrupt_compose = corrupt_compose
+        self.objects = {}
+        self.lines = {}
+        self.finished = {}
+        # Small objects written from memory (day manifests) and versions
+        self.data = {}
+        self.generations = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix=""):
+        return [FakeBlob(self, name) for name in list(self.objects) if name.startswith(prefix)]
+
+    def delete_blobs(self, blobs, on_error=None, **kwargs):
+        for blob in blobs:
+            if blob.name in self.objects:
+                blob.delete()
+            elif on_error is not None:
+                on_error(blob)
@@ -0,0 +1,72 @@
+import datetime
+import json
+
+import pytest
+
+from project6 import export
+from project6.benchmark import synthetic_docs
+from project6.columnar import arrow_schema, parquet_row_groups, parquet_writer, rows_to_table
+from project6.metrics import METRICS
+from project6.serializers import get_serializer
+
+# Integers BigQuery (INT64) and the Parquet int64 columns can't hold
+TOO_BIG = [str(2 ** 63), 1e30, -(2 ** 64)]
+
+
+@pytest.fixture(autouse=True)
+def metrics():
+    METRICS.reset()
+
+
+def overflowing_docs():
+    docs = list(synthetic_docs(3))
+    for doc, value in zip(docs, TOO_BIG):
+        doc["recommendation_clicked_position"] = value
+        doc["cart_products"] = [{"product_id": value, "amount": str(2 ** 63 - 1),
+                                 "option": [{"option_id": value}]}]
+    return docs
+
+
+def normalized(docs, normalize):
+    rows = []
+    for doc in docs:
+        row = normalize(doc)
+        row[export.PARTITION_FIELD] = export.event_date(row["time_stamp"], doc["_id"])
+        rows.append(row)
+    return rows
+
+
+@pytest.mark.parametrize("normalize", [
+    export.compile_normalizer(export.summary_schema),
+    lambda doc: export.normalize_doc(doc, export.summary_schema),
+], ids=["compiled", "normalize_doc"])
+def test_integers_outside_int64_become_null_and_are_counted(normalize):
+    rows = normalized(overflowing_docs(), normalize)
+
+    assert [row["recommendation_clicked_position"] for row in rows] == [None] * 3
+    assert [row["cart_products"][0]["product_id"] for row in rows] == [None] * 3
+    assert [row["cart_products"][0]["option"][0]["option_id"] for row in rows] == [None] * 3
+    # The largest INT64 is kept
+    assert {row["cart_products"][0]["amount"] for row in rows} == {2 ** 63 - 1}
+    failures = METRICS.snapshot()["cast_failures"]
+    assert failures["recommendation_clicked_position"] == 3
+    assert sum(failures.values()) == 9
+
+
+def test_parquet_round_trips_to_the_jsonl_rows(tmp_path):
+    normalize = export.compile_normalizer(export.summary_schema)
+    rows = normalized(list(synthetic_docs(2000, seed=3)) + overflowing_docs(), normalize)
+    schema = arrow_schema(export.shard_schema)
+
+    path = str(tmp_path / "summary_00000.parquet")
+    writer = parquet_writer(path, schema)
+    for start in range(0, len(rows), 500):
+        writer.write_table(rows_to_table(rows[start:start + 500], schema))
+    writer.close()
+    from_parquet = [row for table in parquet_row_groups(path) for row in table.to_pylist()]
+    for row in from_parquet:
+        row[export.PARTITION_FIELD] = row[export.PARTITION_FIELD].isoformat()
+
+    jsonl = get_serializer("json")(rows).decode("utf-8").splitlines()
+    assert from_parquet == [json.loads(line) for line in jsonl]
+    assert isinstance(rows[0][export.PARTITION_FIELD], datetime.date)
@@ -0,0 +1,92 @@
+import collections
+import json
+
+import pytest
+
+from project6.csv_convert import RAGGED_ROWS, convert_csv, csv_chunks, merge_parts
+from project6.columnar import parquet_row_groups
+
+TYPES = {"id": "INTEGER", "price": "FLOAT", "ok": "BOOLEAN"}
+
+CSV = (
+    "id,name,price,ok\n"
+    "1,plain,1.5,true\n"
+    "+2,,1e999,0\n"
+    "3.0,\"multi\nline, \"\"quoted\"\"\",-.5,FALSE\n"
+    ",empty,,\n"
+    "12345678901234567890,too big,abc,maybe\n"
+    "6,short,2\n"
+    "7,long,3,true,extra\n"
+    "8, padded ,  4e2 , 1 \n"
+)
+
+EXPECTED = [
+    {"id": 1, "name": "plain", "price": 1.5, "ok": True},
+    {"id": 2, "name": None, "price": None, "ok": False},
+    {"id": 3, "name": 'multi\nline, "quoted"', "price": -0.5, "ok": False},
+    {"id": None, "name": "empty", "price": None, "ok": None},
+    {"id": None, "name": "too big", "price": None, "ok": None},
+    {"id": 8, "name": " padded ", "price": 400.0, "ok": True},
+]
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_bytes(CSV.encode("utf-8"))
+    return str(path)
+
+
+def read_jsonl(path):
+    with open(path, "rb") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("engine", ["arrow", "python"])
+def test_cells_are_cast_and_bad_ones_nulled_and_counted(csv_file, tmp_path, engine):
+    out_path = str(tmp_path / "data.jsonl")
+    failures = collections.Counter()
+
+    rows = convert_csv(csv_file, out_path, TYPES, engine=engine, failures=failures)
+
+    assert rows == len(EXPECTED)
+    assert read_jsonl(out_path) == EXPECTED
+    # 1e999 overflows FLOAT64; empty cells are null but not failures
+    assert failures == {"id": 1, "price": 2, "ok": 1, RAGGED_ROWS: 2}
+
+
+def test_parquet_output_holds_the_same_rows(csv_file, tmp_path):
+    out_path = str(tmp_path / "data.parquet")
+
+    convert_csv(csv_file, out_path, TYPES, file_format="parquet")
+
+    assert [row for table in parquet_row_groups(out_path) for row in table.to_pylist()] == EXPECTED
+
+
+def test_chunks_never_split_a_quoted_value(tmp_path):
+    path = tmp_path / "quoted.csv"
+    lines = ["id,text\n"]
+    for i in range(200):
+        text = f'"row {i}\nsecond line\n""third"" line"' if i % 3 == 0 else f"row {i}"
+        lines.append(f"{i},{text}\n")
+    path.write_bytes("".join(lines).encode("utf-8"))
+
+    ranges = csv_chunks(str(path), 100)
+
+    assert len(ranges) > 10
+    assert ranges[0][0] == len(lines[0]) and ranges[-1][1] == path.stat().st_size
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    parts = []
+    for n, byte_range in enumerate(ranges):
+        part = str(tmp_path / f"part_{n}.jsonl")
+        convert_csv(str(path), part, {"id": "INTEGER"}, byte_range=byte_range)
+        parts.append(part)
+    merge_parts(parts, str(tmp_path / "merged.jsonl"))
+
+    whole = str(tmp_path / "whole.jsonl")
+    assert convert_csv(str(path), whole, {"id": "INTEGER"}) == 200
+    assert read_jsonl(str(tmp_path / "merged.jsonl")) == read_jsonl(whole)
+
+
+def test_small_file_is_one_chunk(csv_file):
+    assert csv_chunks(csv_file, 1 << 20) == [(len("id,name,price,ok\n"), len(CSV.encode("utf-8")))]
@@ -0,0 +1,57 @@
+import os
+import threading
+
+from project6 import dedup
+from project6.dedup import DedupIndex
+
+
+def ids(start, n):
+    return [i.to_bytes(12, "big") for i in range(start, start + n)]
+
+
+class BlockedBloomFilter(dedup.BloomFilter):
+    """Bloom filter whose grown instances wait for `release` before being built."""
+
+    release = threading.Event()
+    started = threading.Event()
+
+    def __init__(self, capacity, *args, **kwargs):
+        if threading.current_thread().name == "dedup-bloom":
+            self.started.set()
+            assert self.release.wait(10)
+        super().__init__(capacity, *args, **kwargs)
+
+
+def test_filter_grows_without_blocking_commits(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "BloomFilter", BlockedBloomFilter)
+    index = DedupIndex(str(tmp_path), capacity=1000)
+    initial = index.bloom
+
+    index.commit(b"".join(ids(0, 1500)))
+    assert BlockedBloomFilter.started.wait(10)
+    # Committed and looked up while the grown filter is being built
+    index.commit(b"".join(ids(1500, 500)))
+    assert index.bloom is initial
+    assert ids(1999, 1)[0] in index
+
+    BlockedBloomFilter.release.set()
+    index._grower.join(10)
+
+    assert index.bloom.capacity == 3000
+    assert all(key in index.bloom for key in ids(0, 2000))
+    assert ids(5000, 1)[0] not in index
+
+
+def test_grown_filter_is_saved_on_close(tmp_path):
+    index = DedupIndex(str(tmp_path), capacity=1000)
+    for start in range(0, 5000, 500):
+        index.commit(b"".join(ids(start, 500)))
+    index.close()
+    assert os.path.exists(tmp_path / "bloom.bin")
+
+    reopened = DedupIndex(str(tmp_path), capacity=1000)
+
+    assert reopened.bloom.capacity > 1000
+    assert all(key in reopened for key in ids(0, 5000))
+    assert not any(key in reopened for key in ids(5000, 1000))
+    reopened.close()
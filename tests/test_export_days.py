@@ -0,0 +1,130 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+
+from project6 import export
+from project6.upload_queue import UploadQueue
+
+from fakes import FakeSummaryCollection
+
+# 2020-04-01 00:00:00 UTC
+DAY0 = 1585699200
+
+
+def day_docs(days, per_day):
+    """`per_day` docs on each of `days` consecutive days, round robin over the days."""
+    return [
+        {"_id": ObjectId(), "collection": "view_product_detail", "time_stamp": DAY0 + d * 86400 + i}
+        for i in range(per_day)
+        for d in range(days)
+    ]
+
+
+def run_in_thread(fn, timeout=30):
+    """Run `fn` on a thread; returns its result, or fails if it is still running after `timeout`."""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "export loop hung"
+    return result["value"]
+
+
+def test_stream_with_more_days_than_upload_slots(export_dirs, bucket):
+    uploads = UploadQueue(ThreadPoolExecutor(max_workers=2), max_in_flight=2)
+    docs = day_docs(days=5, per_day=20)
+
+    written = run_in_thread(lambda: export.write_shards(
+        iter(docs), bucket, uploads, stream=True, compression="none",
+    ))
+    uploads.join()
+    uploads.shutdown()
+
+    assert written == len(docs)
+    assert sum(bucket.lines.values()) == len(docs)
+    assert {name.split("/")[-2] for name in bucket.lines} == {
+        f"dt=2020-04-0{d}" for d in range(1, 6)
+    }
+
+
+def test_stream_follows_a_lowered_upload_limit(export_dirs, bucket):
+    # The adaptive tuner may lower max_in_flight while days are open
+    uploads = UploadQueue(ThreadPoolExecutor(max_workers=4), max_in_flight=4)
+    docs = iter(day_docs(days=6, per_day=20))
+
+    def lowered():
+        for i, doc in enumerate(docs):
+            if i == 10:
+                uploads.set_max_in_flight(1)
+            yield doc
+
+    written = run_in_thread(lambda: export.write_shards(
+        lowered(), bucket, uploads, stream=True, compression="none",
+    ))
+    uploads.join()
+    uploads.shutdown()
+
+    assert written == 120
+    assert sum(bucket.lines.values()) == 120
+
+
+class FailingCollection(FakeSummaryCollection):
+    """Serves one cursor batch, then fails like a dropped connection."""
+
+    def next_batch(self, docs, projection, batch_size):
+        if getattr(self, "served", False):
+            raise ConnectionError("connection reset")
+        self.served = True
+        return super().next_batch(docs, projection, batch_size)
+
+
+def full_export(monkeypatch, bucket, collection):
+    monkeypatch.setattr(export, "get_summary_collection", lambda mongo_options=None: collection)
+    monkeypatch.setattr(export, "get_bucket", lambda: bucket)
+    export.export_to_gcs(compression="none", shard_bytes=200_000,
+                         mongo_options={"batch_size": 1000})
+
+
+def manifest(bucket, day="2020-04-01"):
+    return json.loads(bucket.data[f"{export.BLOB_PREFIX}/dt={day}/_manifest.json"])
+
+
+def test_failed_full_export_keeps_the_previous_one_loadable(export_dirs, bucket, monkeypatch):
+    full_export(monkeypatch, bucket, FakeSummaryCollection(3000))
+    before = manifest(bucket)
+    assert before["rows"] == 3000 and len(before["shards"]) > 1
+
+    full_export(monkeypatch, bucket, FailingCollection(3000))
+
+    assert manifest(bucket) == before
+    for shard in before["shards"]:
+        assert bucket.objects[shard["name"]] == shard["bytes"]
+
+
+def test_full_export_deletes_earlier_shards_once_committed(export_dirs, bucket, monkeypatch):
+    full_export(monkeypatch, bucket, FakeSummaryCollection(3000))
+    first = {shard["name"] for shard in manifest(bucket)["shards"]}
+    # Kept: shards of other kinds of runs
+    tail_shard = f"{export.BLOB_PREFIX}/dt=2020-04-01/summary_tail_20200401T000000_00000.jsonl"
+    bucket.blob(tail_shard).upload_from_string("{}\n")
+
+    full_export(monkeypatch, bucket, FakeSummaryCollection(3000))
+    second = {shard["name"] for shard in manifest(bucket)["shards"]}
+
+    assert not first & second
+    assert manifest(bucket)["rows"] == 3000
+    shards = {name for name in bucket.objects if not name.endswith("_manifest.json")}
+    assert shards == second | {tail_shard}
+
+
+def test_shards_are_cut_at_shard_bytes(export_dirs, bucket, monkeypatch):
+    # Far fewer bytes than a MONGO_BATCH of rows
+    full_export(monkeypatch, bucket, FakeSummaryCollection(3000))
+
+    shards = manifest(bucket)["shards"]
+    assert len(shards) > 5
+    sizes = [bucket.objects[shard["name"]] for shard in shards]
+    # Buffered rows count at the average row size: within a few rows of it
+    assert all(abs(size - 200_000) < 10_000 for size in sizes[:-1])
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from project6 import gcs_compose
+
+from fakes import FakeBlob, FakeBucket
+
+MB = 1024 * 1024
+
+
+class RecordingBlob(FakeBlob):
+    """FakeBlob that records the client and timeout of every call, and slows part uploads."""
+
+    def upload_from_string(self, data, **kwargs):
+        bucket = self.bucket
+        with bucket.lock:
+            bucket.calls.append(("upload", kwargs.get("client"), kwargs.get("timeout")))
+            bucket.uploading += 1
+            bucket.max_uploading = max(bucket.max_uploading, bucket.uploading)
+        try:
+            time.sleep(bucket.part_latency)
+            super().upload_from_string(data, **kwargs)
+        finally:
+            with bucket.lock:
+                bucket.uploading -= 1
+
+    def compose(self, sources, **kwargs):
+        self.bucket.calls.append(("compose", kwargs.get("client"), kwargs.get("timeout")))
+        super().compose(sources, **kwargs)
+
+
+class RecordingBucket(FakeBucket):
+    def __init__(self, part_latency=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.part_latency = part_latency
+        self.lock = threading.Lock()
+        self.calls = []
+        self.uploading = self.max_uploading = 0
+
+    def blob(self, name):
+        return RecordingBlob(self, name)
+
+
+def write_file(path, size):
+    data = os.urandom(size)
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+
+def test_composite_upload_matches_the_file(tmp_path):
+    bucket = FakeBucket()
+    path = tmp_path / "shard.jsonl.gz"
+    data = write_file(path, 5 * MB + 123)
+
+    uploaded = gcs_compose.upload_composite(bucket.blob("shard.jsonl.gz"), str(path), part_size=MB)
+
+    assert uploaded == len(data)
+    assert bucket.data["shard.jsonl.gz"] == data
+    # Parts are deleted
+    assert list(bucket.objects) == ["shard.jsonl.gz"]
+
+
+def test_crc_mismatch_deletes_the_composed_object(tmp_path):
+    bucket = FakeBucket(corrupt_compose=True)
+    path = tmp_path / "shard.jsonl.gz"
+    write_file(path, 3 * MB)
+
+    with pytest.raises(ValueError, match="CRC32C mismatch"):
+        gcs_compose.upload_composite(bucket.blob("shard.jsonl.gz"), str(path), part_size=MB)
+
+    assert bucket.objects == {}
+
+
+def test_failed_part_fails_the_upload_and_leaves_no_parts(tmp_path, monkeypatch):
+    bucket = FakeBucket()
+    path = tmp_path / "shard.jsonl.gz"
+    write_file(path, 3 * MB)
+
+    # Parts whose CRC32C doesn't match their data are rejected, as by GCS
+    monkeypatch.setattr(gcs_compose, "encode_crc32c", lambda checksum: "AAAAAA==")
+
+    with pytest.raises(Exception, match="CRC32C"):
+        gcs_compose.upload_composite(bucket.blob("shard.jsonl.gz"), str(path), part_size=MB)
+
+    assert bucket.objects == {}
+
+
+def test_upload_from_path_passes_client_and_timeout_to_composite_uploads(tmp_path, monkeypatch):
+    monkeypatch.setattr(gcs_compose, "PART_SIZE", MB)
+    bucket = RecordingBucket()
+    path = tmp_path / "product_info.jsonl"
+    write_file(path, 3 * MB)
+    client = object()
+
+    gcs_compose.upload_from_path(bucket.blob("product_info.jsonl"), str(path), threshold=2 * MB,
+                                 client=client, timeout=1200)
+
+    assert [call[0] for call in bucket.calls].count("compose") == 1
+    assert {(c, t) for _, c, t in bucket.calls} == {(client, 1200)}
+
+
+def test_parts_are_bounded_across_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(gcs_compose, "_part_slots", threading.BoundedSemaphore(2))
+    bucket = RecordingBucket(part_latency=0.05)
+    paths = []
+    for i in range(3):
+        paths.append(tmp_path / f"shard_{i}.jsonl.gz")
+        write_file(paths[-1], 4 * MB)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        sizes = list(pool.map(
+            lambda path: gcs_compose.upload_composite(bucket.blob(path.name), str(path), part_size=MB),
+            paths,
+        ))
+
+    assert sizes == [4 * MB] * 3
+    assert bucket.max_uploading <= 2
+    assert sorted(bucket.objects) == [path.name for path in paths]
@@ -0,0 +1,106 @@
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from project6.gcs_stream import GCSStreamWriter
+
+CHUNK = 256 * 1024
+
+
+class FakeResumableWriter:
+    """Resumable upload of a MemoryBlob: the object only exists once closed."""
+
+    def __init__(self, blob, fail_after=None):
+        self.blob = blob
+        self.data = bytearray()
+        self.fail_after = fail_after
+
+    def write(self, data):
+        if self.fail_after is not None and len(self.data) >= self.fail_after:
+            raise ConnectionError("upload session expired")
+        self.data += data
+
+    def close(self):
+        self.blob.objects[self.blob.name] = bytes(self.data)
+
+
+class MemoryBlob:
+    def __init__(self, name, fail_after=None):
+        self.name = name
+        self.objects = {}
+        self.fail_after = fail_after
+
+    def open(self, mode="wb", **kwargs):
+        return FakeResumableWriter(self, self.fail_after)
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+def rows(n):
+    return [f'{{"row": {i}, "pad": "{"x" * 100}"}}\n' for i in range(n)]
+
+
+def test_close_finalizes_the_object(executor):
+    blob = MemoryBlob("summary_00000.jsonl")
+    writer = GCSStreamWriter(blob, executor, chunk_size=CHUNK, max_pending=2)
+    data = rows(10000)
+    for row in data:
+        writer.write(row)
+
+    raw, uploaded = writer.close().result()
+
+    expected = "".join(data).encode("utf-8")
+    assert blob.objects[blob.name] == expected
+    assert raw == uploaded == len(expected)
+
+
+def test_close_compresses_each_chunk_into_one_gzip_stream(executor):
+    blob = MemoryBlob("summary_00000.jsonl.gz")
+    writer = GCSStreamWriter(blob, executor, chunk_size=CHUNK, max_pending=2, compression="gzip")
+    data = rows(10000)
+    for row in data:
+        writer.write(row.encode("utf-8"))
+
+    raw, uploaded = writer.close().result()
+
+    assert gzip.decompress(blob.objects[blob.name]) == "".join(data).encode("utf-8")
+    assert uploaded == len(blob.objects[blob.name]) < raw
+
+
+def test_abort_leaves_no_object(executor):
+    blob = MemoryBlob("summary_00000.jsonl")
+    writer = GCSStreamWriter(blob, executor, chunk_size=CHUNK, max_pending=2)
+    for row in rows(5000):
+        writer.write(row)
+
+    writer.abort()
+
+    with pytest.raises(RuntimeError, match="aborted"):
+        writer._future.result(timeout=10)
+    assert blob.objects == {}
+
+
+def test_upload_error_is_raised_from_write(executor):
+    blob = MemoryBlob("summary_00000.jsonl", fail_after=CHUNK)
+    writer = GCSStreamWriter(blob, executor, chunk_size=CHUNK, max_pending=2)
+
+    with pytest.raises(ConnectionError, match="expired"):
+        # Far more than max_pending chunks: a dead upload must not block the producer
+        for row in rows(100000):
+            writer.write(row)
+    assert blob.objects == {}
+
+
+def test_upload_error_is_raised_from_close(executor):
+    blob = MemoryBlob("summary_00000.jsonl", fail_after=0)
+    writer = GCSStreamWriter(blob, executor, chunk_size=CHUNK, max_pending=2)
+    writer.write("x" * 100)
+
+    with pytest.raises(ConnectionError):
+        writer.close().result(timeout=10)
+    assert blob.objects == {}
@@ -0,0 +1,47 @@
+import pytest
+
+from project6.geoip import IpLocations, ipv4_int
+
+ROWS = [
+    ("10.0.0.1", "Vietnam", "Hanoi", "Hanoi"),
+    ("8.0.0.1", "United States", "California", "Mountain View"),
+    ("2001:db8::1", "Germany", "Berlin", "Berlin"),
+    ("unknown", "France", None, None),
+]
+
+
+@pytest.fixture
+def index():
+    return IpLocations.from_rows(ROWS)
+
+
+def test_dotted_quads_are_parsed():
+    assert ipv4_int("10.0.0.1") == 0x0A000001
+    assert ipv4_int("255.255.255.255") == 2 ** 32 - 1
+
+
+@pytest.mark.parametrize("ip", ["010.0.0.1", "10.1", "10.0.0.1 x", "167772161", "0x0a.0.0.1", "", None])
+def test_other_forms_inet_aton_accepts_are_not_ipv4(ip):
+    assert ipv4_int(ip) is None
+
+
+@pytest.mark.parametrize("ip", ["010.0.0.1", "10.1", "10.0.0.1 x", "167772161"])
+def test_malformed_ips_get_no_location(index, ip):
+    assert index.lookup(ip) is None
+    assert index.enrich({"ip": ip}) == {"ip": ip, "country": None, "region": None, "city": None}
+
+
+def test_lookup_matches_the_exact_ip(index):
+    assert index.lookup("10.0.0.1") == ("Vietnam", "Hanoi", "Hanoi")
+    assert index.lookup("8.0.0.1")[0] == "United States"
+    assert index.lookup("10.0.0.2") is None
+    # Anything but IPv4 is matched as a string
+    assert index.lookup("2001:db8::1") == ("Germany", "Berlin", "Berlin")
+    assert index.lookup("unknown") == ("France", None, None)
+
+
+def test_malformed_ips_in_the_csv_only_match_themselves():
+    index = IpLocations.from_rows([("010.0.0.1", "Vietnam", "Hanoi", "Hanoi")])
+
+    assert index.lookup("8.0.0.1") is None
+    assert index.lookup("010.0.0.1") == ("Vietnam", "Hanoi", "Hanoi")
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+from bson import ObjectId
+
+from project6 import export
+from project6.checkpoint import ExportCheckpoint
+
+# 2020-04-01 00:00:00 UTC
+DAY0 = 1585699200
+
+
+class IdCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs = sorted(self.docs, key=lambda doc: doc["_id"])
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def close(self):
+        pass
+
+
+class IdCollection:
+    """find/find_one over docs, comparing `_id` bounds type-bracketed like the server."""
+
+    def __init__(self, ids):
+        self.docs = [{"_id": i, "collection": "view_product_detail", "time_stamp": DAY0 + n}
+                     for n, i in enumerate(ids)]
+
+    def _matching(self, query):
+        cond = query.get("_id", {})
+        return [
+            doc for doc in self.docs
+            if all(type(doc["_id"]) is type(bound) and (doc["_id"] > bound if op == "$gt" else doc["_id"] <= bound)
+                   for op, bound in cond.items())
+        ]
+
+    def find(self, query, projection=None, no_cursor_timeout=False):
+        return IdCursor(self._matching(query))
+
+    def find_one(self, query, projection, sort):
+        # _ids sort by type, then value
+        docs = sorted(self._matching(query), key=lambda doc: (export.id_type(doc["_id"]), doc["_id"]),
+                      reverse=sort[0][1] < 0)
+        return docs[0] if docs else None
+
+
+@pytest.fixture
+def incremental(export_dirs, bucket, monkeypatch):
+    monkeypatch.setattr(export, "get_bucket", lambda: bucket)
+    path = str(export_dirs / "summary_checkpoint.json")
+
+    def run(collection):
+        monkeypatch.setattr(export, "get_summary_collection", lambda mongo_options=None: collection)
+        return export.export_incremental(checkpoint_path=path, shard_options={"compression": "none"})[0]
+
+    run.path = path
+    return run
+
+
+@pytest.mark.parametrize("make_id", [lambda n: ObjectId(), lambda n: f"order-{n:05d}", lambda n: n],
+                         ids=["objectid", "string", "int"])
+def test_runs_continue_after_the_typed_high_water_mark(incremental, make_id):
+    ids = [make_id(n) for n in range(200)]
+
+    assert incremental(IdCollection(ids[:120])) == 120
+    assert incremental(IdCollection(ids)) == 80
+    assert incremental(IdCollection(ids)) == 0
+
+    checkpoint = ExportCheckpoint(incremental.path)
+    assert checkpoint.high_water_mark == ids[-1]
+    assert type(checkpoint.high_water_mark) is type(ids[-1])
+
+
+def test_mixed_id_types_are_refused(incremental, bucket):
+    ids = [ObjectId() for _ in range(10)] + ["legacy-1"]
+
+    with pytest.raises(RuntimeError, match="_ids of one type"):
+        incremental(IdCollection(ids))
+    assert bucket.objects == {}
+
+
+def test_high_water_mark_of_another_type_is_refused(incremental):
+    incremental(IdCollection([ObjectId() for _ in range(10)]))
+
+    with pytest.raises(RuntimeError, match="high-water mark ObjectId"):
+        incremental(IdCollection([f"order-{n}" for n in range(10)]))
+
+
+def test_checkpoint_of_hex_strings_is_read_as_object_ids(tmp_path):
+    hwm, end, last = ObjectId(), ObjectId(), ObjectId()
+    path = tmp_path / "summary_checkpoint.json"
+    path.write_text(json.dumps({
+        "high_water_mark": str(hwm),
+        "run": {"run_id": "20200401T000000", "start_after": str(hwm), "end": str(end),
+                "shards": {"0": {"blob": "summary_00000.jsonl", "last_id": str(last), "docs": 5}}},
+    }))
+
+    checkpoint = ExportCheckpoint(str(path))
+
+    assert checkpoint.high_water_mark == hwm
+    assert checkpoint.run["end"] == end
+    assert checkpoint.resume_point() == (1, last)
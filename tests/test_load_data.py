@@ -0,0 +1,128 @@
+import datetime
+import types
+
+import pytest
+from google.cloud import bigquery
+
+from project6 import load_data
+from project6.manifest import DayManifests, shard_entry
+
+from fakes import FakeBucket
+
+DAY = datetime.date(2020, 4, 1)
+PREFIX = "summary/run"
+MANIFEST_URI = f"gs://twan_glamira/{PREFIX}/dt=2020-04-01/_manifest.json"
+
+
+class StubJob:
+    def __init__(self, output_rows=None):
+        self.output_rows = output_rows
+
+    def result(self):
+        return self
+
+
+class StubBigQuery:
+    """Just the calls load_from_manifest makes; loads count the lines of FakeBucket objects."""
+
+    def __init__(self, bucket, extra_rows=0):
+        self.bucket = bucket
+        self.extra_rows = extra_rows
+        self.tables = {}
+        self.loads = []
+        self.copies = []
+
+    def get_table(self, table_ref):
+        return types.SimpleNamespace(
+            schema=[bigquery.SchemaField("event_date", "DATE")],
+            time_partitioning=bigquery.TimePartitioning(field="event_date"),
+            clustering_fields=["collection"],
+        )
+
+    def create_table(self, table):
+        self.tables[f"{table.project}.{table.dataset_id}.{table.table_id}"] = table
+
+    def delete_table(self, table_ref, not_found_ok=False):
+        self.tables.pop(table_ref, None)
+
+    def load_table_from_uri(self, uris, table_ref, job_config=None):
+        names = [uri.removeprefix("gs://twan_glamira/") for uri in uris]
+        self.loads.append((names, table_ref))
+        return StubJob(sum(self.bucket.data[name].count(b"\n") for name in names) + self.extra_rows)
+
+    def copy_table(self, source, destination, job_config=None):
+        self.copies.append((source, destination, job_config.write_disposition))
+        return StubJob()
+
+
+class StubStorage:
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def bucket(self, name):
+        return self._bucket
+
+    def list_blobs(self, bucket_name, prefix=""):
+        return self._bucket.list_blobs(prefix=prefix)
+
+
+@pytest.fixture
+def bucket():
+    """FakeBucket holding two shards of DAY and its manifest."""
+    bucket = FakeBucket()
+    manifests = DayManifests(bucket, PREFIX, replace=True)
+    for n, rows in enumerate([3, 5]):
+        blob = bucket.blob(f"{PREFIX}/dt=2020-04-01/summary_{n:05d}.jsonl")
+        blob.upload_from_string(b'{"a": 1}\n' * rows)
+        manifests.add(shard_entry(blob, DAY, rows))
+    manifests.commit()
+    return bucket
+
+
+def load(bucket, client):
+    return load_data.load_from_manifest(
+        "project", "dataset", "summary$20200401", MANIFEST_URI, schema=[],
+        client=client, storage_client=StubStorage(bucket),
+    )
+
+
+def test_shards_are_loaded_into_staging_and_copied_into_the_partition(bucket):
+    client = StubBigQuery(bucket)
+
+    assert load(bucket, client) == 8
+
+    (names, staging_ref), = client.loads
+    assert names == [f"{PREFIX}/dt=2020-04-01/summary_00000.jsonl", f"{PREFIX}/dt=2020-04-01/summary_00001.jsonl"]
+    assert staging_ref == "project.dataset.summary__staging_20200401$20200401"
+    assert client.copies == [(staging_ref, "project.dataset.summary$20200401",
+                              bigquery.WriteDisposition.WRITE_TRUNCATE)]
+    # Dropped after the copy
+    assert client.tables == {}
+
+
+def test_row_count_mismatch_is_not_copied(bucket):
+    client = StubBigQuery(bucket, extra_rows=1)
+
+    with pytest.raises(ValueError, match="loaded 9 rows, manifest lists 8"):
+        load(bucket, client)
+
+    assert len(client.loads) == 1 and client.copies == []
+    # Kept for a look, until it expires
+    staging = client.tables["project.dataset.summary__staging_20200401"]
+    assert staging.time_partitioning.field == "event_date" and staging.expires is not None
+
+
+@pytest.mark.parametrize("change", ["rewritten", "missing"])
+def test_shards_changed_since_the_export_are_refused(bucket, change):
+    blob = bucket.blob(f"{PREFIX}/dt=2020-04-01/summary_00001.jsonl")
+    if change == "rewritten":
+        # Same size, other bytes: only the CRC32C tells
+        blob.upload_from_string(b'{"a": 2}\n' * 5)
+    else:
+        blob.delete()
+    client = StubBigQuery(bucket)
+
+    with pytest.raises(ValueError, match=f"summary_00001.jsonl {'is missing' if change == 'missing' else 'changed'}"):
+        load(bucket, client)
+
+    assert client.loads == [] and client.copies == [] and client.tables == {}
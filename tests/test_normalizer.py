@@ -0,0 +1,56 @@
+import bson
+import pytest
+from bson.raw_bson import RawBSONDocument
+
+from project6 import export
+from project6.benchmark import sample_docs, synthetic_docs
+from project6.metrics import METRICS
+
+# Out of INT64 range; BSON can't hold the last one, so raw docs get the others
+TOO_BIG = [str(2 ** 63), 1e30, -(2 ** 63) - 1]
+
+
+@pytest.fixture(autouse=True)
+def metrics():
+    METRICS.reset()
+
+
+def varied_docs():
+    """Synthetic docs, some with out-of-range ints and sub-documents in STRING fields."""
+    docs = sample_docs() + list(synthetic_docs(3000, seed=5, dirty=0.2))
+    for n, doc in enumerate(docs[::50]):
+        value = TOO_BIG[n % len(TOO_BIG)]
+        doc["recommendation_clicked_position"] = value
+        doc["cart_products"] = [{"product_id": value, "amount": 2 ** 63 - 1, "price": "12.5",
+                                 "option": [{"option_id": value}, "not an option", {"raw": {"nested": 1}}]},
+                                {"option": {"option_id": "7"}}]
+    return docs
+
+
+def total_failures():
+    return sum(METRICS.snapshot()["cast_failures"].values())
+
+
+def test_compiled_normalizer_matches_normalize_doc():
+    normalize = export.compile_normalizer(export.summary_schema)
+    docs = varied_docs()
+
+    expected = [export.normalize_doc(doc, export.summary_schema) for doc in docs]
+    failures = total_failures()
+    METRICS.reset()
+
+    assert [normalize(doc) for doc in docs] == expected
+    assert failures > 0 and total_failures() == failures
+
+
+def test_compiled_normalizer_reads_raw_bson_like_decoded_docs():
+    normalize = export.compile_normalizer(export.summary_schema)
+    docs = [doc for doc in varied_docs() if doc.get("recommendation_clicked_position") not in TOO_BIG[2:]]
+    encoded = [bson.encode(doc) for doc in docs]
+
+    expected = [export.normalize_doc(bson.decode(data), export.summary_schema) for data in encoded]
+    failures = total_failures()
+    METRICS.reset()
+
+    assert [normalize(RawBSONDocument(data)) for data in encoded] == expected
+    assert total_failures() == failures
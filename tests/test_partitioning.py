@@ -0,0 +1,74 @@
+import random
+
+import pytest
+from bson import ObjectId
+
+from project6 import export
+
+# Mongo's $type alias of each Python type used as an _id here
+TYPES = {ObjectId: "objectId", str: "string", int: "int"}
+
+
+def matches(query, value):
+    """Whether `_id` `value` matches `query`, as the server compares (type-bracketed)."""
+    if "$or" in query:
+        return any(matches(clause, value) for clause in query["$or"])
+    if "_id" not in query:
+        return True
+    return condition(query["_id"], value)
+
+
+def condition(cond, value):
+    for op, arg in cond.items():
+        if op == "$not":
+            ok = not condition(arg, value)
+        elif op == "$type":
+            ok = TYPES[type(value)] == arg
+        else:
+            # $gte and $lt only compare values of the same type
+            ok = type(value) is type(arg) and (value >= arg if op == "$gte" else value < arg)
+        if not ok:
+            return False
+    return True
+
+
+class IdCollection:
+    """Just the calls compute_split_points makes, over a list of `_id`s."""
+
+    def __init__(self, ids, sample=True):
+        self.ids = ids
+        self.sample = sample
+
+    def aggregate(self, pipeline):
+        size = pipeline[0]["$sample"]["size"]
+        ids = random.Random(0).sample(self.ids, min(size, len(self.ids))) if self.sample else []
+        return [{"_id": i} for i in ids]
+
+    def find_one(self, query, projection, sort):
+        found = sorted((i for i in self.ids if matches(query, i)), reverse=sort[0][1] < 0)
+        return {"_id": found[0]} if found else None
+
+
+def mixed_ids():
+    ids = [ObjectId() for _ in range(2000)]
+    ids += [f"legacy-{i}" for i in range(50)] + list(range(30))
+    random.Random(1).shuffle(ids)
+    return ids
+
+
+@pytest.mark.parametrize("sample", [True, False], ids=["sampled", "min_max"])
+def test_ranges_cover_ids_of_every_type_once(sample):
+    ids = mixed_ids()
+    ranges = export.partition_ranges(export.compute_split_points(IdCollection(ids, sample), 4))
+    assert len(ranges) == 4
+
+    queries = [export.range_query(lo, hi) for lo, hi in ranges]
+
+    for i in ids:
+        assert sum(matches(query, i) for query in queries) == 1, i
+    # The odd ones all go to the first range
+    assert all(matches(queries[0], i) for i in ids if not isinstance(i, ObjectId))
+
+
+def test_single_range_is_the_whole_collection():
+    assert export.range_query(None, None) == {}
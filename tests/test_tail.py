@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from project6 import export
+from project6.checkpoint import TailCheckpoint
+
+from fakes import FakeBucket, FakeChangeStream, FakeSummaryCollection
+
+
+class BrokenChangeStream(FakeChangeStream):
+    """Fails with `error`, or is invalidated, once `fail_at` events were handed out."""
+
+    def try_next(self):
+        col = self.collection
+        if col.fail_at is not None and self.position >= col.fail_at:
+            if col.error is None:
+                self.invalidated = True
+                return None
+            raise col.error
+        return super().try_next()
+
+
+class BrokenCollection(FakeSummaryCollection):
+    def __init__(self, n_docs, fail_at=None, error=None, lost_on_resume=False, **kwargs):
+        super().__init__(n_docs, **kwargs)
+        self.fail_at = fail_at
+        self.error = error
+        self.lost_on_resume = lost_on_resume
+
+    def watch(self, pipeline=None, resume_after=None, max_await_time_ms=1000, batch_size=None):
+        if self.lost_on_resume and resume_after is not None:
+            raise OperationFailure("Resume of change stream was not possible", code=286)
+        stream = BrokenChangeStream(self, resume_after, max_await_time_ms / 1000)
+        self.streams.append(stream)
+        return stream
+
+
+def position(token):
+    return int(token["_data"], 16) if token else 0
+
+
+@pytest.fixture
+def tail(export_dirs, monkeypatch):
+    """Run export_tail over a collection into a fresh FakeBucket; returns (result, bucket)."""
+    monkeypatch.setattr(export, "TAIL_AWAIT_MS", 100)
+    checkpoint_path = str(export_dirs / "summary_tail.json")
+
+    def run(collection, **tail_options):
+        stop = collection.stop = threading.Event()
+        bucket = FakeBucket()
+        monkeypatch.setattr(export, "get_summary_collection", lambda mongo_options=None: collection)
+        monkeypatch.setattr(export, "get_bucket", lambda: bucket)
+        result = export.export_tail(
+            checkpoint_path=checkpoint_path,
+            shard_options={"compression": "none"},
+            tail_options=tail_options,
+            stop=stop,
+        )
+        return result, bucket
+
+    run.checkpoint = lambda: TailCheckpoint(checkpoint_path)
+    return run
+
+
+def test_resumes_after_the_saved_token_of_an_interrupted_run(tail):
+    with pytest.raises(ConnectionError):
+        tail(BrokenCollection(3000, fail_at=2000, error=ConnectionError("connection reset")),
+             roll_bytes=50_000)
+    saved = position(tail.checkpoint().resume_token)
+    assert 0 < saved <= 2000
+
+    collection = BrokenCollection(3000, linger=0.2)
+    (docs, _, _), bucket = tail(collection, roll_bytes=50_000)
+
+    assert collection.streams[0].emitted and docs == 3000 - saved
+    assert sum(bucket.lines.values()) == docs
+    assert position(tail.checkpoint().resume_token) == 3000
+
+
+def test_rolls_a_shard_by_size(tail):
+    (docs, _, _), bucket = tail(BrokenCollection(2000, linger=0.2), roll_bytes=50_000)
+
+    assert docs == sum(bucket.lines.values()) == 2000
+    assert len(bucket.lines) > 3
+    # Every shard but the last is cut once its rows reach about roll_bytes
+    sizes = [bucket.objects[name] for name in sorted(bucket.lines)]
+    assert all(abs(size - 50_000) < 5_000 for size in sizes[:-1])
+
+
+def test_rolls_a_shard_by_age(tail):
+    # 1.5 seconds of events at 200 per second
+    (docs, _, _), bucket = tail(BrokenCollection(300, rate=200, linger=0.5),
+                                roll_bytes=1 << 30, roll_seconds=0.4)
+
+    assert docs == sum(bucket.lines.values()) == 300
+    assert len(bucket.lines) >= 3
+
+
+def test_invalidated_stream_ships_the_open_shard_and_fails(tail):
+    with pytest.raises(RuntimeError, match="invalidated"):
+        tail(BrokenCollection(1000, fail_at=700), roll_bytes=1 << 30)
+
+    # Nothing is lost: every event before the invalidate is uploaded and saved
+    assert position(tail.checkpoint().resume_token) == 700
+
+
+def test_history_lost_mid_stream_ships_the_open_shard_and_fails(tail):
+    lost = OperationFailure("Resume of change stream was not possible", code=286)
+
+    with pytest.raises(RuntimeError, match="oplog no longer holds it"):
+        tail(BrokenCollection(1000, fail_at=400, error=lost), roll_bytes=1 << 30)
+
+    assert position(tail.checkpoint().resume_token) == 400
+
+
+def test_resume_token_off_the_oplog_fails_at_start(tail):
+    tail(BrokenCollection(500, linger=0.2))
+    saved = tail.checkpoint().resume_token
+
+    with pytest.raises(RuntimeError, match="--incremental"):
+        tail(BrokenCollection(1000, lost_on_resume=True))
+
+    assert tail.checkpoint().resume_token == saved
+
+
+def test_other_operation_failures_are_raised_as_is(tail):
+    error = OperationFailure("not primary", code=10107)
+
+    with pytest.raises(OperationFailure):
+        tail(BrokenCollection(1000, fail_at=100, error=error))
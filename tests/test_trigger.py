@@ -0,0 +1,287 @@
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask, request
+from google.api_core.exceptions import Conflict, NotFound
+
+from project6 import trigger_bigquery_test_on_GCP as trigger
+
+app = Flask(__name__)
+
+
+class StubJob:
+    def __init__(self, job_id, uris, table_id, job_type="load", labels=None):
+        self.job_id = job_id
+        self.uris = uris
+        self.table_id = table_id
+        self.job_type = job_type
+        self.labels = labels or {}
+        self.state = "RUNNING"
+        self.error_result = None
+        self.output_rows = len(uris)
+        self.destination = None
+
+    def result(self):
+        self.state = "DONE"
+        return self
+
+
+class StubClient:
+    """BigQuery client that records load jobs; a job id can be used once, like BigQuery's."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.loads = []
+        self.fail_loads = False
+        self._lock = threading.Lock()
+
+    def get_table(self, table_id):
+        return types.SimpleNamespace(schema=[])
+
+    def load_table_from_uri(self, uris, table_id, job_id=None, job_config=None):
+        uris = [uris] if isinstance(uris, str) else list(uris)
+        with self._lock:
+            job_id = job_id or f"random_{len(self.loads)}"
+            if job_id in self.jobs:
+                raise Conflict(f"Already Exists: Job {job_id}")
+            job = self.jobs[job_id] = StubJob(job_id, uris, table_id)
+            self.loads.append(job)
+        if self.fail_loads:
+            job.state, job.error_result = "DONE", {"reason": "invalid"}
+        return job
+
+    def query(self, sql, job_id=None, job_config=None, location=None):
+        with self._lock:
+            if job_id in self.jobs:
+                raise Conflict(f"Already Exists: Job {job_id}")
+            job = self.jobs[job_id] = StubJob(job_id, [], None, "query", job_config.labels)
+        job.state = "DONE"
+        return job
+
+    def get_job(self, job_id, location=None):
+        if job_id not in self.jobs:
+            raise NotFound(f"Not found: Job {job_id}")
+        return self.jobs[job_id]
+
+    def loaded(self, table_name):
+        """URIs loaded into `table_name` (any partition), once per load."""
+        return sorted(uri for job in self.loads if f".{table_name}" in job.table_id for uri in job.uris)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    stub = StubClient()
+    monkeypatch.setattr(trigger, "_client", stub)
+    monkeypatch.setattr(trigger, "COALESCE_WINDOW_SECONDS", 0.3)
+    monkeypatch.setattr(trigger, "ASYNC_LOADS", False)
+    trigger.invalidate_schema()
+    yield stub
+    trigger.invalidate_schema()
+
+
+def event(name, generation="1", size=100):
+    return {"bucket": "twan_glamira", "name": name, "generation": generation, "size": str(size)}
+
+
+def post(body):
+    with app.test_request_context(method="POST", json=body):
+        response = trigger.trigger_bigquery_load(request)
+    status = 200
+    if isinstance(response, tuple):
+        response, status = response
+    return status, response.get_json() if hasattr(response, "get_json") else response
+
+
+def post_all(events):
+    """Deliver `events` concurrently, like Cloud Run with concurrency > 1."""
+    with ThreadPoolExecutor(max_workers=len(events)) as pool:
+        return list(pool.map(post, events))
+
+
+def shards(n, day="2020-04-01"):
+    return [event(f"dataset_export/summary/dt={day}/summary_{i:05d}.jsonl.gz") for i in range(n)]
+
+
+def test_batch_job_id_ignores_order():
+    objects = [("b", f"summary_{i:05d}.jsonl.gz", "7") for i in range(3)]
+
+    assert trigger.batch_job_id(objects) == trigger.batch_job_id(objects[::-1])
+    assert trigger.batch_job_id(objects) != trigger.batch_job_id(objects[:2])
+    assert trigger.batch_job_id(objects[:1]) == trigger.load_job_id(*objects[0])
+    assert trigger.batch_job_id(objects + [("b", "x.jsonl", None)]) is None
+
+
+def test_redelivered_batch_reuses_its_job(client):
+    events = shards(3)
+
+    first = post_all(events)
+    again = post_all(events[::-1])
+
+    assert len(client.loads) == 1
+    assert {status for status, _ in first + again} == {200}
+    assert {body["job_id"] for _, body in first + again} == {client.loads[0].job_id}
+    assert len(client.loaded("glamira_raw")) == 3
+
+
+def test_async_batch_answers_once_submitted(client, monkeypatch):
+    monkeypatch.setattr(trigger, "ASYNC_LOADS", True)
+
+    responses = post_all(shards(2))
+
+    assert [status for status, _ in responses] == [202, 202]
+    job = client.loads[0]
+    assert {body["job_id"] for _, body in responses} == {job.job_id}
+    assert job.job_id.startswith("gcs_batch_")
+    # Not waited for
+    assert job.state == "RUNNING"
+
+
+def test_batch_flushes_when_the_window_ends(client):
+    started = time.perf_counter()
+    responses = post_all(shards(3))
+
+    assert time.perf_counter() - started >= trigger.COALESCE_WINDOW_SECONDS
+    assert len(client.loads) == 1
+    assert [body["rows_loaded"] for _, body in responses] == [3, 3, 3]
+    assert {len(body["files"]) for _, body in responses} == {3}
+
+
+def test_lone_event_is_loaded_after_the_window(client):
+    status, body = post(shards(1)[0])
+
+    assert status == 200
+    assert body["files"] == [client.loads[0].uris[0]]
+    # One object: the same job id as without batching
+    assert body["job_id"] == trigger.load_job_id(
+        "twan_glamira", "dataset_export/summary/dt=2020-04-01/summary_00000.jsonl.gz", "1")
+
+
+def test_batch_flushes_early_at_the_file_limit(client, monkeypatch):
+    monkeypatch.setattr(trigger, "COALESCE_WINDOW_SECONDS", 30)
+    monkeypatch.setattr(trigger, "COALESCE_MAX_FILES", 2)
+
+    started = time.perf_counter()
+    responses = post_all(shards(2))
+
+    assert time.perf_counter() - started < 5
+    assert len(client.loads) == 1
+    assert {len(body["files"]) for _, body in responses} == {2}
+
+
+def test_batch_flushes_early_at_the_byte_limit(client, monkeypatch):
+    monkeypatch.setattr(trigger, "COALESCE_WINDOW_SECONDS", 30)
+    monkeypatch.setattr(trigger, "COALESCE_MAX_BYTES", 1000)
+
+    started = time.perf_counter()
+    status, body = post(event("dataset_export/summary/dt=2020-04-01/summary_00000.jsonl.gz", size=5000))
+
+    assert time.perf_counter() - started < 5
+    assert status == 200 and len(client.loads) == 1
+
+
+def test_batches_are_kept_per_table_and_partition(client):
+    events = shards(2) + shards(1, day="2020-04-02") + [
+        event("dataset_export/product_ids_to_crawl.jsonl"),
+        event("dataset_export/ip_location_results.jsonl"),
+    ]
+
+    responses = post_all(events)
+
+    assert {status for status, _ in responses} == {200}
+    tables = sorted((job.table_id.split(".")[-1], len(job.uris)) for job in client.loads)
+    assert tables == [
+        ("glamira_raw$20200401", 2),
+        ("glamira_raw$20200402", 1),
+        ("ip_locations", 1),
+        ("product_ids_to_crawl", 1),
+    ]
+
+
+def test_redelivered_event_is_not_loaded_twice(client):
+    events = shards(1)
+
+    post_all(events)
+    status, body = post(events[0])
+
+    assert status == 200
+    assert len(client.loads) == 1
+    assert body["job_id"] == client.loads[0].job_id
+
+
+def test_redelivered_event_with_a_new_companion_is_not_loaded_twice(client):
+    first, second = shards(2)
+    post_all([first, event("dataset_export/summary/dt=2020-04-01/summary_00009.jsonl.gz")])
+
+    responses = post_all([first, second])
+
+    assert {status for status, _ in responses} == {200}
+    # Each object is loaded by exactly one job
+    assert client.loaded("glamira_raw") == sorted(
+        f"gs://twan_glamira/dataset_export/summary/dt=2020-04-01/summary_{i:05d}.jsonl.gz" for i in (0, 1, 9))
+    first_body, second_body = (body for _, body in responses)
+    assert first_body["job_id"] == client.loads[0].job_id
+    assert second_body["job_id"] == client.loads[1].job_id
+    assert second_body["files"] == [client.loads[1].uris[0]]
+
+
+def test_redelivered_event_alone_finds_its_batch_job(client):
+    events = shards(2)
+    post_all(events)
+
+    status, body = post(events[0])
+
+    assert status == 200
+    assert len(client.loads) == 1
+    assert body["job_id"] == client.loads[0].job_id
+
+
+def test_event_of_a_failed_batch_is_loaded_again(client):
+    events = shards(2)
+    client.fail_loads = True
+    post_all(events)
+    client.fail_loads = False
+
+    status, body = post(events[0])
+
+    assert status == 200
+    assert len(client.loads) == 2
+    assert client.loads[1].uris == [body["files"][0]]
+    assert body["job_id"] == client.loads[1].job_id
+
+
+def test_new_generation_is_loaded_again(client):
+    post(event("dataset_export/summary/dt=2020-04-01/summary_00000.jsonl.gz", generation="1"))
+    post(event("dataset_export/summary/dt=2020-04-01/summary_00000.jsonl.gz", generation="2"))
+
+    assert len(client.loads) == 2
+
+
+def test_status_of_an_unknown_job_is_404(client):
+    with app.test_request_context(method="GET", query_string={"job_id": "gcs_load_missing"}):
+        response = trigger.trigger_bigquery_load(request)
+
+    assert response[1] == 404
+
+
+def test_status_of_a_job(client):
+    post(shards(1)[0])
+    job = client.loads[0]
+
+    with app.test_request_context(method="GET", query_string={"job_id": job.job_id}):
+        response = trigger.trigger_bigquery_load(request)
+
+    assert response.get_json()["state"] == "DONE"
+
+
+def test_failed_batch_fails_every_request(client, monkeypatch):
+    def failing_load(*args, **kwargs):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(client, "load_table_from_uri", failing_load)
+
+    responses = post_all(shards(2))
+
+    assert [status for status, _ in responses] == [500, 500]
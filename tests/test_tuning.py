@@ -0,0 +1,122 @@
+import pytest
+
+from project6 import tuning
+from project6.metrics import METRICS
+from project6.tuning import AdaptiveTuner
+
+WINDOW = 5.0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeQueue:
+    def __init__(self):
+        self.limits = []
+
+    def set_max_in_flight(self, n):
+        self.limits.append(n)
+
+
+@pytest.fixture
+def clock():
+    METRICS.reset()
+    return FakeClock()
+
+
+def tuner(clock, batch_size=1000, batch_bounds=(1000, 100000), uploads=2, upload_bounds=(2, 32)):
+    tuner = AdaptiveTuner(batch_size, batch_bounds, uploads, upload_bounds, window=WINDOW, clock=clock)
+    tuner.queue_limits = FakeQueue()
+    tuner.attach(tuner.queue_limits)
+    return tuner
+
+
+def window(tuner, clock, fetched=None, upload_wait=0.0, exported=0):
+    """One TUNE_WINDOW: `fetched` is (docs, seconds) of Mongo round trips."""
+    if fetched is not None:
+        tuner.fetched(*fetched)
+    METRICS.record("upload_wait", upload_wait)
+    METRICS.record("normalize", 0.0, exported)
+    clock.now += WINDOW
+    tuner.tick()
+
+
+def test_no_decision_before_a_window_has_passed(clock):
+    t = tuner(clock)
+    t.fetched(1000, 4.0)
+    clock.now += WINDOW / 2
+
+    t.tick()
+
+    assert t.decisions == []
+
+
+def test_slow_source_grows_the_batch_then_shrinks_it_once_fast(clock):
+    t = tuner(clock)
+
+    # Half of each window waits on Mongo, and bigger batches fetch faster
+    window(t, clock, fetched=(1000, 2.5))
+    window(t, clock, fetched=(4000, 2.5))
+    assert t.batch_size == 4000
+
+    # The source stops being the bottleneck (10% of the window)
+    for _ in range(tuning.IDLE_WINDOWS):
+        window(t, clock, fetched=(4000, 0.5))
+    assert t.batch_size == 2000
+    # Halving cost nothing: kept
+    window(t, clock, fetched=(4000, 0.5))
+    assert t.batch_size == 2000
+
+    assert [(d["from"], d["to"]) for d in t.decisions] == [(1000, 2000), (2000, 4000), (4000, 2000)]
+    assert "shrinking" in t.decisions[-1]["why"]
+    # The sink never was the bottleneck
+    assert t.queue_limits.limits == [2]
+
+
+def test_slow_sink_grows_uploads_reverts_a_useless_step_then_shrinks(clock):
+    t = tuner(clock, uploads=4)
+
+    # Half of each window blocked on uploads
+    window(t, clock, upload_wait=2.5, exported=5000)
+    window(t, clock, upload_wait=2.5, exported=8000)
+    # 8 uploads export barely more than 6: reverted and held
+    window(t, clock, exported=8100)
+    assert t.queue_limits.limits == [4, 6, 8, 6]
+
+    for _ in range(tuning.HOLD_WINDOWS):
+        window(t, clock, exported=8000)
+    assert t.queue_limits.limits == [4, 6, 8, 6]
+    window(t, clock, exported=8000)
+    window(t, clock, exported=8000)
+
+    assert t.queue_limits.limits == [4, 6, 8, 6, 4]
+    assert t.values() == {"batch_size": 1000, "upload_concurrency": 4}
+
+
+def test_shrink_that_costs_throughput_is_reverted(clock):
+    t = tuner(clock, uploads=8)
+
+    for _ in range(tuning.IDLE_WINDOWS):
+        window(t, clock, exported=8000)
+    assert t.queue_limits.limits == [8, 6]
+    window(t, clock, exported=5000)
+
+    assert t.queue_limits.limits == [8, 6, 8]
+    assert "reverting" in t.decisions[-1]["why"]
+    # Held: no new shrink right away
+    for _ in range(tuning.IDLE_WINDOWS):
+        window(t, clock, exported=8000)
+    assert t.queue_limits.limits == [8, 6, 8]
+
+
+def test_knobs_stay_within_bounds(clock):
+    t = tuner(clock, batch_size=64000, batch_bounds=(1000, 100000), uploads=2, upload_bounds=(2, 4))
+
+    window(t, clock, fetched=(64000, 2.5), upload_wait=2.5, exported=1000)
+
+    assert t.values() == {"batch_size": 100000, "upload_concurrency": 4}